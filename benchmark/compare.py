@@ -0,0 +1,78 @@
+"""Compare benchmark results written by run.py.
+
+python benchmark/compare.py before.json after.json
+"""
+
+import argparse
+import json
+
+# Metric name, how to get it from the scenario summary, unit scale and unit
+METRICS = [
+    ("req/s", lambda summary: summary["rps"], 1, ""),
+    ("p50", lambda summary: summary["latency"]["p50"], 1000, "ms"),
+    ("p90", lambda summary: summary["latency"]["p90"], 1000, "ms"),
+    ("p99", lambda summary: summary["latency"]["p99"], 1000, "ms"),
+    ("MiB/s", lambda summary: summary["throughput"], 1 / 2**20, ""),
+    ("cpu", lambda summary: summary["cpu_percent"], 1, "%"),
+    ("rss peak", lambda summary: summary["rss_peak"], 1 / 2**20, "MiB"),
+    ("errors", lambda summary: sum(summary["errors"].values()), 1, ""),
+]
+
+
+def change(before: float | None, after: float | None) -> str:
+    if before is None or after is None:
+        return ""
+    if before == 0:
+        return "" if after == 0 else "new"
+    return f"{100 * (after - before) / before:+.1f} %"
+
+
+def compare(before: dict, after: dict) -> list[tuple[str, str, str, str, str]]:
+    """Get the table rows of the scenarios present in both results."""
+
+    rows = []
+    for name, summary in after["scenarios"].items():
+        if name not in before["scenarios"]:
+            continue
+        label = name
+        for metric, get, scale, unit in METRICS:
+            old, new = get(before["scenarios"][name]), get(summary)
+            rows.append(
+                (
+                    label,
+                    metric,
+                    f"{old * scale:.1f} {unit}" if old is not None else "-",
+                    f"{new * scale:.1f} {unit}" if new is not None else "-",
+                    change(old, new),
+                )
+            )
+            label = ""
+
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("before", help="Baseline results.")
+    parser.add_argument("after", help="Results to compare with the baseline.")
+    args = parser.parse_args()
+
+    with open(args.before) as file:
+        before = json.load(file)
+    with open(args.after) as file:
+        after = json.load(file)
+
+    header = (
+        "scenario",
+        "metric",
+        before["label"] or "before",
+        after["label"] or "after",
+    )
+    rows = [header + ("change",)] + compare(before, after)
+    widths = [max(len(row[column]) for row in rows) for column in range(len(header) + 1)]
+    for row in rows:
+        print("  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip())
+
+
+if __name__ == "__main__":
+    main()
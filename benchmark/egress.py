@@ -0,0 +1,198 @@
+"""Stand-in outbound proxy for trying the egress proxy pool locally.
+
+Forwards plain HTTP requests in the absolute form and tunnels CONNECT requests, like
+a regular forward proxy. It can add latency and fail a share of the requests with
+502, so the health scoring and ejection of the pool can be watched. A request for
+`/stats` on the proxy itself returns the number of the forwarded and failed requests.
+"""
+
+import argparse
+import json
+import random
+import select
+import socket
+import time
+from collections import Counter
+from http.client import HTTPConnection
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from urllib.parse import urlparse
+
+HOP_HEADERS = {
+    "connection",
+    "keep-alive",
+    "proxy-authorization",
+    "proxy-connection",
+    "te",
+    "trailer",
+    "transfer-encoding",
+    "upgrade",
+}
+
+
+class EgressProxy(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], delay: int = 0, fail_rate: float = 0):
+        """Initialize the proxy server.
+
+        Args:
+            address (tuple[str, int]): The address to listen on.
+            delay (int, optional): Milliseconds added to every forwarded request.
+            fail_rate (float, optional): Share of the requests answered with 502.
+        """
+
+        super().__init__(address, EgressProxyHandler)
+        self.delay = delay
+        self.fail_rate = fail_rate
+        self.counts = Counter()
+        self._lock = Lock()
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            self.counts[name] += 1
+
+
+class EgressProxyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_CONNECT(self):
+        if not self.admit():
+            return
+        host, _, port = self.path.rpartition(":")
+        try:
+            upstream = socket.create_connection((host, int(port)), timeout=30)
+        except OSError:
+            self.fail()
+            return
+        self.send_response(200, "Connection established")
+        self.end_headers()
+        sockets = [self.connection, upstream]
+        try:
+            while True:
+                readable, _, _ = select.select(sockets, [], [], 30)
+                if not readable:
+                    break
+                for sock in readable:
+                    data = sock.recv(65536)
+                    if not data:
+                        return
+                    (upstream if sock is self.connection else self.connection).sendall(
+                        data
+                    )
+        finally:
+            upstream.close()
+            self.close_connection = True
+
+    def forward(self):
+        url = urlparse(self.path)
+        if not url.netloc:
+            if url.path == "/stats":
+                with self.server._lock:
+                    body = json.dumps(self.server.counts).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            else:
+                self.send_error(400, "Only absolute urls are proxied.")
+            return
+        if not self.admit():
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length else None
+        headers = {
+            name: value
+            for name, value in self.headers.items()
+            if name.lower() not in HOP_HEADERS
+        }
+        connection = HTTPConnection(url.hostname, url.port or 80, timeout=30)
+        try:
+            path = url.path or "/"
+            if url.query:
+                path += f"?{url.query}"
+            connection.request(self.command, path, body, headers)
+            response = connection.getresponse()
+            content = response.read()
+        except OSError:
+            self.fail()
+            return
+        finally:
+            connection.close()
+
+        # The upstream Server and Date headers are kept, Cloudflare is told by them
+        self.send_response_only(response.status, response.reason)
+        for name, value in response.getheaders():
+            if name.lower() not in HOP_HEADERS and name.lower() != "content-length":
+                self.send_header(name, value)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(content)
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_PATCH = do_HEAD = forward
+
+    def admit(self) -> bool:
+        """Count the request, delay it and decide whether it fails."""
+
+        if self.server.delay:
+            time.sleep(self.server.delay / 1000)
+        if random.random() < self.server.fail_rate:
+            self.fail()
+            return False
+        self.server.count("forwarded")
+        return True
+
+    def fail(self) -> None:
+        self.server.count("failed")
+        self.send_error(502, "Bad gateway")
+
+
+def serve(
+    host: str = "127.0.0.1", port: int = 0, delay: int = 0, fail_rate: float = 0
+) -> EgressProxy:
+    """Start the proxy server in a background thread.
+
+    Returns:
+        EgressProxy: The running server, `server_address` tells the bound port.
+    """
+
+    proxy = EgressProxy((host, port), delay, fail_rate)
+    Thread(target=proxy.serve_forever, daemon=True).start()
+    return proxy
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=3128)
+    parser.add_argument(
+        "--delay",
+        type=int,
+        default=0,
+        help="Milliseconds added to every forwarded request.",
+    )
+    parser.add_argument(
+        "--fail-rate",
+        type=float,
+        default=0,
+        help="Share of the requests answered with 502.",
+    )
+    args = parser.parse_args()
+
+    proxy = EgressProxy((args.host, args.port), args.delay, args.fail_rate)
+    print(f"Proxying on http://{args.host}:{proxy.server_address[1]}", flush=True)
+    try:
+        proxy.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+"""Fake Cloudflare-fronted origin server for benchmarking the proxy locally.
+
+Routes, all taking an optional `delay` in milliseconds to simulate a slow origin:
+
+* `/plain?size=1024` - plain text body with a Content-Length.
+* `/gzip?size=1024` - gzip encoded body.
+* `/chunked?size=1024&chunk=4096` - body sent with chunked transfer encoding.
+* `/large?size=10485760` - large body written in 64 KiB pieces.
+* `/challenge/<anything>` - the page behind a Cloudflare IUAM challenge. Without a
+  valid `cf_clearance` cookie a version 1 challenge is served, which cloudscraper
+  solves with its native interpreter. Submitting the answer sets the cookie and
+  redirects back to the page.
+* `/stats` - number of the served responses and challenges.
+"""
+
+import argparse
+import gzip
+import json
+import secrets
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from http.cookies import SimpleCookie
+from threading import Lock, Thread
+from urllib.parse import parse_qs, urlparse
+
+PIECE = 64 * 1024
+# The challenge answer is ((2 + "1") + 11).toFixed(10)
+CHALLENGE_ANSWER = "32.0000000000"
+CHALLENGE_PAGE = """<!DOCTYPE HTML>
+<html lang="en-US">
+<head>
+  <title>Just a moment...</title>
+  <script type="text/javascript">
+  //<![CDATA[
+  (function(){{
+    var a = function() {{try{{return !!window.addEventListener}} catch(e) {{return !1}} }},
+    b = function(b, c) {{a() ? document.addEventListener("DOMContentLoaded", b, c) : document.attachEvent("onreadystatechange", b)}};
+    b(function(){{
+      var a = document.getElementById('cf-content');a.style.display = 'block';
+      setTimeout(function(){{
+        var s,t,o,p,b,r,e,a,k,i,n,g,f, bmOvXRf={{"wgTtp":+((!+[]+!![]+[])+(!+[]))}};
+        g = String.fromCharCode;
+        t = document.createElement('div');
+        t.innerHTML="<a href='/'>x</a>";
+        t = t.firstChild.href;r = t.match(/https?:\\/\\//)[0];
+        t = t.substr(r.length); t = t.substr(0,t.length-1);
+        a = document.getElementById('jschl-answer');
+        f = document.getElementById('challenge-form');
+        ;bmOvXRf.wgTtp+=+((!+[]+[])+(!+[]));a.value = (+bmOvXRf.wgTtp).toFixed(10); '; 121'
+        f.action += location.hash;
+        f.submit();
+      }}, {delay});
+    }}, false);
+  }})();
+  //]]>
+  </script>
+</head>
+<body>
+  <div id="cf-content" style="display:none">
+    <img src="/cdn-cgi/images/trace/jsch/js/transparent.gif?ray=0" />
+  </div>
+  <form class="challenge-form" id="challenge-form" action="{path}?__cf_chl_f_tk={token}" method="POST" enctype="application/x-www-form-urlencoded">
+    <input type="hidden" name="r" value="{token}"/>
+    <input type="hidden" name="jschl_vc" value="{vc}"/>
+    <input type="hidden" name="pass" value="{password}"/>
+    <input type="hidden" id="jschl-answer" name="jschl_answer"/>
+  </form>
+</body>
+</html>
+"""
+
+
+class Origin(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: tuple[str, int],
+        clearance_ttl: int = 1800,
+        challenge_delay: int = 0,
+    ):
+        """Initialize the origin server.
+
+        Args:
+            address (tuple[str, int]): The address to listen on.
+            clearance_ttl (int, optional): Seconds the issued cf_clearance is valid for.
+            challenge_delay (int, optional): Milliseconds the challenge page asks the
+                client to wait before submitting the answer.
+        """
+
+        super().__init__(address, OriginHandler)
+        self.clearance_ttl = clearance_ttl
+        self.challenge_delay = challenge_delay
+        self.counts = Counter()
+        self._clearances = {}
+        self._lock = Lock()
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            self.counts[name] += 1
+
+    def issue_clearance(self) -> str:
+        """Issue a new cf_clearance value."""
+
+        clearance = secrets.token_urlsafe(32)
+        with self._lock:
+            self._clearances[clearance] = time.time() + self.clearance_ttl
+        return clearance
+
+    def cleared(self, clearance: str | None) -> bool:
+        """Check whether the cf_clearance value was issued and is still valid."""
+
+        with self._lock:
+            return self._clearances.get(clearance, 0) > time.time()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counts, clearances=len(self._clearances))
+
+
+class OriginHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, don't let them wait for delayed ACKs
+    disable_nagle_algorithm = True
+
+    def version_string(self):
+        return "cloudflare"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        delay = int(params.get("delay", 0))
+        if delay:
+            time.sleep(delay / 1000)
+        size = int(params.get("size", 1024))
+        route = url.path.split("/")[1]
+        self.server.count(route or "root")
+
+        if route == "plain":
+            self.send_body(body(size), "text/plain")
+        elif route == "gzip":
+            self.send_body(gzip.compress(body(size), 1), "text/plain", encoding="gzip")
+        elif route == "chunked":
+            self.send_chunked(body(size), int(params.get("chunk", 4096)))
+        elif route == "large":
+            self.send_large(size)
+        elif route == "challenge":
+            if self.server.cleared(self.cookie("cf_clearance")):
+                self.send_body(body(size), "text/html")
+            else:
+                self.server.count("challenges")
+                self.send_challenge(url.path)
+        elif route == "stats":
+            self.send_body(json.dumps(self.server.stats()).encode(), "application/json")
+        else:
+            self.send_body(b"Not found", "text/plain", status=404)
+
+    def do_HEAD(self):
+        self.send_body(b"", "text/plain")
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        length = int(self.headers.get("Content-Length", 0))
+        form = parse_qs(self.rfile.read(length).decode())
+        route = url.path.split("/")[1]
+        if route != "challenge" or "__cf_chl_f_tk" not in url.query:
+            self.server.count(route or "root")
+            self.send_body(b"OK", "text/plain")
+            return
+        if form.get("jschl_answer", [None])[0] != CHALLENGE_ANSWER:
+            self.server.count("challenges_failed")
+            self.send_body(b"Invalid challenge answer", "text/plain", status=400)
+            return
+
+        self.server.count("challenges_solved")
+        self.send_response(302)
+        self.send_header("Location", url.path)
+        self.send_header(
+            "Set-Cookie",
+            f"cf_clearance={self.server.issue_clearance()}; Path=/; "
+            f"Max-Age={self.server.clearance_ttl}; HttpOnly",
+        )
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def cookie(self, name: str) -> str | None:
+        morsel = SimpleCookie(self.headers.get("Cookie", "")).get(name)
+        return morsel.value if morsel is not None else None
+
+    def send_body(
+        self, content: bytes, content_type: str, status: int = 200, encoding: str = None
+    ) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        if encoding is not None:
+            self.send_header("Content-Encoding", encoding)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(content)
+
+    def send_chunked(self, content: bytes, chunk: int) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for start in range(0, len(content), chunk):
+            piece = content[start : start + chunk]
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(piece), piece))
+        self.wfile.write(b"0\r\n\r\n")
+
+    def send_large(self, size: int) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(size))
+        self.end_headers()
+        piece = body(PIECE)
+        for start in range(0, size, PIECE):
+            self.wfile.write(piece[: min(PIECE, size - start)])
+
+    def send_challenge(self, path: str) -> None:
+        token = secrets.token_hex(16)
+        page = CHALLENGE_PAGE.format(
+            path=path,
+            token=token,
+            vc=secrets.token_hex(16),
+            password=f"{time.time():.3f}-{secrets.token_hex(5)}",
+            delay=self.server.challenge_delay,
+        )
+        self.send_body(page.encode(), "text/html; charset=UTF-8", status=503)
+
+
+def body(size: int) -> bytes:
+    """Get a compressible body of the size."""
+
+    line = b"The quick brown fox jumps over the lazy dog.\n"
+    return (line * (size // len(line) + 1))[:size]
+
+
+def serve(
+    host: str = "127.0.0.1",
+    port: int = 0,
+    clearance_ttl: int = 1800,
+    challenge_delay: int = 0,
+) -> Origin:
+    """Start the origin server in a background thread.
+
+    Returns:
+        Origin: The running server, `server_address` tells the bound port.
+    """
+
+    origin = Origin((host, port), clearance_ttl, challenge_delay)
+    Thread(target=origin.serve_forever, daemon=True).start()
+    return origin
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument(
+        "--clearance-ttl",
+        type=int,
+        default=1800,
+        help="Seconds the issued cf_clearance is valid for.",
+    )
+    parser.add_argument(
+        "--challenge-delay",
+        type=int,
+        default=0,
+        help="Milliseconds the client waits before submitting the challenge answer.",
+    )
+    args = parser.parse_args()
+
+    origin = Origin((args.host, args.port), args.clearance_ttl, args.challenge_delay)
+    print(f"Serving on http://{args.host}:{origin.server_address[1]}", flush=True)
+    try:
+        origin.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
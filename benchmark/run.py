@@ -0,0 +1,674 @@
+"""Load test the proxy against the local fake Cloudflare origin.
+
+Starts the origin and the service, drives every scenario with the configured
+concurrency and writes the throughput, latency percentiles, RSS and CPU of the
+service processes as JSON, so runs can be compared with compare.py.
+
+    python benchmark/run.py --concurrency 16 --duration 20
+    python benchmark/run.py --scenarios cached_agent,batch --output before.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from itertools import count
+from threading import Event, Lock, Thread
+
+import requests
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVICE_DIR = os.path.join(os.path.dirname(BENCHMARK_DIR), "service")
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+class Context:
+    def __init__(self, service: str, origin: str, args: argparse.Namespace):
+        """Initialize the benchmark context shared by the scenarios.
+
+        Args:
+            service (str): The service base url.
+            origin (str): The origin base url.
+            args (argparse.Namespace): The command line arguments.
+        """
+
+        self.service = service
+        self.origin = origin
+        self.args = args
+        self._agents = []
+
+    def agents(self, number: int) -> list[int]:
+        """Get persistent agents already cleared for the origin, creating the missing ones."""
+
+        while len(self._agents) < number:
+            response = requests.post(f"{self.service}/agent/persistent", json={})
+            response.raise_for_status()
+            agent_id = response.json()["id"]
+            # A failing stand-in egress proxy fails some of the warm-ups
+            for attempt in range(5):
+                warm_up = proxy(
+                    requests, self.service, agent_id, f"{self.origin}/challenge/warm-up"
+                )
+                if warm_up.ok:
+                    break
+            warm_up.raise_for_status()
+            self._agents.append(agent_id)
+
+        return self._agents[:number]
+
+
+def proxy(session, service: str, agent_id: int | None, dst: str, **params):
+    """Make a request through the proxy."""
+
+    params = {"agent_id": agent_id, "dst": dst, **params}
+    return session.get(f"{service}/proxy", params=params)
+
+
+def read(response: requests.Response) -> int:
+    """Read the response body in chunks, returning its size."""
+
+    response.raise_for_status()
+    size = 0
+    for chunk in response.iter_content(64 * 1024):
+        size += len(chunk)
+    return size
+
+
+class Scenario:
+    """A benchmark scenario, `run` makes one request or sequence of requests."""
+
+    name = None
+    description = None
+
+    def __init__(self, context: Context, concurrency: int):
+        self.context = context
+
+    def run(self, session: requests.Session, slot: int) -> int:
+        """Run the operation once, returning the number of bytes received."""
+
+        raise NotImplementedError
+
+
+class CachedAgent(Scenario):
+    name = "cached_agent"
+    description = "Requests through agents already holding cf_clearance for the origin."
+    path = "/challenge/page"
+
+    def __init__(self, context: Context, concurrency: int):
+        super().__init__(context, concurrency)
+        self.agents = context.agents(concurrency)
+        self.dst = f"{context.origin}{self.path}?size={context.args.size}"
+
+    def run(self, session: requests.Session, slot: int) -> int:
+        return read(proxy(session, self.context.service, self.agents[slot], self.dst))
+
+
+class Gzip(CachedAgent):
+    name = "gzip"
+    description = "Gzip encoded responses through cleared agents."
+    path = "/gzip"
+
+
+class Chunked(CachedAgent):
+    name = "chunked"
+    description = "Chunked responses through cleared agents."
+    path = "/chunked"
+
+
+class HotAgent(CachedAgent):
+    name = "hot_agent"
+    description = "All clients share one agent, waiting for its lease."
+
+    def __init__(self, context: Context, concurrency: int):
+        super().__init__(context, concurrency)
+        self.agents = context.agents(1) * concurrency
+
+
+class ColdAgent(Scenario):
+    name = "cold_agent"
+    description = (
+        "Creates an agent, solves the challenge on its first request and deletes it."
+    )
+
+    def __init__(self, context: Context, concurrency: int):
+        super().__init__(context, concurrency)
+        self.pages = count()
+
+    def run(self, session: requests.Session, slot: int) -> int:
+        service = self.context.service
+        response = session.post(f"{service}/agent/persistent", json={})
+        response.raise_for_status()
+        agent_id = response.json()["id"]
+        try:
+            dst = f"{self.context.origin}/challenge/cold-{next(self.pages)}"
+            return read(proxy(session, service, agent_id, dst))
+        finally:
+            session.delete(f"{service}/agent/persistent/{agent_id}")
+
+
+class Streaming(Scenario):
+    name = "streaming"
+    description = "Large downloads streamed through cleared agents."
+
+    def __init__(self, context: Context, concurrency: int):
+        super().__init__(context, concurrency)
+        self.agents = context.agents(concurrency)
+        self.dst = f"{context.origin}/large?size={context.args.large_size}"
+
+    def run(self, session: requests.Session, slot: int) -> int:
+        response = session.get(
+            f"{self.context.service}/proxy",
+            params={"agent_id": self.agents[slot], "dst": self.dst, "stream": "true"},
+            stream=True,
+        )
+        return read(response)
+
+
+class Batch(Scenario):
+    name = "batch"
+    description = "Batches of plain, gzip and chunked requests through cleared agents."
+
+    def __init__(self, context: Context, concurrency: int):
+        super().__init__(context, concurrency)
+        self.agents = context.agents(concurrency)
+        size = context.args.size
+        self.dsts = [
+            f"{context.origin}/challenge/page?size={size}",
+            f"{context.origin}/gzip?size={size}",
+            f"{context.origin}/chunked?size={size}",
+        ]
+
+    def run(self, session: requests.Session, slot: int) -> int:
+        items = [
+            {"dst": self.dsts[index % len(self.dsts)], "agent_id": self.agents[slot]}
+            for index in range(self.context.args.batch_size)
+        ]
+        response = session.post(
+            f"{self.context.service}/proxy/batch", json={"items": items}
+        )
+        response.raise_for_status()
+        lines = response.content.splitlines()
+        errors = [json.loads(line)["error"] for line in lines if b'"error"' in line]
+        if errors or len(lines) != len(items):
+            raise RuntimeError(f"Batch failed: {errors[:1] or len(lines)}")
+        return len(response.content)
+
+
+SCENARIOS = {
+    scenario.name: scenario
+    for scenario in (CachedAgent, Gzip, Chunked, HotAgent, ColdAgent, Streaming, Batch)
+}
+
+
+def process_tree(pid: int) -> list[int]:
+    """Get the process and its descendants."""
+
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as file:
+                ppid = int(file.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+
+    pids, pending = [], [pid]
+    while pending:
+        pids.append(pending.pop())
+        pending.extend(children.get(pids[-1], []))
+    return pids
+
+
+def cpu_seconds(pids: list[int]) -> float:
+    """Get the user and system CPU time of the processes."""
+
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat") as file:
+                fields = file.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        total += int(fields[11]) + int(fields[12])
+    return total / CLOCK_TICKS
+
+
+def rss_bytes(pids: list[int]) -> int:
+    """Get the resident memory of the processes."""
+
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/status") as file:
+                for line in file:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            continue
+    return total
+
+
+class ResourceMonitor:
+    def __init__(self, pid: int | None, interval: float = 0.2):
+        """Initialize the monitor of the service processes.
+
+        Args:
+            pid (int | None): The service process, its children are included. Without
+                it nothing is measured.
+            interval (float, optional): Seconds between the RSS samples.
+        """
+
+        self.pid = pid
+        self.interval = interval
+        self._stop = Event()
+
+    def __enter__(self):
+        self.rss_peak = self.rss_end = None
+        self.cpu = None
+        if self.pid is None:
+            return self
+        self._pids = process_tree(self.pid)
+        self._cpu_start = cpu_seconds(self._pids)
+        self.rss_start = self.rss_peak = rss_bytes(self._pids)
+        self._stop.clear()
+        self._thread = Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.pid is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._pids = process_tree(self.pid)
+        self.cpu = cpu_seconds(self._pids) - self._cpu_start
+        self.rss_end = rss_bytes(self._pids)
+        self.rss_peak = max(self.rss_peak, self.rss_end)
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            # Workers may be restarted meanwhile
+            self._pids = process_tree(self.pid)
+            self.rss_peak = max(self.rss_peak, rss_bytes(self._pids))
+
+
+def percentile(values: list[float], share: float) -> float:
+    """Get the nearest-rank percentile of the sorted values."""
+
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, int(share * len(values) + 0.5) - 1))]
+
+
+def load(
+    scenario: Scenario, concurrency: int, duration: float, requests_limit: int | None
+) -> dict:
+    """Run the scenario operation in a loop from every client until the time or the
+    operations limit is reached."""
+
+    latencies = []
+    errors = Counter()
+    received = []
+    started = count()
+    lock = Lock()
+    deadline = time.monotonic() + duration
+
+    def client(slot: int):
+        session = requests.Session()
+        while time.monotonic() < deadline:
+            if requests_limit is not None and next(started) >= requests_limit:
+                break
+            start = time.perf_counter()
+            try:
+                size = scenario.run(session, slot)
+            except Exception as err:
+                with lock:
+                    errors[type(err).__name__] += 1
+                continue
+            latency = time.perf_counter() - start
+            with lock:
+                latencies.append(latency)
+                received.append(size)
+        session.close()
+
+    start = time.perf_counter()
+    threads = [Thread(target=client, args=(slot,)) for slot in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    return {
+        "latencies": sorted(latencies),
+        "errors": dict(errors),
+        "bytes": sum(received),
+        "elapsed": elapsed,
+    }
+
+
+def run_scenario(
+    context: Context, name: str, service_pid: int | None, args: argparse.Namespace
+) -> dict:
+    """Run the scenario, warming it up first, and summarize the measured run."""
+
+    scenario = SCENARIOS[name](context, args.concurrency)
+    if args.warmup:
+        load(scenario, args.concurrency, args.warmup, None)
+    with ResourceMonitor(service_pid) as monitor:
+        result = load(scenario, args.concurrency, args.duration, args.requests)
+
+    latencies = result["latencies"]
+    elapsed = result["elapsed"]
+    summary = {
+        "description": scenario.description,
+        "concurrency": args.concurrency,
+        "duration": elapsed,
+        "requests": len(latencies),
+        "errors": result["errors"],
+        "rps": len(latencies) / elapsed,
+        "bytes": result["bytes"],
+        "throughput": result["bytes"] / elapsed,
+        "latency": {
+            "min": latencies[0] if latencies else None,
+            "mean": sum(latencies) / len(latencies) if latencies else None,
+            "p50": percentile(latencies, 0.5),
+            "p90": percentile(latencies, 0.9),
+            "p99": percentile(latencies, 0.99),
+            "max": latencies[-1] if latencies else None,
+        },
+        "rss_start": monitor.rss_start if monitor.cpu is not None else None,
+        "rss_peak": monitor.rss_peak,
+        "rss_end": monitor.rss_end,
+        "cpu_seconds": monitor.cpu,
+        "cpu_percent": 100 * monitor.cpu / elapsed if monitor.cpu is not None else None,
+    }
+    if name == "batch":
+        summary["items_per_second"] = summary["rps"] * args.batch_size
+
+    return summary
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_ready(url: str, process: subprocess.Popen, timeout: float) -> None:
+    """Wait for the server to answer."""
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"{url} exited with {process.returncode}.")
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} didn't start in {timeout} seconds.")
+
+
+def start_origin(args: argparse.Namespace) -> tuple[subprocess.Popen, str]:
+    """Start the fake origin in its own process, so it doesn't compete with the clients."""
+
+    port = args.origin_port or free_port()
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.join(BENCHMARK_DIR, "origin.py"),
+            "--port",
+            str(port),
+            "--challenge-delay",
+            str(args.challenge_delay),
+        ],
+        stdout=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    wait_ready(f"{url}/stats", process, 10)
+    return process, url
+
+
+def start_egress(args: argparse.Namespace) -> tuple[list[subprocess.Popen], list[str]]:
+    """Start the stand-in outbound proxies, the first one failing at --egress-fail-rate."""
+
+    processes, urls = [], []
+    for index in range(args.egress):
+        port = free_port()
+        processes.append(
+            subprocess.Popen(
+                [
+                    sys.executable,
+                    os.path.join(BENCHMARK_DIR, "egress.py"),
+                    "--port",
+                    str(port),
+                    "--fail-rate",
+                    str(args.egress_fail_rate if index == 0 else 0),
+                ],
+                stdout=subprocess.DEVNULL,
+            )
+        )
+        urls.append(f"http://127.0.0.1:{port}")
+        wait_ready(f"{urls[-1]}/stats", processes[-1], 10)
+    return processes, urls
+
+
+def start_service(
+    args: argparse.Namespace, log, egress: list[str]
+) -> tuple[subprocess.Popen, str]:
+    """Start the service with Gunicorn or the built-in Flask server."""
+
+    port = free_port()
+    env = dict(
+        os.environ,
+        PYTHONPATH=SERVICE_DIR,
+        CLOUDSCRAPER_PROXY_HOST="127.0.0.1",
+        CLOUDSCRAPER_PROXY_PORT=str(port),
+        CLOUDSCRAPER_PROXY_WORKERS=str(args.workers),
+        CLOUDSCRAPER_PROXY_LOG_LEVEL=args.log_level,
+    )
+    if args.config is not None:
+        env["CLOUDSCRAPER_PROXY_CONFIG_PATH"] = os.path.abspath(args.config)
+    if egress:
+        env["CLOUDSCRAPER_PROXY_EGRESS_PROXIES"] = ",".join(egress)
+    if args.server == "gunicorn":
+        command = [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            "-b",
+            f"127.0.0.1:{port}",
+            "-c",
+            "utils/gunicorn_config.py",
+            "wsgi:app",
+        ]
+    else:
+        # The development server runs a single process
+        env["CLOUDSCRAPER_PROXY_WORKERS"] = "1"
+        command = [sys.executable, "main.py"]
+    process = subprocess.Popen(
+        command, cwd=SERVICE_DIR, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+    url = f"http://127.0.0.1:{port}"
+    wait_ready(f"{url}/agent/persistent/stats", process, 60)
+    return process, url
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BENCHMARK_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_summary(name: str, summary: dict) -> None:
+    latency = summary["latency"]
+    line = (
+        f"{name:<14} {summary['rps']:>9.1f} req/s"
+        f"  p50 {1000 * (latency['p50'] or 0):>8.1f} ms"
+        f"  p99 {1000 * (latency['p99'] or 0):>8.1f} ms"
+    )
+    if summary["cpu_percent"] is not None:
+        line += (
+            f"  cpu {summary['cpu_percent']:>6.1f} %"
+            f"  rss {summary['rss_peak'] / 2**20:>7.1f} MiB"
+        )
+    errors = sum(summary["errors"].values())
+    if errors:
+        line += f"  errors {errors}"
+    print(line, flush=True)
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--scenarios",
+        default=",".join(SCENARIOS),
+        help=f"Comma separated scenarios out of {', '.join(SCENARIOS)}.",
+    )
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent clients.")
+    parser.add_argument(
+        "--duration", type=float, default=10, help="Seconds every scenario is measured."
+    )
+    parser.add_argument(
+        "--requests",
+        type=int,
+        default=None,
+        help="Stop every scenario after this many operations.",
+    )
+    parser.add_argument(
+        "--warmup", type=float, default=2, help="Seconds of unmeasured load first."
+    )
+    parser.add_argument("--size", type=int, default=16 * 1024, help="Page size in bytes.")
+    parser.add_argument(
+        "--large-size",
+        type=int,
+        default=16 * 2**20,
+        help="Streamed download size in bytes.",
+    )
+    parser.add_argument("--batch-size", type=int, default=10, help="Items per batch.")
+    parser.add_argument(
+        "--challenge-delay",
+        type=int,
+        default=0,
+        help="Milliseconds the origin challenge asks the client to wait.",
+    )
+    parser.add_argument(
+        "--server",
+        choices=["gunicorn", "flask"],
+        default="gunicorn",
+        help="How the service is started.",
+    )
+    parser.add_argument("--workers", type=int, default=1, help="Gunicorn workers.")
+    parser.add_argument(
+        "--egress",
+        type=int,
+        default=0,
+        help="Stand-in outbound proxies the agents are spread over.",
+    )
+    parser.add_argument(
+        "--egress-fail-rate",
+        type=float,
+        default=0,
+        help="Share of the requests the first outbound proxy fails.",
+    )
+    parser.add_argument("--config", default=None, help="Service config file.")
+    parser.add_argument("--log-level", default="WARNING", help="Service log level.")
+    parser.add_argument(
+        "--url",
+        default=None,
+        help="Benchmark a running service instead of starting one.",
+    )
+    parser.add_argument(
+        "--pid",
+        type=int,
+        default=None,
+        help="Process of the running service to measure with --url.",
+    )
+    parser.add_argument("--origin-port", type=int, default=None, help="Origin port.")
+    parser.add_argument(
+        "--output",
+        default=None,
+        help="Results file, by default results/<time>.json next to this script.",
+    )
+    parser.add_argument("--label", default=None, help="Label stored with the results.")
+    args = parser.parse_args(argv)
+
+    unknown = set(args.scenarios.split(",")) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}.")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    started = datetime.now(timezone.utc)
+    output = args.output or os.path.join(
+        BENCHMARK_DIR, "results", f"{started:%Y%m%dT%H%M%S}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+
+    origin_process, origin = start_origin(args)
+    service_process = None
+    egress_processes, egress = start_egress(args)
+    log = open(os.path.splitext(output)[0] + ".log", "wb")
+    try:
+        if args.url is None:
+            service_process, service = start_service(args, log, egress)
+            service_pid = service_process.pid
+        else:
+            service, service_pid = args.url.rstrip("/"), args.pid
+        context = Context(service, origin, args)
+
+        scenarios = {}
+        for name in args.scenarios.split(","):
+            scenarios[name] = run_scenario(context, name, service_pid, args)
+            print_summary(name, scenarios[name])
+    finally:
+        if service_process is not None:
+            service_process.terminate()
+            service_process.wait(30)
+        for process in [origin_process, *egress_processes]:
+            process.terminate()
+            process.wait(10)
+        log.close()
+
+    results = {
+        "label": args.label,
+        "started": started.isoformat(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "settings": {
+            name: value
+            for name, value in vars(args).items()
+            if name not in {"output", "label", "pid"}
+        },
+        "scenarios": scenarios,
+    }
+    with open(output, "w") as file:
+        json.dump(results, file, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
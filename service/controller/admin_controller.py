@@ -0,0 +1,167 @@
+"""This controller provides the admin blueprint."""
+
+from json import loads
+
+from entity.admin import (
+    FlightRecorderResponseShema,
+    ProfileRequestParamsShema,
+    ProfileSelectionParamsShema,
+    ProfileSelectionShema,
+)
+from flask import Response, jsonify, request
+from flask_smorest import Blueprint, abort
+from utils.config import ProfilerConfig, ProfilerConfigSchema
+from utils.flight_recorder import FlightRecorder, merge
+from utils.profile_selector import ProfileSelector
+from utils.profile_selector import merge as merge_selection
+from utils.profiler import RequestProfiler, StackSampler
+from utils.shard import ShardRouter, is_forwarded
+
+
+def construct_admin_blueprint(
+    flight_recorder: FlightRecorder | None = None,
+    shard_router: ShardRouter | None = None,
+    stack_sampler: StackSampler | None = None,
+    request_profiler: RequestProfiler | None = None,
+    profiler_config: ProfilerConfig = ProfilerConfigSchema().load({}),
+    profile_selector: ProfileSelector | None = None,
+) -> Blueprint:
+    bp = Blueprint("admin", __name__, url_prefix="/admin", description="Admin API.")
+
+    @bp.before_request
+    def before_request():
+        if shard_router is not None and request.view_args:
+            # Request profiles are kept by the workers that made them
+            return shard_router.forward_request(
+                request, request.view_args.get("profile_id")
+            )
+
+    if flight_recorder is not None:
+
+        @bp.route("/requests", methods=["GET"])
+        @bp.response(200, FlightRecorderResponseShema)
+        def get_requests():
+            """Get the slowest and a sample of the recent requests with the time spent in every stage."""
+
+            entries = flight_recorder.entries()
+            if shard_router is not None and not is_forwarded(request):
+                others = [
+                    loads(body)
+                    for status, body in shard_router.broadcast("GET", request.path, {})
+                    if status == 200
+                ]
+                entries = merge(
+                    [entries] + others,
+                    flight_recorder.slowest,
+                    flight_recorder.sample_size,
+                )
+
+            return jsonify(entries), 200
+
+        @bp.route("/requests", methods=["DELETE"])
+        @bp.response(
+            200,
+            schema={
+                "type": "object",
+                "properties": {"message": {"type": "string"}},
+            },
+        )
+        def clear_requests():
+            """Forget the recorded requests."""
+
+            flight_recorder.clear()
+            if shard_router is not None and not is_forwarded(request):
+                shard_router.broadcast("DELETE", request.path, {})
+            return jsonify({"message": "All recorded requests deleted"}), 200
+
+    if profile_selector is not None:
+
+        @bp.route("/selection", methods=["GET"])
+        @bp.arguments(ProfileSelectionParamsShema, location="query")
+        @bp.response(
+            200,
+            ProfileSelectionShema(many=True),
+            description="Outcomes and scores of the proxy config entries by the destination host. New agents mostly get the entry scoring best on their host.",
+        )
+        def get_selection(params):
+            """Get the scores of the agent profiles."""
+
+            stats = profile_selector.stats(params["host"])
+            if shard_router is not None and not is_forwarded(request):
+                others = [
+                    loads(body)
+                    for status, body in shard_router.broadcast(
+                        "GET", request.full_path, {}
+                    )
+                    if status == 200
+                ]
+                stats = merge_selection([stats] + others)
+
+            return jsonify(stats), 200
+
+    if stack_sampler is not None:
+
+        @bp.route("/profile", methods=["GET"])
+        @bp.arguments(ProfileRequestParamsShema, location="query")
+        @bp.response(
+            200,
+            content_type="text/plain",
+            description="Sample counts of the stacks of all threads and greenlets, collapsed as the flamegraph input.",
+        )
+        @bp.response(409, description="Another profile is running.")
+        def profile(params):
+            """Profile the worker for the given seconds."""
+
+            shard = params["shard"]
+            if shard is not None and shard_router is not None:
+                if shard >= shard_router.shards:
+                    return abort(422, message="No such worker.")
+                response = shard_router.forward_request(request, shard)
+                if response is not None:
+                    return response
+
+            stacks = stack_sampler.profile(
+                min(params["seconds"], profiler_config.max_seconds), params["idle"]
+            )
+            if stacks is None:
+                return abort(409, message="Another profile is running.")
+
+            return Response(
+                "".join(f"{stack} {count}\n" for stack, count in stacks.most_common()),
+                200,
+                mimetype="text/plain",
+            )
+
+    if request_profiler is not None:
+
+        @bp.before_app_request
+        def start_request_profile():
+            request_profiler.start(request)
+
+        @bp.after_app_request
+        def finish_request_profile(response):
+            request_profiler.finish(request, response)
+            return response
+
+        @bp.teardown_app_request
+        def stop_request_profile(error=None):
+            # The request failed before its profile was finished
+            request_profiler.stop(request)
+
+        @bp.route("/profile/<int:profile_id>", methods=["GET"])
+        @bp.response(
+            200,
+            content_type="text/plain",
+            description="The cProfile report of a request made with the X-Cloudscraper-Proxy-Profile header, its X-Cloudscraper-Proxy-Profile-Id response header tells the profile id.",
+        )
+        @bp.response(404, description="Profile not found.")
+        def get_request_profile(profile_id):
+            """Get the profile of a request."""
+
+            report = request_profiler.get(profile_id)
+            if report is None:
+                return abort(404)
+
+            return Response(report, 200, mimetype="text/plain")
+
+    return bp
@@ -1,10 +1,8 @@
 """This controller provides the ephemeral proxy agent blueprint."""
 
-from random import choice
-from time import time
-from urllib.parse import unquote
+from time import perf_counter, time
+from urllib.parse import unquote, urlparse
 
-import cloudscraper
 from entity.agent import (
     AgentRequestFullResponseShema,
     EphemeralAgentRequestDataShema,
@@ -13,11 +11,21 @@ from entity.agent import (
 from flask import jsonify, request
 from flask_smorest import Blueprint, abort
 from structlog import get_logger
+from utils.clearance import ClearanceCache
 from utils.dotdict import dotdict
+from utils.flight_recorder import FlightRecorder
+from utils.profile_selector import ProfileSelector, select_profile
 
 
-def construct_ephemeral_agent_blueprint(proxy_configs: list[dict] = [{}]) -> Blueprint:
+def construct_ephemeral_agent_blueprint(
+    proxy_configs: list[dict] = [{}],
+    clearance_cache: ClearanceCache | None = None,
+    flight_recorder: FlightRecorder | None = None,
+    profile_selector: ProfileSelector | None = None,
+) -> Blueprint:
     log = get_logger(__name__)
+    if clearance_cache is None:
+        clearance_cache = ClearanceCache()
     bp = Blueprint(
         "ephemeral-agent",
         __name__,
@@ -28,10 +36,14 @@ def construct_ephemeral_agent_blueprint(proxy_configs: list[dict] = [{}]) -> Blu
     @bp.before_request
     def before_request():
         request.start_time = time()
+        if flight_recorder is not None:
+            flight_recorder.start(request)
 
     @bp.after_request
     def after_request(response):
         request_time = time() - request.start_time
+        if flight_recorder is not None:
+            flight_recorder.finish(request, response)
         log.info(
             "Processing request.",
             endpoint=request.url_rule.rule,
@@ -49,14 +61,21 @@ def construct_ephemeral_agent_blueprint(proxy_configs: list[dict] = [{}]) -> Blu
     @bp.response(201, AgentRequestFullResponseShema)
     @bp.response(500, description="Couldn't create an ephemeral agent.")
     def create(params, data):
-        """Generate an ephemeral agent: user agent and cloudflare session cookie."""
+        """Generate an ephemeral agent: user agent and cloudflare session cookie. Clearances are cached per destination host and agent configuration until the cookie expires."""
 
         params = dotdict(params)
         try:
             url = unquote(params.url)
-            cookie, ua = cloudscraper.get_cookie_string(
-                url, **(choice(proxy_configs) | data)
+            start = perf_counter()
+            clearance = clearance_cache.solve(
+                url,
+                select_profile(proxy_configs, profile_selector, urlparse(url).hostname)
+                | data,
+                refresh=params.refresh,
             )
+            if flight_recorder is not None:
+                request.flight_record.host = urlparse(url).hostname
+                request.flight_record.stage("clearance", perf_counter() - start)
         except Exception as err:
             log.error("Couldn't create an ephemeral agent.", error=err)
             return abort(500)
@@ -64,8 +83,8 @@ def construct_ephemeral_agent_blueprint(proxy_configs: list[dict] = [{}]) -> Blu
         return (
             jsonify(
                 {
-                    "user_agent": ua,
-                    "cf_clearance": cookie.lstrip("cf_clearance="),
+                    "user_agent": clearance.user_agent,
+                    "cf_clearance": clearance.cf_clearance,
                 }
             ),
             201,
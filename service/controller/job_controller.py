@@ -0,0 +1,171 @@
+"""This controller provides the asynchronous job blueprint."""
+
+from time import time
+from urllib.parse import urlparse
+
+from entity.job import (
+    EphemeralAgentJobRequestDataShema,
+    JobQueueStatsResponseShema,
+    JobRequestParamsShema,
+    JobResponseShema,
+    PersistentAgentJobRequestDataShema,
+)
+from flask import jsonify, request, url_for
+from flask_smorest import Blueprint, abort
+from structlog import get_logger
+from utils.agent_pool import AgentPool
+from utils.clearance import ClearanceCache
+from utils.config import (
+    JobConfig,
+    JobConfigSchema,
+    UpstreamConfig,
+    UpstreamConfigSchema,
+)
+from utils.jobs import JobQueue
+from utils.profile_selector import ProfileSelector, select_profile
+from utils.retry import deadline, timeouts
+from utils.shard import ShardRouter
+
+
+def construct_job_blueprint(
+    agent_pool: AgentPool,
+    job_queue: JobQueue,
+    proxy_configs: list[dict] = [{}],
+    clearance_cache: ClearanceCache | None = None,
+    shard_router: ShardRouter | None = None,
+    job_config: JobConfig = JobConfigSchema().load({}),
+    profile_selector: ProfileSelector | None = None,
+    upstream_config: UpstreamConfig = UpstreamConfigSchema().load({}),
+) -> Blueprint:
+    log = get_logger(__name__)
+    if clearance_cache is None:
+        clearance_cache = ClearanceCache()
+    bp = Blueprint(
+        "job",
+        __name__,
+        url_prefix="/job",
+        description="Asynchronous agent creation and clearance solving API.",
+    )
+
+    @bp.before_request
+    def before_request():
+        request.start_time = time()
+        if shard_router is not None and request.view_args:
+            # Jobs are owned by the workers that run them
+            return shard_router.forward_request(request, request.view_args.get("job_id"))
+
+    @bp.after_request
+    def after_request(response):
+        request_time = time() - request.start_time
+        log.info(
+            "Processing request.",
+            endpoint=request.url_rule.rule,
+            args=request.view_args,
+            method=request.method,
+            status=response.status_code,
+            src=request.remote_addr,
+            time_seconds=request_time,
+        )
+        return response
+
+    def submit(kind, fn, items):
+        if len(items) > job_config.max_items:
+            return abort(
+                422, message=f"A job may have at most {job_config.max_items} items."
+            )
+        job = job_queue.submit(kind, fn, items)
+        if job is None:
+            return abort(503, message="The job queue is full.")
+
+        return (
+            jsonify(job.to_dict()),
+            202,
+            {"Location": url_for("job.get", job_id=job.id)},
+        )
+
+    def create_persistent(kwargs: dict) -> dict:
+        url = kwargs.pop("url", None)
+        agent_id, agent = agent_pool.generate(**kwargs)
+        if url is not None:
+            try:
+                with agent_pool.use(agent_id, url) as agent:
+                    agent.get(
+                        url,
+                        timeout=timeouts(
+                            upstream_config.connect_timeout,
+                            upstream_config.read_timeout,
+                            deadline(upstream_config.deadline),
+                        ),
+                    ).raise_for_status()
+            except Exception:
+                agent_pool.pop(agent_id, None)
+                raise
+
+        return {
+            "id": agent_id,
+            "user_agent": agent.headers.get("User-Agent", ""),
+            "cf_clearance": agent.cookies.get_dict().get("cf_clearance", ""),
+        }
+
+    @bp.route("/agent/persistent", methods=["POST"])
+    @bp.arguments(PersistentAgentJobRequestDataShema, location="json", required=False)
+    @bp.response(202, JobResponseShema)
+    @bp.response(422, description="Too many agents requested.")
+    @bp.response(503, description="The job queue is full.")
+    def create_persistent_agents(data):
+        """Create persistent agents in the background. Poll the returned job for the created agents."""
+
+        count = data.pop("count", 1)
+        items = [
+            select_profile(proxy_configs, profile_selector) | data for _ in range(count)
+        ]
+
+        return submit("persistent", create_persistent, items)
+
+    @bp.route("/agent/ephemeral", methods=["POST"])
+    @bp.arguments(EphemeralAgentJobRequestDataShema, location="json", required=True)
+    @bp.response(202, JobResponseShema)
+    @bp.response(422, description="Too many URLs requested.")
+    @bp.response(503, description="The job queue is full.")
+    def create_ephemeral_agents(data):
+        """Solve the clearances of the URLs in the background. Poll the returned job for the user agents and cf_clearance cookies."""
+
+        urls = data.pop("urls")
+        refresh = data.pop("refresh", False)
+
+        def solve(url: str) -> dict:
+            clearance = clearance_cache.solve(
+                url,
+                select_profile(proxy_configs, profile_selector, urlparse(url).hostname)
+                | data,
+                refresh=refresh,
+            )
+            return {
+                "url": url,
+                "user_agent": clearance.user_agent,
+                "cf_clearance": clearance.cf_clearance,
+            }
+
+        return submit("ephemeral", solve, urls)
+
+    @bp.route("/<int:job_id>", methods=["GET"])
+    @bp.arguments(JobRequestParamsShema, location="query")
+    @bp.response(200, JobResponseShema)
+    @bp.response(404, description="Job not found or its results expired.")
+    def get(params, job_id):
+        """Get the job. With `wait` the request is held until the job finishes or the wait time passes."""
+
+        job = job_queue.wait(job_id, min(params["wait"], job_config.max_wait))
+        if job is None:
+            return abort(404)
+
+        return jsonify(job.to_dict()), 200
+
+    @bp.route("/stats", methods=["GET"])
+    @bp.response(200, JobQueueStatsResponseShema)
+    def stats():
+        """Get the job queue statistics."""
+
+        return jsonify(job_queue.stats()), 200
+
+    return bp
@@ -0,0 +1,55 @@
+"""This controller provides the metrics blueprint."""
+
+from time import perf_counter
+
+from flask import Response, request
+from flask_smorest import Blueprint
+from utils.metrics import Metrics, merge
+from utils.shard import ShardRouter, is_forwarded
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def construct_metrics_blueprint(
+    metrics: Metrics, shard_router: ShardRouter | None = None
+) -> Blueprint:
+    bp = Blueprint("metrics", __name__, url_prefix="/metrics", description="Metrics API.")
+
+    @bp.before_app_request
+    def track_request():
+        # Requests forwarded by other workers are tracked by the workers they came to
+        if not is_forwarded(request):
+            request.metrics_start = perf_counter()
+            request.metrics_endpoint = request.endpoint or "unmatched"
+            metrics.requests_in_flight.inc(endpoint=request.metrics_endpoint)
+
+    @bp.teardown_app_request
+    def observe_request(error=None):
+        if hasattr(request, "metrics_start"):
+            metrics.requests_in_flight.dec(endpoint=request.metrics_endpoint)
+            metrics.request_seconds.observe(
+                perf_counter() - request.metrics_start,
+                endpoint=request.metrics_endpoint,
+                method=request.method,
+            )
+
+    @bp.route("", methods=["GET"])
+    @bp.response(
+        200,
+        content_type=CONTENT_TYPE,
+        description="Metrics in the Prometheus text exposition format.",
+    )
+    def get():
+        """Get the metrics. With several workers the metrics of all of them are summed up."""
+
+        text = metrics.render()
+        if shard_router is not None and not is_forwarded(request):
+            texts = [text]
+            for status, body in shard_router.broadcast("GET", request.path, {}):
+                if status == 200:
+                    texts.append(body.decode())
+            text = merge(texts)
+
+        return Response(text, 200, content_type=CONTENT_TYPE)
+
+    return bp
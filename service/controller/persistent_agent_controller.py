@@ -1,9 +1,12 @@
 """This controller provides the persistent proxy agent blueprint."""
 
-from random import choice
+from json import loads
 from time import time
 
 from entity.agent import (
+    AgentContentionParamsShema,
+    AgentContentionShema,
+    AgentPoolStatsResponseShema,
     AgentRequestFullResponseShema,
     AgentRequestShortResponseShema,
     PersistentAgentRequestDataShema,
@@ -12,10 +15,19 @@ from flask import jsonify, request
 from flask_smorest import Blueprint, abort
 from structlog import get_logger
 from utils.agent_pool import AgentPool
+from utils.challenge_pool import ChallengePool
+from utils.flight_recorder import FlightRecorder
+from utils.profile_selector import ProfileSelector, select_profile
+from utils.shard import ShardRouter, is_forwarded
 
 
 def construct_persistent_agent_blueprint(
-    agent_pool: AgentPool, proxy_configs: list[dict] = [{}]
+    agent_pool: AgentPool,
+    proxy_configs: list[dict] = [{}],
+    shard_router: ShardRouter | None = None,
+    challenge_pool: ChallengePool | None = None,
+    flight_recorder: FlightRecorder | None = None,
+    profile_selector: ProfileSelector | None = None,
 ) -> Blueprint:
     log = get_logger(__name__)
     bp = Blueprint(
@@ -28,10 +40,22 @@ def construct_persistent_agent_blueprint(
     @bp.before_request
     def before_request():
         request.start_time = time()
+        if shard_router is not None and request.view_args:
+            # Agents owned by other workers are served by their owners
+            response = shard_router.forward_request(
+                request, request.view_args.get("agent_id")
+            )
+            if response is not None:
+                return response
+        if flight_recorder is not None:
+            flight_recorder.start(request)
+            request.flight_record.agent_id = (request.view_args or {}).get("agent_id")
 
     @bp.after_request
     def after_request(response):
         request_time = time() - request.start_time
+        if flight_recorder is not None:
+            flight_recorder.finish(request, response)
         log.info(
             "Processing request.",
             endpoint=request.url_rule.rule,
@@ -70,16 +94,39 @@ def construct_persistent_agent_blueprint(
     def get_all():
         """Get all persistent agents."""
 
-        return jsonify(
-            [
-                {
-                    "id": agent_id,
-                    "user_agent": agent.headers.get("User-Agent", ""),
-                    "cf_clearance": agent.cookies.get_dict().get("cf_clearance", ""),
-                }
-                for agent_id, agent in agent_pool.items()
-            ]
-        )
+        agents = [
+            {
+                "id": agent_id,
+                "user_agent": agent.headers.get("User-Agent", ""),
+                "cf_clearance": agent.cookies.get_dict().get("cf_clearance", ""),
+            }
+            for agent_id, agent in agent_pool.items()
+        ]
+        if shard_router is not None and not is_forwarded(request):
+            for status, body in shard_router.broadcast("GET", request.path, {}):
+                if status == 200:
+                    agents.extend(loads(body))
+
+        return jsonify(agents)
+
+    @bp.route("/stats", methods=["GET"])
+    @bp.response(200, AgentPoolStatsResponseShema)
+    def stats():
+        """Get the agent pool statistics."""
+
+        stats = agent_pool.stats()
+        if challenge_pool is not None:
+            stats["challenge"] = challenge_pool.stats()
+
+        return jsonify(stats), 200
+
+    @bp.route("/contention", methods=["GET"])
+    @bp.arguments(AgentContentionParamsShema, location="query")
+    @bp.response(200, AgentContentionShema(many=True))
+    def contention(params):
+        """Get the agents requests waited for the longest in total, with their lease statistics."""
+
+        return jsonify(agent_pool.contention(params["limit"])), 200
 
     @bp.route("", methods=["POST"])
     @bp.arguments(
@@ -93,7 +140,11 @@ def construct_persistent_agent_blueprint(
         """Generate a persistent agent."""
 
         try:
-            agent_id, _ = agent_pool.generate(**(choice(proxy_configs) | data))
+            agent_id, _ = agent_pool.generate(
+                **(select_profile(proxy_configs, profile_selector) | data)
+            )
+            if flight_recorder is not None:
+                request.flight_record.agent_id = agent_id
         except Exception as err:
             log.error("Couldn't create an agent.", error=err)
             return abort(500)
@@ -123,6 +174,8 @@ def construct_persistent_agent_blueprint(
         """Delete all persistent agents."""
 
         agent_pool.clear()
+        if shard_router is not None and not is_forwarded(request):
+            shard_router.broadcast("DELETE", request.path, {})
         return jsonify({"message": "All agents deleted"}), 200
 
     return bp
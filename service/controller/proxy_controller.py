@@ -1,36 +1,117 @@
 """Proxy controller module provides the proxy blueprint."""
 
-import gzip
-from random import choice
-from time import time
-from urllib.parse import unquote
-
-from entity.proxy import ProxyRequestParams
-from flask import make_response, request
-from flask_smorest import Blueprint
+import json
+from base64 import b64encode
+from collections.abc import Callable, Iterator
+from contextlib import ExitStack, contextmanager, nullcontext
+from math import ceil
+from time import monotonic, perf_counter, sleep, time
+from urllib.parse import quote, unquote, urlencode, urlparse
+
+import requests
+from entity.proxy import (
+    CircuitBreakerStatsResponseShema,
+    HostLimitStatsResponseShema,
+    ProxyBatchRequestShema,
+    ProxyBatchResultShema,
+    ProxyRequestParams,
+    RequestCollapseStatsResponseShema,
+    ResponseCacheStatsResponseShema,
+)
+from flask import Response, jsonify, make_response, request
+from flask_smorest import Blueprint, abort
+from requests.structures import CaseInsensitiveDict
 from structlog import get_logger
-from utils.agent_pool import AgentPool
+from utils.agent_pool import AgentNotFound, AgentPool, LeaseTimeout
+from utils.batch import iter_completed
+from utils.circuit_breaker import CLOSED, CircuitBreaker, CircuitOpen
+from utils.circuit_breaker import merge as merge_circuits
+from utils.clearance import share_clearance
+from utils.config import (
+    BatchConfig,
+    BatchConfigSchema,
+    CollapseConfig,
+    CollapseConfigSchema,
+    EncodingConfig,
+    EncodingConfigSchema,
+    StreamConfig,
+    StreamConfigSchema,
+    UpstreamConfig,
+    UpstreamConfigSchema,
+)
 from utils.dotdict import dotdict
+from utils.egress import agent_egress
+from utils.flight_recorder import FlightRecorder, current_record
+from utils.host_limiter import HostLimiter, HostLimitTimeout
+from utils.host_limiter import merge as merge_limits
+from utils.metrics import Metrics
+from utils.profile_selector import BLOCKED_STATUSES, ProfileSelector, select_profile
+from utils.response_cache import CacheEntry, ResponseCache
+from utils.retry import (
+    FAILED_ERRORS,
+    FAILED_STATUSES,
+    TIMEOUT_HEADER,
+    DeadlineExceeded,
+    backoff,
+    deadline,
+    retryable,
+    timeouts,
+)
+from utils.shard import ShardRouter, is_forwarded
+from utils.single_flight import SingleFlight
+from utils.stream import accepts, decode, is_decodable, iter_decoded, negotiate
 
 
 COOKIE_NAME = "cloudscraper-agent-id"
+COLLAPSIBLE_METHODS = {"GET", "HEAD"}
+EXCLUDED_HEADERS = {"Content-Encoding", "Transfer-Encoding", "Content-Length"}
 
 
 def construct_proxy_blueprint(
-    agent_pool: AgentPool, proxy_configs: list[dict] = [{}]
+    agent_pool: AgentPool,
+    proxy_configs: list[dict] = [{}],
+    stream_config: StreamConfig = StreamConfigSchema().load({}),
+    shard_router: ShardRouter | None = None,
+    response_cache: ResponseCache | None = None,
+    collapse_config: CollapseConfig = CollapseConfigSchema().load({}),
+    batch_config: BatchConfig = BatchConfigSchema().load({}),
+    metrics: Metrics | None = None,
+    flight_recorder: FlightRecorder | None = None,
+    encoding_config: EncodingConfig = EncodingConfigSchema().load({}),
+    host_limiter: HostLimiter | None = None,
+    profile_selector: ProfileSelector | None = None,
+    upstream_config: UpstreamConfig = UpstreamConfigSchema().load({}),
+    circuit_breaker: CircuitBreaker | None = None,
 ) -> Blueprint:
     """Construct the proxy blueprint."""
 
     log = get_logger(__name__)
+    challenge_flight = SingleFlight("challenge")
+    request_flight = None
+    if collapse_config.enabled:
+        request_flight = SingleFlight("request", window=collapse_config.window)
     bp = Blueprint("proxy", __name__, url_prefix="/proxy", description="Proxy API.")
 
     @bp.before_request
     def before_request():
         request.start_time = time()
+        if shard_router is not None and request.endpoint == "proxy.proxy":
+            # Agents owned by other workers are proxied by their owners
+            agent_id = request.args.get("agent_id", request.cookies.get(COOKIE_NAME))
+            if agent_id is not None and agent_id.isdigit():
+                response = shard_router.forward_request(request, int(agent_id))
+                if response is not None:
+                    return response
+        if flight_recorder is not None:
+            flight_recorder.start(request)
 
     @bp.after_request
     def after_request(response):
         request_time = time() - request.start_time
+        if hasattr(request, "response_start"):
+            observe("response", perf_counter() - request.response_start)
+        if flight_recorder is not None:
+            flight_recorder.finish(request, response)
         log.info(
             "Processing request.",
             endpoint=request.url_rule.rule,
@@ -42,52 +123,747 @@ def construct_proxy_blueprint(
         )
         return response
 
+    def resolve_agent(agent_id: int | None, host: str) -> tuple[int, bool]:
+        """Get the requested agent, an idle one holding cf_clearance for the host or a new one.
+
+        Returns:
+            tuple(int, bool): The agent id and whether the agent was generated.
+        """
+
+        if agent_id is None or agent_id not in agent_pool:
+            agent_id = agent_pool.route(host)
+        if agent_id is None:
+            agent_id, _ = agent_pool.generate(
+                **select_profile(proxy_configs, profile_selector, host)
+            )
+            return agent_id, True
+
+        return agent_id, False
+
+    def observe(stage: str, seconds: float) -> None:
+        """Record the time spent in the proxy request stage."""
+
+        if metrics is not None:
+            metrics.stage_seconds.observe(seconds, stage=stage)
+        if flight_recorder is not None:
+            record = current_record()
+            if record is not None:
+                record.stage(stage, seconds)
+                record.challenge |= stage == "challenge"
+
+    @contextmanager
+    def lease(agent_id: int, url: str) -> Iterator:
+        """Lease the agent, answering 404 if it's gone since it was resolved and 503 if it stays busy for the lease timeout."""
+
+        start = perf_counter()
+        with ExitStack() as stack:
+            try:
+                agent = stack.enter_context(agent_pool.use(agent_id, url))
+            except AgentNotFound as err:
+                abort(404, message=str(err))
+            except LeaseTimeout as err:
+                abort(503, message=str(err))
+            observe("lease", perf_counter() - start)
+            yield agent
+
+    @contextmanager
+    def admit(host: str, agent) -> Iterator:
+        """Wait for the destination host limits, answering 503 if the request isn't admitted in time."""
+
+        with ExitStack() as stack:
+            try:
+                waited = stack.enter_context(host_limiter.acquire(host, id(agent)))
+            except HostLimitTimeout as err:
+                abort(503, message=str(err))
+            if waited:
+                observe("limit", waited)
+            yield
+
+    def count_upstream(host: str, status: int | str) -> None:
+        """Count the upstream response."""
+
+        if metrics is not None:
+            metrics.upstream_responses.inc(host=metrics.host(host), status=status)
+
+    def upstream_deadline(headers) -> float | None:
+        """Get the upstream deadline of the request, answering 422 if its timeout header is invalid."""
+
+        try:
+            return deadline(upstream_config.deadline, headers.get(TIMEOUT_HEADER))
+        except ValueError as err:
+            abort(422, message=str(err))
+
+    def fetch(
+        agent_id: int,
+        agent,
+        generated: bool,
+        method: str,
+        url: str,
+        kwargs: dict,
+        until: float | None = None,
+    ):
+        """Make the upstream request with the agent, retrying the failed idempotent ones with a backoff until the deadline.
+
+        Answers 504 once the deadline passes and 502 or 504 if the last attempt
+        couldn't connect or timed out.
+        """
+
+        host = urlparse(url).hostname or ""
+        attempt = 0
+        while True:
+            try:
+                kwargs["timeout"] = timeouts(
+                    upstream_config.connect_timeout, upstream_config.read_timeout, until
+                )
+            except DeadlineExceeded as err:
+                abort(504, message=str(err))
+            error = response = None
+            try:
+                response = attempt_upstream(
+                    agent_id, agent, generated, method, url, kwargs
+                )
+            except FAILED_ERRORS as err:
+                error = err
+            if error is None and response.status_code not in FAILED_STATUSES:
+                return response
+            if attempt >= upstream_config.retries or not retryable(method, error):
+                break
+            if circuit_breaker is not None and circuit_breaker.state(host) != CLOSED:
+                # The last answer is passed through rather than the open circuit
+                break
+            delay = backoff(attempt, upstream_config.backoff, upstream_config.max_backoff)
+            if until is not None and monotonic() + delay >= until:
+                break
+            if response is not None:
+                response.close()
+            log.info(
+                "Retrying the upstream request.",
+                dst=url,
+                attempt=attempt + 1,
+                status=None if response is None else response.status_code,
+                error=error,
+                backoff_seconds=delay,
+            )
+            if metrics is not None:
+                metrics.upstream_retries.inc(host=metrics.host(host))
+            record = current_record() if flight_recorder is not None else None
+            if record is not None:
+                record.retries += 1
+            sleep(delay)
+            observe("backoff", delay)
+            attempt += 1
+            # The challenge was solved or shared by the first attempt
+            generated = False
+
+        if error is None:
+            # The destination answer is passed through
+            return response
+        abort(504 if isinstance(error, requests.Timeout) else 502, message=str(error))
+
+    def attempt_upstream(
+        agent_id: int, agent, generated: bool, method: str, url: str, kwargs: dict
+    ):
+        """Make the upstream request with the agent once the circuit of the destination host and its limits admit it."""
+
+        host = urlparse(url).hostname or ""
+        if circuit_breaker is not None:
+            try:
+                circuit_breaker.before(host)
+            except CircuitOpen as err:
+                abort(
+                    503,
+                    message=str(err),
+                    headers={"Retry-After": str(max(ceil(err.retry_after), 1))},
+                )
+
+        # Unknown until the request reaches the destination
+        ok = None
+        try:
+            if host_limiter is None:
+                response = observe_upstream(
+                    agent_id, agent, generated, method, url, kwargs
+                )
+            else:
+                with admit(host, agent):
+                    response = observe_upstream(
+                        agent_id, agent, generated, method, url, kwargs
+                    )
+            ok = response.status_code not in FAILED_STATUSES
+            return response
+        except FAILED_ERRORS:
+            ok = False
+            raise
+        finally:
+            if circuit_breaker is not None:
+                circuit_breaker.record(host, ok)
+
+    def observe_upstream(
+        agent_id: int, agent, generated: bool, method: str, url: str, kwargs: dict
+    ):
+        """Make the upstream request with the agent, recording the stage time and scoring its egress proxy and profile."""
+
+        egress = agent_pool.egress
+        if (
+            metrics is None
+            and flight_recorder is None
+            and egress is None
+            and profile_selector is None
+        ):
+            return request_upstream(agent, generated, method, url, kwargs)
+
+        host = urlparse(url).hostname or ""
+        clearances = clearance_cookies(agent)
+        start = perf_counter()
+        in_flight = nullcontext()
+        if metrics is not None:
+            in_flight = metrics.upstream_in_flight.track()
+        with in_flight:
+            try:
+                response = request_upstream(agent, generated, method, url, kwargs)
+            except Exception as err:
+                count_upstream(host, "error")
+                if egress is not None and isinstance(err, FAILED_ERRORS):
+                    egress.observe(agent_egress(agent), None, None)
+                observe_profile(agent_id, host, None, True)
+                raise
+        seconds = perf_counter() - start
+        # A renewed clearance means the request went through a challenge
+        challenged = clearance_cookies(agent) != clearances
+        observe("challenge" if challenged else "upstream", seconds)
+        count_upstream(host, response.status_code)
+        if egress is not None:
+            egress.observe(
+                agent_egress(agent), None if challenged else seconds, response.status_code
+            )
+        observe_profile(
+            agent_id,
+            host,
+            seconds if challenged else None,
+            response.status_code in BLOCKED_STATUSES,
+        )
+
+        return response
+
+    def observe_profile(
+        agent_id: int, host: str, challenge_seconds: float | None, blocked: bool
+    ) -> None:
+        """Score the profile the agent was generated with."""
+
+        if profile_selector is None:
+            return
+        info = agent_pool.info(agent_id)
+        if info is not None:
+            profile_selector.observe(host, info.kwargs, challenge_seconds, blocked)
+
+    def request_upstream(agent, generated: bool, method: str, url: str, kwargs: dict):
+        """Make the upstream request with the agent."""
+
+        if generated:
+            # New agents for the same host wait for the first one's request, as a
+            # challenge is only told by making it. If it solved one, they share its
+            # clearance, which is only valid for the IP address it was solved from
+            host = urlparse(url).hostname or ""
+            (leader, response, error, solved), shared = challenge_flight.do(
+                (host, agent_egress(agent)), lead, agent, method, url, kwargs
+            )
+            if not shared:
+                if error is not None:
+                    raise error
+                return response
+            if solved:
+                share_clearance(leader, agent, host)
+                record = current_record() if flight_recorder is not None else None
+                if record is not None:
+                    record.retries += 1
+
+        return agent.request(method, url, **kwargs)
+
+    def lead(agent, method: str, url: str, kwargs: dict) -> tuple:
+        """Make the request of the first new agent for the host.
+
+        Returns:
+            tuple: The agent, the response, the error and whether a challenge was
+                solved. The error is returned rather than raised, so the waiting
+                agents make their own requests instead of failing with it.
+        """
+
+        clearances = clearance_cookies(agent)
+        try:
+            response = agent.request(method, url, **kwargs)
+        except Exception as err:
+            return agent, None, err, False
+
+        return agent, response, None, clearance_cookies(agent) != clearances
+
     @bp.route("", methods=["GET", "POST", "PUT", "DELETE", "PATCH"])
     @bp.arguments(ProxyRequestParams, location="query")
     def proxy(params):
-        """Proxy the request as it is. Returns the response from the destination server. agent_id from request parameters is in precedence over the one from cookies."""
+        """Proxy the request as it is. Returns the response from the destination server. agent_id from request parameters is in precedence over the one from cookies, without either an idle agent holding cf_clearance for the destination host is reused."""
 
         params = dotdict(params)
         url = unquote(params.dst)
+        host = urlparse(url).hostname or ""
+        until = upstream_deadline(request.headers)
         agent_id = params.agent_id
         if agent_id is None:
             agent_id = request.cookies.get(COOKIE_NAME)
             if agent_id is not None:
                 agent_id = int(agent_id)
-        if agent_id is None or agent_id not in agent_pool:
-            agent_id, _ = agent_pool.generate(**choice(proxy_configs))
-
-        response = agent_pool[agent_id].request(
-            request.method,
-            url,
-            headers=filter_headers(dict(request.headers)),
-            data=request.data,
-            cookies=filter_cookies(dict(request.cookies)),
-        )
+        if flight_recorder is not None:
+            request.flight_record.host = host
+
+        stream = stream_config.enabled if params.stream is None else params.stream
+        kwargs = {
+            "headers": filter_headers(dict(request.headers)),
+            "data": request.data,
+            "cookies": filter_cookies(dict(request.cookies)),
+            "stream": stream,
+        }
+        cached = response_cache is not None and request.method == "GET"
+        cache_result = "MISS" if cached else None
+        if cached and response_cache.bypass(request.headers):
+            response_cache.record("bypass")
+            cached = False
+            cache_result = "BYPASS"
+        cache_key = cache_entry = response = None
+        if cached:
+            # Looked up before leasing, so hits don't wait for a busy agent. Without an
+            # agent the key has only the client cookies
+            agent_cookies = None
+            if agent_id is not None:
+                agent_cookies = agent_pool.cookies(agent_id)
+            cache_key = response_cache.key(url, agent_cookies or [], kwargs["cookies"])
+            cache_entry = response_cache.get(cache_key, request.headers)
+            if cache_entry is not None and cache_entry.fresh():
+                response_cache.record("hit")
+                if agent_cookies is None:
+                    agent_id = None
+                return cached_response(cache_entry, agent_id, "HIT")
+            if cache_entry is not None:
+                # Revalidate the stale entry with a conditional request
+                kwargs["headers"].update(cache_entry.validators())
 
-        # Decode chunked response
-        if "chunked" in response.headers.get("Transfer-Encoding", ""):
-            content = b"".join(response.iter_content(8192))
-        else:
-            content = response.content
+        start = perf_counter()
+        agent_id, generated = resolve_agent(agent_id, host)
+        observe("agent", perf_counter() - start)
+        if flight_recorder is not None:
+            request.flight_record.agent_id = agent_id
 
-        # Decompress gzip content
-        if response.headers.get("Content-Encoding") == "gzip":
-            if content[:2] == b"\x1f\x8b":  # Check for gzip magic numbers
-                content = gzip.decompress(content)
+        collapse = (
+            request_flight is not None
+            and request.method in COLLAPSIBLE_METHODS
+            and not stream
+        )
+        accept_encoding = None
+        if encoding_config.passthrough:
+            accept_encoding = request.headers.get("Accept-Encoding")
+        # Shared and cached bodies are kept decoded, as their clients may not accept
+        # the encoding, the others are read as they came to pass them through
+        raw = accept_encoding is not None and not cached and not collapse
+        kwargs["stream"] = stream or raw
+        collapsed = False
+
+        held = None
+        with ExitStack() as stack:
+            agent = stack.enter_context(lease(agent_id, url))
+            negotiate_encoding(agent, kwargs["headers"])
+            if cached:
+                # Stored for the site session of the leased agent
+                cache_key = response_cache.key(url, agent.cookies, kwargs["cookies"])
+            if collapse:
+                # Identical requests wait for one upstream request and share its response
+                key = (
+                    request.method,
+                    ResponseCache.key(url, agent.cookies, kwargs["cookies"]),
+                    collapse_key_headers(
+                        kwargs["headers"], collapse_config.ignore_headers
+                    ),
+                )
+                (status, headers, content), collapsed = request_flight.do(
+                    key,
+                    lambda: read_response(
+                        fetch(
+                            agent_id, agent, generated, request.method, url, kwargs, until
+                        ),
+                        observe,
+                    ),
+                )
+            else:
+                response = fetch(
+                    agent_id, agent, generated, request.method, url, kwargs, until
+                )
+            request.response_start = perf_counter()
+            if response is not None:
+                status, headers = response.status_code, response.headers
+                if stream:
+                    # The agent stays leased until the streamed body is sent
+                    held = stack.pop_all()
+                else:
+                    # The body still comes over the connection of the agent
+                    status, headers, content = read_response(
+                        response, observe, accept_encoding if raw else None
+                    )
+                    response = None
+        if cache_entry is not None and status == 304:
+            if response is not None:
+                response.close()
+                held.close()
+            response_cache.record("revalidated")
+            cache_entry = response_cache.revalidate(cache_key, cache_entry, headers)
+            return cached_response(cache_entry, agent_id, "REVALIDATED")
+        if cached:
+            response_cache.record("miss")
+        if response is not None:
+            flask_response = stream_response(response, agent_id, accept_encoding, held)
+            if cache_result is not None:
+                flask_response.headers["X-Cache"] = cache_result
+            return flask_response
 
         # Convert requests.Response to Flask response
-        flask_response = make_response(content, response.status_code)
-        for name, value in response.headers.items():
-            if name not in {"Content-Encoding", "Transfer-Encoding"}:
-                flask_response.headers[name] = value
+        flask_response = make_response(content, status)
+        for name, value in headers.items():
+            flask_response.headers[name] = value
+        flask_response.set_cookie(COOKIE_NAME, str(agent_id))
+        if cached and not collapsed:
+            response_cache.store(
+                cache_key,
+                status,
+                without_excluded(headers),
+                content,
+                request.headers,
+            )
+        if cache_result is not None:
+            flask_response.headers["X-Cache"] = cache_result
+
+        return flask_response
+
+    @bp.route("/batch", methods=["POST"])
+    @bp.arguments(ProxyBatchRequestShema, location="json")
+    @bp.response(
+        200,
+        ProxyBatchResultShema,
+        content_type="application/x-ndjson",
+        description="One JSON result per line, streamed as soon as every item completes, so slow items don't hold up fast ones.",
+    )
+    def batch(data):
+        """Proxy a batch of requests concurrently."""
+
+        items = data["items"]
+        if len(items) > batch_config.max_items:
+            return abort(
+                422, message=f"A batch may have at most {batch_config.max_items} items."
+            )
+        concurrency = min(
+            data["concurrency"] or batch_config.concurrency, batch_config.max_concurrency
+        )
+
+        return Response(
+            iter_completed(proxy_item, items, concurrency),
+            mimetype="application/x-ndjson",
+        )
+
+    def proxy_item(index: int, item: dict) -> str:
+        """Proxy the batch item, returning its result line."""
+
+        url = item["dst"]
+        body = item["body"].encode() if item["body"] is not None else None
+        agent_id = item["agent_id"]
+        result = {"index": index, "dst": url}
+        try:
+            if agent_id is not None and not (
+                shard_router is None or shard_router.is_local(agent_id)
+            ):
+                # The agent is owned by another worker
+                path = "/proxy?" + urlencode(
+                    {"agent_id": agent_id, "dst": quote(url, safe="")}
+                )
+                response = shard_router.forward(
+                    shard_router.owner(agent_id),
+                    item["method"],
+                    path,
+                    item["headers"],
+                    body,
+                )
+                status, headers, content = (
+                    response.status,
+                    dict(response.getheaders()),
+                    response.read(),
+                )
+                response.close()
+            else:
+                until = upstream_deadline(CaseInsensitiveDict(item["headers"]))
+                agent_id, generated = resolve_agent(
+                    agent_id, urlparse(url).hostname or ""
+                )
+                kwargs = {
+                    "headers": filter_headers(dict(item["headers"])),
+                    "data": body,
+                    "stream": False,
+                }
+                with agent_pool.use(agent_id, url) as agent:
+                    negotiate_encoding(agent, kwargs["headers"])
+                    status, headers, content = read_response(
+                        fetch(
+                            agent_id,
+                            agent,
+                            generated,
+                            item["method"],
+                            url,
+                            kwargs,
+                            until,
+                        ),
+                        observe,
+                    )
+            result |= {
+                "agent_id": agent_id,
+                "status": status,
+                "headers": dict(without_excluded(headers)),
+                "body": b64encode(content).decode(),
+            }
+        except Exception as err:
+            log.warning("Couldn't proxy the batch item.", dst=url, error=err)
+            # Aborted items tell the abort message
+            result["error"] = getattr(err, "data", {}).get("message", str(err))
+
+        return json.dumps(result) + "\n"
+
+    def cached_response(entry: CacheEntry, agent_id: int | None, result: str) -> Response:
+        """Convert a cache entry to a Flask response, hits without an agent set no cookie."""
+
+        flask_response = make_response(entry.body, entry.status)
+        for name, value in entry.headers:
+            flask_response.headers[name] = value
+        flask_response.headers["Age"] = str(int(time() - entry.stored_at))
+        flask_response.headers["X-Cache"] = result
+        if agent_id is not None:
+            flask_response.set_cookie(COOKIE_NAME, str(agent_id))
+
+        return flask_response
+
+    def negotiate_encoding(agent, headers: dict[str, str]) -> None:
+        """Ask the destination server only for the encodings the proxy can decode."""
+
+        agent_accept_encoding = agent.headers.get("Accept-Encoding")
+        accept_encoding = negotiate(agent_accept_encoding, encoding_config.zstd)
+        if accept_encoding != agent_accept_encoding:
+            headers["Accept-Encoding"] = accept_encoding
+
+    def stream_response(
+        response,
+        agent_id: int,
+        accept_encoding: str | None = None,
+        held: ExitStack | None = None,
+    ) -> Response:
+        """Convert a streamed requests.Response to a Flask response sending chunks as they arrive.
+
+        The body is decoded unless the client's Accept-Encoding allows its encoding.
+        The held agent lease is released once the response is closed.
+        """
+
+        content_encoding = response.headers.get("Content-Encoding")
+        decoded = is_decodable(content_encoding) and not accepts(
+            accept_encoding, content_encoding
+        )
+        headers = CaseInsensitiveDict(response.headers)
+        headers.pop("Transfer-Encoding", None)
+        if decoded:
+            # The decoded body length is unknown upfront
+            headers.pop("Content-Encoding", None)
+            headers.pop("Content-Length", None)
+        elif is_decodable(content_encoding):
+            vary_on_accept_encoding(headers)
+
+        def generate():
+            try:
+                chunks = response.raw.stream(
+                    stream_config.chunk_size, decode_content=False
+                )
+                if decoded:
+                    chunks = iter_decoded(
+                        chunks, content_encoding, stream_config.buffer_size
+                    )
+                yield from chunks
+            finally:
+                response.close()
+
+        flask_response = Response(generate(), response.status_code)
+        for name, value in headers.items():
+            flask_response.headers[name] = value
         flask_response.set_cookie(COOKIE_NAME, str(agent_id))
+        if held is not None:
+            # Called even if the body is never iterated, unlike the finally above
+            flask_response.call_on_close(held.close)
 
         return flask_response
 
+    if response_cache is not None:
+
+        @bp.route("/cache", methods=["GET"])
+        @bp.response(200, ResponseCacheStatsResponseShema)
+        def cache_stats():
+            """Get the response cache statistics."""
+
+            return jsonify(response_cache.stats()), 200
+
+        @bp.route("/cache", methods=["DELETE"])
+        @bp.response(
+            200,
+            schema={
+                "type": "object",
+                "properties": {"message": {"type": "string"}},
+            },
+        )
+        def cache_clear():
+            """Delete all cached responses."""
+
+            response_cache.clear()
+            return jsonify({"message": "All cached responses deleted"}), 200
+
+    if request_flight is not None:
+
+        @bp.route("/collapse", methods=["GET"])
+        @bp.response(200, RequestCollapseStatsResponseShema)
+        def collapse_stats():
+            """Get the request collapsing statistics."""
+
+            return jsonify(request_flight.stats()), 200
+
+    if host_limiter is not None:
+
+        @bp.route("/limit", methods=["GET"])
+        @bp.response(200, HostLimitStatsResponseShema)
+        def limit_stats():
+            """Get the queue depths of the destination hosts limited by the rate or concurrency of their requests, summed over all workers."""
+
+            stats = host_limiter.stats()
+            if shard_router is not None and not is_forwarded(request):
+                others = [
+                    json.loads(body)
+                    for status, body in shard_router.broadcast("GET", request.path, {})
+                    if status == 200
+                ]
+                stats = merge_limits([stats] + others)
+
+            return jsonify(stats), 200
+
+    if circuit_breaker is not None:
+
+        @bp.route("/breaker", methods=["GET"])
+        @bp.response(200, CircuitBreakerStatsResponseShema)
+        def breaker_stats():
+            """Get the circuits of the destination hosts with failed requests, over all workers."""
+
+            stats = circuit_breaker.stats()
+            if shard_router is not None and not is_forwarded(request):
+                others = [
+                    json.loads(body)
+                    for status, body in shard_router.broadcast("GET", request.path, {})
+                    if status == 200
+                ]
+                stats = merge_circuits([stats] + others)
+
+            return jsonify(stats), 200
+
     return bp
 
 
+def read_response(
+    response,
+    observe: Callable[[str, float], None] | None = None,
+    accept_encoding: str | None = None,
+) -> tuple[int, dict[str, str], bytes]:
+    """Read the whole requests.Response.
+
+    Args:
+        response (requests.Response): The response.
+        observe (Callable[[str, float], None] | None, optional): Called with the stage
+            name and the seconds spent decompressing the body.
+        accept_encoding (str | None, optional): The client Accept-Encoding for a
+            response requested with stream=True. Its body is read as it came and kept
+            encoded when the client accepts the encoding, otherwise it's decoded.
+            Without it requests reads and decodes the body.
+
+    Returns:
+        tuple(int, dict[str, str], bytes): The status code, the headers to send and
+            the body.
+    """
+
+    headers = CaseInsensitiveDict(response.headers)
+    headers.pop("Transfer-Encoding", None)
+    if getattr(response.request, "method", None) != "HEAD":
+        # Set for the body sent, which may be decoded
+        headers.pop("Content-Length", None)
+    content_encoding = headers.get("Content-Encoding")
+
+    # A challenge response is read by cloudscraper before it gets here
+    if accept_encoding is None or response._content_consumed is True:
+        content = response.content
+        # Some servers compress the body twice
+        if content_encoding == "gzip" and content[:2] == b"\x1f\x8b":
+            start = perf_counter()
+            content = decode(content, content_encoding)
+            if observe is not None:
+                observe("decompression", perf_counter() - start)
+        if is_decodable(content_encoding):
+            del headers["Content-Encoding"]
+        return response.status_code, headers, content
+
+    content = response.raw.read(decode_content=False)
+    response.raw.release_conn()
+    if not is_decodable(content_encoding):
+        pass
+    elif accepts(accept_encoding, content_encoding):
+        vary_on_accept_encoding(headers)
+    else:
+        start = perf_counter()
+        content = decode(content, content_encoding)
+        if observe is not None:
+            observe("decompression", perf_counter() - start)
+        del headers["Content-Encoding"]
+
+    return response.status_code, headers, content
+
+
+def vary_on_accept_encoding(headers: CaseInsensitiveDict) -> None:
+    """Tell caches the response depends on the client's Accept-Encoding."""
+
+    vary = headers.get("Vary")
+    if vary is None:
+        headers["Vary"] = "Accept-Encoding"
+    elif "accept-encoding" not in vary.lower() and vary.strip() != "*":
+        headers["Vary"] = f"{vary}, Accept-Encoding"
+
+
+def without_excluded(headers) -> CaseInsensitiveDict:
+    """Get the response headers without the ones describing the body as it was sent."""
+
+    excluded = {name.lower() for name in EXCLUDED_HEADERS}
+    return CaseInsensitiveDict(
+        (name, value) for name, value in headers.items() if name.lower() not in excluded
+    )
+
+
+def clearance_cookies(agent) -> list[str]:
+    """Get the agent's cf_clearance cookie values."""
+
+    return [cookie.value for cookie in agent.cookies if cookie.name == "cf_clearance"]
+
+
+def collapse_key_headers(
+    headers: dict[str, str], ignore_headers: list[str]
+) -> tuple[tuple[str, str], ...]:
+    """Get the proxied headers that make otherwise identical requests different."""
+
+    ignored = {name.lower() for name in ignore_headers}
+    return tuple(
+        sorted(
+            (name.lower(), value)
+            for name, value in headers.items()
+            if name.lower() not in ignored
+        )
+    )
+
+
 def filter_headers(headers: dict[str, str]) -> dict[str, str]:
     """Filter out headers that are not allowed to be proxied."""
 
@@ -97,8 +873,12 @@ def filter_headers(headers: dict[str, str]) -> dict[str, str]:
         "Accept-Language",
         "Connection",
         "Content-Length",
+        # Cookies are passed separately, so they are merged with the agent cookies
+        "Cookie",
         "Host",
         "User-Agent",
+        # Tells the proxy the upstream deadline
+        TIMEOUT_HEADER,
     ]
     for header in disallowed_headers:
         headers.pop(header, None)
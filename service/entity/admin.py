@@ -0,0 +1,113 @@
+"""Admin request form."""
+
+from marshmallow import Schema, fields
+
+
+class FlightRecordShema(Schema):
+    """Recorded request schema."""
+
+    started = fields.Float(required=True, description="Start timestamp.")
+    method = fields.String(required=True, description="HTTP method.")
+    endpoint = fields.String(required=True, description="Endpoint rule.")
+    status = fields.Integer(required=True, description="Response status code.")
+    duration = fields.Float(
+        required=True, description="Seconds until the response was returned."
+    )
+    stages = fields.Dict(
+        keys=fields.String(),
+        values=fields.Float(),
+        required=True,
+        description="Seconds spent in every stage of the request.",
+    )
+    agent_id = fields.Integer(required=True, allow_none=True, description="Agent ID.")
+    host = fields.String(required=True, allow_none=True, description="Destination host.")
+    challenge = fields.Boolean(
+        required=True, description="Whether a challenge was solved on the way."
+    )
+    retries = fields.Integer(
+        required=True, description="Upstream requests repeated after the first one."
+    )
+    bytes_in = fields.Integer(required=True, description="Request body size.")
+    bytes_out = fields.Integer(
+        required=True,
+        allow_none=True,
+        description="Response body size, unknown for streamed responses.",
+    )
+
+
+class FlightRecorderResponseShema(Schema):
+    """Flight recorder response schema."""
+
+    recorded = fields.Integer(required=True, description="Requests recorded.")
+    slowest = fields.List(
+        fields.Nested(FlightRecordShema),
+        required=True,
+        description="The slowest requests, the slowest first.",
+    )
+    sample = fields.List(
+        fields.Nested(FlightRecordShema),
+        required=True,
+        description="Sampled recent requests, the latest first.",
+    )
+
+
+class ProfileSelectionShema(Schema):
+    """Agent profile outcomes on a destination host schema."""
+
+    host = fields.String(
+        required=True, description="Destination host, * for the total of all hosts."
+    )
+    profile = fields.Integer(
+        required=True, description="Index of the profile in the proxy config."
+    )
+    config = fields.Dict(required=True, description="The proxy config entry.")
+    selected = fields.Integer(
+        required=True, description="Agents generated with the profile for the host."
+    )
+    requests = fields.Integer(
+        required=True, description="Requests the agents of the profile made."
+    )
+    challenges = fields.Integer(
+        required=True, description="Requests that went through a challenge solve."
+    )
+    challenge_seconds = fields.Float(
+        required=True, description="Seconds of the challenge solves in total."
+    )
+    blocked = fields.Integer(
+        required=True, description="Failed requests and 403, 429 or 503 responses."
+    )
+    score = fields.Float(
+        required=True,
+        allow_none=True,
+        description="Moving score between 0 and 1, null before the first request.",
+    )
+
+
+class ProfileSelectionParamsShema(Schema):
+    """Agent profile selection statistics request params schema."""
+
+    host = fields.String(
+        missing=None,
+        allow_none=True,
+        description="Destination host, all hosts and their total by default.",
+    )
+
+
+class ProfileRequestParamsShema(Schema):
+    """Stack sampling profile request params schema."""
+
+    seconds = fields.Float(
+        missing=10,
+        validate=lambda t: t > 0,
+        description="Seconds to sample for, capped by the service.",
+    )
+    idle = fields.Boolean(
+        missing=False,
+        description="Sample the waiting greenlets too, for a wall clock rather than a CPU view.",
+    )
+    shard = fields.Integer(
+        missing=None,
+        allow_none=True,
+        validate=lambda n: n >= 0,
+        description="Worker to profile, the one receiving the request by default.",
+    )
@@ -7,6 +7,11 @@ class EphemeralAgentRequestParamsShema(Schema):
     """Proxy request form."""
 
     url = fields.String(required=True)
+    refresh = fields.Boolean(
+        required=False,
+        missing=False,
+        description="Solve a new clearance even if a cached one is still valid.",
+    )
 
 
 class BrowserOptionsSchema(Schema):
@@ -101,3 +106,152 @@ class AgentRequestShortResponseShema(Schema):
     """Agent request short response schema."""
 
     id = fields.Integer(required=True, description="Agent ID.")
+
+
+class AgentPoolEvictionsShema(Schema):
+    """Agent pool eviction counters schema."""
+
+    capacity = fields.Integer(
+        required=True, description="Agents evicted due to the max agents limit."
+    )
+    memory = fields.Integer(
+        required=True, description="Agents evicted due to the memory budget."
+    )
+    ttl = fields.Integer(required=True, description="Agents expired due to idle TTL.")
+
+
+class AgentLeaseStatsShema(Schema):
+    """Agent lease statistics schema."""
+
+    acquired = fields.Integer(required=True, description="Agent leases for requests.")
+    contended = fields.Integer(
+        required=True, description="Leases that waited for a busy agent."
+    )
+    timeouts = fields.Integer(
+        required=True, description="Requests that gave up waiting for a busy agent."
+    )
+    wait_seconds = fields.Float(
+        required=True, description="Seconds requests waited for busy agents."
+    )
+    waiting = fields.Integer(
+        required=True, description="Requests waiting for a busy agent."
+    )
+
+
+class AgentContentionShema(Schema):
+    """Lease statistics of a contended agent."""
+
+    id = fields.Integer(required=True, description="Agent ID.")
+    in_flight = fields.Integer(required=True, description="Requests using the agent.")
+    waiting = fields.Integer(required=True, description="Requests waiting for the agent.")
+    leases = fields.Integer(required=True, description="Leases of the agent.")
+    contended = fields.Integer(
+        required=True, description="Leases that waited for the agent."
+    )
+    timeouts = fields.Integer(
+        required=True, description="Requests that gave up waiting for the agent."
+    )
+    wait_seconds = fields.Float(
+        required=True, description="Seconds requests waited for the agent."
+    )
+
+
+class AgentContentionParamsShema(Schema):
+    """Agent contention request parameters schema."""
+
+    limit = fields.Integer(
+        missing=10,
+        validate=validate.Range(min=1, max=1000),
+        description="Maximum number of agents.",
+    )
+
+
+class EgressStatsShema(Schema):
+    """Outbound proxy statistics schema."""
+
+    name = fields.String(required=True, description="Proxy name, host:port by default.")
+    weight = fields.Float(required=True, description="Proxy weight.")
+    agents = fields.Integer(required=True, description="Agents pinned to the proxy.")
+    requests = fields.Integer(
+        required=True, description="Upstream requests made through the proxy."
+    )
+    errors = fields.Integer(
+        required=True,
+        description="Upstream requests failing to connect, timing out or getting 429.",
+    )
+    timed = fields.Integer(
+        required=True, description="Upstream requests without a challenge solve."
+    )
+    seconds = fields.Float(
+        required=True, description="Seconds of the requests without a challenge solve."
+    )
+    error_rate = fields.Float(required=True, description="Moving error rate.")
+    latency_seconds = fields.Float(
+        required=True, description="Moving request latency in seconds."
+    )
+    ejections = fields.Integer(
+        required=True, description="Times the proxy was ejected as unhealthy."
+    )
+    ejected = fields.Boolean(
+        required=True, description="Whether new agents skip the proxy for now."
+    )
+
+
+class AgentReserveStatsShema(Schema):
+    """Agent reserve statistics schema."""
+
+    size = fields.Integer(required=True, description="Number of ready agents.")
+    hits = fields.Integer(required=True, description="Agents taken from the reserve.")
+    misses = fields.Integer(
+        required=True, description="Agents built synchronously on the request path."
+    )
+    hit_rate = fields.Float(
+        required=True, description="Share of agents taken from the reserve."
+    )
+    refills = fields.Integer(required=True, description="Agents built in the background.")
+    refill_seconds_avg = fields.Float(
+        required=True, description="Average background build time in seconds."
+    )
+
+
+class ClearanceRefreshStatsShema(Schema):
+    """Clearance refresh statistics schema."""
+
+    scheduled = fields.Integer(required=True, description="Scheduled refreshes.")
+    refreshed = fields.Integer(required=True, description="Renewed clearances.")
+    skipped = fields.Integer(
+        required=True, description="Refreshes skipped as the agent was idle."
+    )
+    failed = fields.Integer(required=True, description="Failed refreshes.")
+
+
+class ChallengePoolStatsShema(Schema):
+    """Challenge pool statistics schema."""
+
+    workers = fields.Integer(required=True, description="Running worker processes.")
+    queued = fields.Integer(
+        required=True, description="Challenges waiting for a free worker."
+    )
+    in_flight = fields.Integer(required=True, description="Challenges being solved.")
+    spawned = fields.Integer(required=True, description="Worker processes started.")
+    solves = fields.Integer(required=True, description="Solved challenges.")
+    failures = fields.Integer(required=True, description="Failed challenges.")
+    solve_seconds_avg = fields.Float(
+        required=True, description="Average solve time in seconds."
+    )
+
+
+class AgentPoolStatsResponseShema(Schema):
+    """Agent pool statistics response schema."""
+
+    size = fields.Integer(required=True, description="Number of agents in the pool.")
+    memory = fields.Integer(
+        required=True, description="Approximate memory footprint of the pool in bytes."
+    )
+    created = fields.Integer(required=True, description="Generated agents.")
+    evictions = fields.Nested(AgentPoolEvictionsShema, required=True)
+    leases = fields.Nested(AgentLeaseStatsShema, required=True)
+    reserve = fields.Nested(AgentReserveStatsShema, required=False)
+    refresh = fields.Nested(ClearanceRefreshStatsShema, required=False)
+    challenge = fields.Nested(ChallengePoolStatsShema, required=False)
+    egress = fields.List(fields.Nested(EgressStatsShema), required=False)
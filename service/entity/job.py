@@ -0,0 +1,98 @@
+"""Job request form."""
+
+from entity.agent import EphemeralAgentRequestDataShema, PersistentAgentRequestDataShema
+from marshmallow import Schema, fields, validate
+
+
+class JobRequestParamsShema(Schema):
+    """Job request params schema."""
+
+    wait = fields.Float(
+        missing=0,
+        validate=lambda t: t >= 0,
+        description="Seconds to wait for the job to finish, capped by the service.",
+    )
+
+
+class PersistentAgentJobRequestDataShema(PersistentAgentRequestDataShema):
+    """Persistent agent job payload schema."""
+
+    count = fields.Integer(
+        missing=1,
+        validate=lambda n: n > 0,
+        description="Number of agents to create.",
+    )
+    url = fields.String(
+        required=False,
+        allow_none=True,
+        description="Solve the challenge of this URL with every created agent.",
+    )
+
+
+class EphemeralAgentJobRequestDataShema(EphemeralAgentRequestDataShema):
+    """Ephemeral agent job payload schema."""
+
+    urls = fields.List(
+        fields.String(),
+        required=True,
+        validate=validate.Length(min=1),
+        description="URLs to solve the challenges for.",
+    )
+    refresh = fields.Boolean(
+        missing=False,
+        description="Solve new clearances even if cached ones are still valid.",
+    )
+
+
+class JobResultShema(Schema):
+    """Job item result schema."""
+
+    id = fields.Integer(required=False, description="Agent ID.")
+    url = fields.String(required=False, description="URL the challenge was solved for.")
+    user_agent = fields.String(required=False, description="Generated user agent.")
+    cf_clearance = fields.String(required=False, description="Obtained cf_clearance.")
+    error = fields.String(required=False, description="Error if the item failed.")
+
+
+class JobResponseShema(Schema):
+    """Job response schema."""
+
+    id = fields.Integer(required=True, description="Job ID.")
+    kind = fields.String(
+        required=True,
+        validate=validate.OneOf(["persistent", "ephemeral"]),
+        description="Job kind.",
+    )
+    status = fields.String(
+        required=True,
+        validate=validate.OneOf(["queued", "running", "done", "failed"]),
+        description="Job status. A job fails when all its items fail.",
+    )
+    total = fields.Integer(required=True, description="Number of items.")
+    completed = fields.Integer(required=True, description="Number of finished items.")
+    failed = fields.Integer(required=True, description="Number of failed items.")
+    created = fields.Float(required=True, description="Submission timestamp.")
+    finished = fields.Float(
+        required=True, allow_none=True, description="Completion timestamp."
+    )
+    results = fields.List(
+        fields.Nested(JobResultShema),
+        required=True,
+        allow_none=True,
+        description="Item results in the item order, once the job is finished.",
+    )
+
+
+class JobQueueStatsResponseShema(Schema):
+    """Job queue statistics response schema."""
+
+    queued = fields.Integer(required=True, description="Jobs waiting for a worker.")
+    running = fields.Integer(required=True, description="Jobs being run.")
+    finished = fields.Integer(
+        required=True, description="Finished jobs kept until their results expire."
+    )
+    submitted = fields.Integer(required=True, description="Submitted jobs.")
+    rejected = fields.Integer(
+        required=True, description="Jobs rejected as the queue was full."
+    )
+    expired = fields.Integer(required=True, description="Jobs with expired results.")
@@ -1,6 +1,6 @@
 """Proxy request form."""
 
-from marshmallow import Schema, fields
+from marshmallow import Schema, fields, validate
 
 
 class ProxyRequestParams(Schema):
@@ -8,3 +8,189 @@ class ProxyRequestParams(Schema):
 
     agent_id = fields.Integer(required=False)
     dst = fields.String(required=True)
+    stream = fields.Boolean(
+        required=False,
+        description="Stream the response instead of buffering it. Overrides the service default.",
+    )
+
+
+class ResponseCacheDiskStatsShema(Schema):
+    """Response cache disk tier statistics schema."""
+
+    entries = fields.Integer(required=True, description="Responses cached on disk.")
+    size = fields.Integer(required=True, description="Size of the cached files in bytes.")
+    evictions = fields.Integer(
+        required=True, description="Responses evicted due to the byte budget."
+    )
+
+
+class ResponseCacheStatsResponseShema(Schema):
+    """Response cache statistics response schema."""
+
+    entries = fields.Integer(required=True, description="Responses cached in memory.")
+    memory = fields.Integer(
+        required=True, description="Size of the responses cached in memory in bytes."
+    )
+    hit = fields.Integer(required=True, description="Responses served from the cache.")
+    miss = fields.Integer(
+        required=True, description="Responses fetched from the destination."
+    )
+    revalidated = fields.Integer(
+        required=True,
+        description="Stale responses confirmed by the destination and served from the cache.",
+    )
+    bypass = fields.Integer(required=True, description="Requests bypassing the cache.")
+    hit_ratio = fields.Float(
+        required=True, description="Share of the lookups served from the cache."
+    )
+    stores = fields.Integer(required=True, description="Stored responses.")
+    evictions = fields.Integer(
+        required=True, description="Responses evicted from memory."
+    )
+    disk = fields.Nested(ResponseCacheDiskStatsShema, required=False)
+
+
+class RequestCollapseStatsResponseShema(Schema):
+    """Request collapsing statistics response schema."""
+
+    in_flight = fields.Integer(
+        required=True, description="Upstream requests in flight followers can join."
+    )
+    flights = fields.Integer(required=True, description="Upstream requests made.")
+    coalesced = fields.Integer(
+        required=True, description="Collapsed followers served by another request."
+    )
+
+
+class HostLimitStatsShema(Schema):
+    """Destination host limit statistics schema."""
+
+    host = fields.String(required=True, description="Destination host.")
+    pattern = fields.String(required=True, description="Pattern of the host rule.")
+    queued = fields.Integer(required=True, description="Requests waiting for the host.")
+    agents = fields.Integer(required=True, description="Agents with waiting requests.")
+    active = fields.Integer(
+        required=True, description="Upstream requests admitted and not finished yet."
+    )
+    tokens = fields.Float(
+        required=True,
+        allow_none=True,
+        description="Requests the rate allows right now, null without a rate.",
+    )
+    delayed = fields.Integer(required=True, description="Requests that were queued.")
+    wait_seconds = fields.Float(
+        required=True, description="Seconds the requests waited in total."
+    )
+    timeouts = fields.Integer(
+        required=True, description="Requests that gave up waiting and got 503."
+    )
+
+
+class HostLimitStatsResponseShema(Schema):
+    """Destination host limits statistics response schema."""
+
+    queued = fields.Integer(required=True, description="Requests waiting for any host.")
+    active = fields.Integer(
+        required=True, description="Upstream requests admitted to the limited hosts."
+    )
+    hosts = fields.List(
+        fields.Nested(HostLimitStatsShema),
+        required=True,
+        description="Limited hosts seen recently, the longest queues first.",
+    )
+
+
+class CircuitStatsShema(Schema):
+    """Destination host circuit schema."""
+
+    host = fields.String(required=True, description="Destination host.")
+    state = fields.String(
+        required=True,
+        validate=validate.OneOf(["closed", "open", "half_open"]),
+        description="Circuit state, open fails the requests right away and half_open lets one probe request through.",
+    )
+    failures = fields.Integer(required=True, description="Requests failed in a row.")
+    rejected = fields.Integer(
+        required=True, description="Requests failed right away with 503."
+    )
+    retry_after = fields.Float(
+        required=True,
+        allow_none=True,
+        description="Seconds until a probe request is let through, null unless open.",
+    )
+
+
+class CircuitBreakerStatsResponseShema(Schema):
+    """Circuit breaker statistics response schema."""
+
+    open = fields.Integer(required=True, description="Hosts with an open circuit.")
+    rejected = fields.Integer(
+        required=True, description="Requests failed right away with 503."
+    )
+    transitions = fields.Dict(
+        keys=fields.String(),
+        values=fields.Integer(),
+        required=True,
+        description="Circuit state changes by the new state.",
+    )
+    hosts = fields.List(
+        fields.Nested(CircuitStatsShema),
+        required=True,
+        description="Hosts with failed requests, for every worker.",
+    )
+
+
+class ProxyBatchItemShema(Schema):
+    """Proxy batch item schema."""
+
+    method = fields.String(
+        missing="GET",
+        validate=validate.OneOf(["GET", "HEAD", "POST", "PUT", "DELETE", "PATCH"]),
+        description="HTTP method.",
+    )
+    dst = fields.String(required=True, description="Destination URL.")
+    headers = fields.Dict(
+        keys=fields.String(),
+        values=fields.String(),
+        missing=dict,
+        description="Request headers.",
+    )
+    body = fields.String(
+        missing=None, allow_none=True, description="Request body as UTF-8 text."
+    )
+    agent_id = fields.Integer(
+        missing=None,
+        allow_none=True,
+        description="Agent ID. Without it an idle agent holding cf_clearance for the destination host is reused or a new one is created.",
+    )
+
+
+class ProxyBatchRequestShema(Schema):
+    """Proxy batch request schema."""
+
+    items = fields.List(
+        fields.Nested(ProxyBatchItemShema),
+        required=True,
+        validate=validate.Length(min=1),
+        description="Requests to proxy.",
+    )
+    concurrency = fields.Integer(
+        missing=None,
+        allow_none=True,
+        validate=lambda n: n > 0,
+        description="Maximum number of items proxied at once, capped by the service.",
+    )
+
+
+class ProxyBatchResultShema(Schema):
+    """Proxy batch result schema, one per line of the response."""
+
+    index = fields.Integer(required=True, description="Index of the item in the batch.")
+    dst = fields.String(required=True, description="Destination URL.")
+    agent_id = fields.Integer(required=False, description="Agent ID the item used.")
+    status = fields.Integer(required=False, description="Destination status code.")
+    headers = fields.Dict(required=False, description="Destination response headers.")
+    body = fields.String(
+        required=False, description="Destination response body, base64 encoded."
+    )
+    error = fields.String(required=False, description="Error if the item failed.")
@@ -1,14 +1,20 @@
 """Main entry point for the backend service."""
 
 import logging
+import os
+import signal
+import sys
 from datetime import datetime
 from json import dumps, loads
 from json.encoder import JSONEncoder
 
 from __version__ import __version__
+from controller.admin_controller import construct_admin_blueprint
 from controller.ephemeral_agent_controller import (
     construct_ephemeral_agent_blueprint,
 )
+from controller.job_controller import construct_job_blueprint
+from controller.metrics_controller import construct_metrics_blueprint
 from controller.persistent_agent_controller import construct_persistent_agent_blueprint
 from controller.proxy_controller import construct_proxy_blueprint
 from flask import Flask
@@ -16,11 +22,35 @@ from flask.json.provider import JSONProvider
 from flask_smorest import Api
 from structlog import get_logger
 from utils.agent_pool import AgentPool
+from utils.agent_reserve import AgentReserve
+from utils.agent_snapshot import AgentSnapshotter
+from utils.challenge_pool import ChallengePool
+from utils.circuit_breaker import CircuitBreaker
+from utils.clearance import ClearanceCache
+from utils.clearance_refresher import ClearanceRefresher
 from utils.config import Config
+from utils.egress import EgressPool
+from utils.flight_recorder import FlightRecorder
+from utils.host_limiter import HostLimiter
+from utils.jobs import JobQueue
 from utils.logger import StructlogHandler, setup_logging
+from utils.metrics import Metrics
+from utils.profile_selector import ProfileSelector
+from utils.profiler import RequestProfiler, StackSampler
+from utils.response_cache import ResponseCache
+from utils.shard import ShardRouter
 
 config = Config.parse_config()
-setup_logging(filename=config.log.path, log_level=config.log.level, dev=config.log.dev)
+log_queue = setup_logging(
+    filename=config.log.path,
+    log_level=config.log.level,
+    dev=config.log.dev,
+    queue=config.log.queue,
+    queue_size=config.log.queue_size,
+    batch_size=config.log.batch_size,
+    flush_interval=config.log.flush_interval,
+    access_sample_rate=config.log.access_sample_rate,
+)
 log = get_logger(__name__)
 
 
@@ -68,19 +98,274 @@ def create_app() -> tuple[Flask, Api]:
     return app, api
 
 
-def register_blueprints(app: Api, agent_pool: AgentPool):
+def register_blueprints(
+    app: Api,
+    agent_pool: AgentPool,
+    clearance_cache: ClearanceCache,
+    shard_router: ShardRouter | None,
+    challenge_pool: ChallengePool | None,
+    response_cache: ResponseCache | None,
+    job_queue: JobQueue,
+    metrics: Metrics | None,
+    flight_recorder: FlightRecorder | None,
+    stack_sampler: StackSampler | None,
+    request_profiler: RequestProfiler | None,
+    host_limiter: HostLimiter | None,
+    profile_selector: ProfileSelector | None,
+    circuit_breaker: CircuitBreaker | None,
+):
     """Register the blueprints."""
 
-    app.register_blueprint(construct_persistent_agent_blueprint(agent_pool, config.proxy))
-    app.register_blueprint(construct_ephemeral_agent_blueprint(config.proxy))
-    app.register_blueprint(construct_proxy_blueprint(agent_pool, config.proxy))
+    if metrics is not None:
+        app.register_blueprint(construct_metrics_blueprint(metrics, shard_router))
+    app.register_blueprint(
+        construct_persistent_agent_blueprint(
+            agent_pool,
+            config.proxy,
+            shard_router,
+            challenge_pool,
+            flight_recorder,
+            profile_selector,
+        )
+    )
+    app.register_blueprint(
+        construct_ephemeral_agent_blueprint(
+            config.proxy, clearance_cache, flight_recorder, profile_selector
+        )
+    )
+    app.register_blueprint(
+        construct_proxy_blueprint(
+            agent_pool,
+            config.proxy,
+            config.stream,
+            shard_router,
+            response_cache,
+            config.collapse,
+            config.batch,
+            metrics,
+            flight_recorder,
+            config.encoding,
+            host_limiter,
+            profile_selector,
+            config.upstream,
+            circuit_breaker,
+        )
+    )
+    app.register_blueprint(
+        construct_job_blueprint(
+            agent_pool,
+            job_queue,
+            config.proxy,
+            clearance_cache,
+            shard_router,
+            config.job,
+            profile_selector,
+            config.upstream,
+        )
+    )
+    app.register_blueprint(
+        construct_admin_blueprint(
+            flight_recorder,
+            shard_router,
+            stack_sampler,
+            request_profiler,
+            config.profiler,
+            profile_selector,
+        )
+    )
 
 
 app, api = create_app()
-agent_pool = AgentPool()
-register_blueprints(api, agent_pool)
+shard_router = None
+if config.shard.count > 1:
+    shard_router = ShardRouter(
+        config.shard.index,
+        config.shard.count,
+        config.shard.socket_dir,
+        timeout=config.shard.timeout,
+    )
+challenge_pool = None
+if config.challenge.enabled:
+    challenge_pool = ChallengePool(
+        config.challenge.workers,
+        timeout=config.challenge.timeout,
+        node=config.challenge.node,
+    )
+agent_reserve = AgentReserve(
+    config.proxy,
+    low_watermark=config.reserve.low_watermark,
+    high_watermark=config.reserve.high_watermark,
+)
+egress_pool = None
+if config.egress.proxies:
+    egress_pool = EgressPool(
+        config.egress.proxies,
+        strategy=config.egress.strategy,
+        error_threshold=config.egress.error_threshold,
+        latency_threshold=config.egress.latency_threshold,
+        min_requests=config.egress.min_requests,
+        eject_seconds=config.egress.eject_seconds,
+        decay=config.egress.decay,
+    )
+agent_pool = AgentPool(
+    max_agents=config.pool.max_agents,
+    idle_ttl=config.pool.idle_ttl,
+    max_memory=config.pool.max_memory,
+    reserve=agent_reserve,
+    shard=config.shard.index,
+    shards=config.shard.count,
+    max_parallel=config.pool.max_parallel,
+    lease_timeout=config.pool.lease_timeout,
+    egress=egress_pool,
+)
+host_limiter = None
+if config.limit.rate or config.limit.max_concurrency or config.limit.hosts:
+    host_limiter = HostLimiter(
+        config.limit.hosts,
+        rate=config.limit.rate,
+        burst=config.limit.burst,
+        max_concurrency=config.limit.max_concurrency,
+        max_wait=config.limit.max_wait,
+        shards=config.shard.count,
+    )
+circuit_breaker = None
+if config.breaker.enabled:
+    circuit_breaker = CircuitBreaker(
+        failures=config.breaker.failures,
+        open_seconds=config.breaker.open_seconds,
+        max_hosts=config.breaker.max_hosts,
+    )
+clearance_refresher = None
+if config.refresh.enabled:
+    clearance_refresher = ClearanceRefresher(
+        agent_pool,
+        lead_time=config.refresh.lead_time,
+        active_window=config.refresh.active_window,
+        max_concurrency=config.refresh.max_concurrency,
+    )
+profile_selector = None
+if config.selection.enabled:
+    profile_selector = ProfileSelector(
+        config.proxy,
+        exploration=config.selection.exploration,
+        decay=config.selection.decay,
+        solve_seconds=config.selection.solve_seconds,
+        max_hosts=config.selection.max_hosts,
+    )
+clearance_cache = ClearanceCache(
+    max_size=config.clearance_cache.max_size,
+    default_ttl=config.clearance_cache.default_ttl,
+    margin=config.clearance_cache.margin,
+    profile_selector=profile_selector,
+)
+agent_snapshotter = None
+if config.snapshot.path is not None:
+    snapshot_path = config.snapshot.path
+    if shard_router is not None:
+        # Every worker saves its own shard of the pool
+        snapshot_path = f"{snapshot_path}.{config.shard.index}"
+    agent_snapshotter = AgentSnapshotter(agent_pool, snapshot_path)
+response_cache = None
+if config.cache.enabled:
+    disk_path = config.cache.disk_path
+    if disk_path is not None and shard_router is not None:
+        # Every worker keeps its own disk tier
+        disk_path = os.path.join(disk_path, str(config.shard.index))
+    response_cache = ResponseCache(
+        max_entries=config.cache.max_entries,
+        max_memory=config.cache.max_memory,
+        max_entry_size=config.cache.max_entry_size,
+        max_ttl=config.cache.max_ttl,
+        disk_path=disk_path,
+        disk_max_size=config.cache.disk_max_size,
+    )
+metrics = None
+if config.metrics.enabled:
+    metrics = Metrics(max_hosts=config.metrics.max_hosts, buckets=config.metrics.buckets)
+    metrics.track_pool(agent_pool)
+    if egress_pool is not None:
+        metrics.track_egress(egress_pool)
+    if host_limiter is not None:
+        metrics.track_limits(host_limiter)
+    if circuit_breaker is not None:
+        metrics.track_breaker(circuit_breaker)
+    if log_queue is not None:
+        metrics.track_log(log_queue)
+flight_recorder = None
+if config.flight_recorder.enabled:
+    flight_recorder = FlightRecorder(
+        slowest=config.flight_recorder.slowest,
+        sample_size=config.flight_recorder.sample_size,
+        sample_rate=config.flight_recorder.sample_rate,
+    )
+stack_sampler = request_profiler = None
+if config.profiler.enabled:
+    stack_sampler = StackSampler(config.profiler.interval)
+    request_profiler = RequestProfiler(
+        config.profiler.max_profiles, shard=config.shard.index, shards=config.shard.count
+    )
+job_queue = JobQueue(
+    workers=config.job.workers,
+    max_queued=config.job.max_queued,
+    ttl=config.job.ttl,
+    concurrency=config.job.concurrency,
+    shard=config.shard.index,
+    shards=config.shard.count,
+)
+register_blueprints(
+    api,
+    agent_pool,
+    clearance_cache,
+    shard_router,
+    challenge_pool,
+    response_cache,
+    job_queue,
+    metrics,
+    flight_recorder,
+    stack_sampler,
+    request_profiler,
+    host_limiter,
+    profile_selector,
+    circuit_breaker,
+)
+
+
+def start():
+    """Start the background work of the service. Called once the worker runs, so importing the app has no side effects."""
+
+    if challenge_pool is not None:
+        challenge_pool.install()
+    if agent_snapshotter is not None:
+        agent_snapshotter.restore()
+        agent_snapshotter.start(config.snapshot.interval)
+    agent_pool.start_expiry(config.pool.expiry_interval)
+    agent_reserve.start(config.reserve.interval)
+    if clearance_refresher is not None:
+        clearance_refresher.start(config.refresh.interval)
+    job_queue.start()
+    if shard_router is not None:
+        shard_router.serve(app)
+
+
+def save_snapshot():
+    """Save the agent pool snapshot if snapshots are enabled."""
+
+    if agent_snapshotter is not None:
+        agent_snapshotter.save()
+
+
+def handle_sigterm(signum, frame):
+    """Save the agent pool snapshot and write the queued log before the development server exits."""
+
+    save_snapshot()
+    if log_queue is not None:
+        log_queue.stop()
+    sys.exit(0)
+
 
 if __name__ == "__main__":
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    start()
     log.info(
         "Starting development Cloudscraper Proxy service.",
         host=config.host,
@@ -1,7 +1,12 @@
 import unittest
+from http.cookiejar import Cookie
+from threading import Thread
+from time import sleep, time
 from unittest.mock import MagicMock, patch
 
-from utils.agent_pool import AgentPool
+import requests
+
+from utils.agent_pool import AGENT_BASE_SIZE, AgentNotFound, AgentPool, LeaseTimeout
 
 
 class TestAgentPool(unittest.TestCase):
@@ -22,6 +27,221 @@ class TestAgentPool(unittest.TestCase):
             agent_id, agent = agent_pool.generate()
             self.assertEqual(agent_id, 2)
             self.assertEqual(agent, mock_cloudscraper.create_scraper.return_value)
+            self.assertEqual(agent_pool.created, 2)
+
+    def test_capacity_eviction(self):
+        agent_pool = AgentPool(max_agents=2)
+        agent_pool[1] = MagicMock()
+        agent_pool[2] = MagicMock()
+
+        # Touch the first agent, so the second one becomes the least recently used
+        agent_pool[1]
+        agent_pool[3] = MagicMock()
+
+        self.assertEqual(agent_pool.keys(), [1, 3])
+        self.assertEqual(agent_pool.evictions["capacity"], 1)
+
+    def test_memory_eviction(self):
+        agent_pool = AgentPool(max_memory=2 * AGENT_BASE_SIZE)
+        for agent_id in range(1, 4):
+            agent_pool[agent_id] = MagicMock()
+
+        self.assertEqual(agent_pool.keys(), [2, 3])
+        self.assertEqual(agent_pool.evictions["memory"], 1)
+        self.assertEqual(agent_pool.stats()["memory"], 2 * AGENT_BASE_SIZE)
+
+    def test_expire(self):
+        agent_pool = AgentPool(idle_ttl=60)
+        agent_pool[1] = MagicMock()
+        agent_pool[2] = MagicMock()
+        agent_pool.info(1).last_used -= 120
+
+        self.assertEqual(agent_pool.expire(), 1)
+        self.assertNotIn(1, agent_pool)
+        self.assertIn(2, agent_pool)
+        self.assertEqual(agent_pool.evictions["ttl"], 1)
+
+    def test_dict_api(self):
+        agent_pool = AgentPool()
+        agent_pool[1] = MagicMock()
+        agent_pool[2] = MagicMock()
+
+        agent_pool.pop(1, None)
+        agent_pool.pop(99, None)
+        del agent_pool[2]
+        self.assertEqual(len(agent_pool), 0)
+        self.assertEqual(
+            agent_pool.stats(),
+            {
+                "size": 0,
+                "memory": 0,
+                "created": 0,
+                "evictions": {"capacity": 0, "memory": 0, "ttl": 0},
+                "leases": {
+                    "acquired": 0,
+                    "contended": 0,
+                    "timeouts": 0,
+                    "wait_seconds": 0.0,
+                    "waiting": 0,
+                },
+            },
+        )
+
+        agent_pool[3] = MagicMock()
+        agent_pool.clear()
+        self.assertEqual(agent_pool.items(), [])
+        self.assertEqual(agent_pool.agent_id, 0)
+
+    def test_route(self):
+        agent_pool = AgentPool()
+        agent_pool[1] = self._agent("cf_clearance", ".example.com", time() + 60)
+        agent_pool[2] = self._agent("cf_clearance", "other.com", time() + 60)
+        agent_pool[3] = self._agent("cf_clearance", ".expired.com", time() - 60)
+        agent_pool[4] = self._agent("session", ".example.com", None)
+        for agent_id in agent_pool.keys():
+            agent_pool.index(agent_id)
+
+        self.assertEqual(agent_pool.route("www.example.com"), 1)
+        self.assertEqual(agent_pool.route("example.com"), 1)
+        self.assertEqual(agent_pool.route("other.com"), 2)
+        self.assertIsNone(agent_pool.route("expired.com"))
+        self.assertIsNone(agent_pool.route("unknown.com"))
+
+        # Busy agents aren't routed
+        with agent_pool.use(1):
+            self.assertIsNone(agent_pool.route("example.com"))
+        self.assertEqual(agent_pool.route("example.com"), 1)
+
+        # Removed agents are unindexed
+        agent_pool.pop(1)
+        self.assertIsNone(agent_pool.route("example.com"))
+
+    def test_use_indexes_agent(self):
+        agent_pool = AgentPool()
+        agent_pool[1] = requests.Session()
+
+        with agent_pool.use(1) as agent:
+            agent.cookies.set_cookie(
+                self._cookie("cf_clearance", ".example.com", time() + 60)
+            )
+        self.assertEqual(agent_pool.route("example.com"), 1)
+
+        with agent_pool.use(1) as agent:
+            agent.cookies.clear()
+        self.assertIsNone(agent_pool.route("example.com"))
+
+    def test_use_exclusive_fifo(self):
+        agent_pool = AgentPool()
+        agent_pool[1] = requests.Session()
+        order = []
+
+        def use(name):
+            with agent_pool.use(1):
+                order.append(name)
+
+        with agent_pool.use(1):
+            threads = []
+            for name in ["first", "second", "third"]:
+                threads.append(Thread(target=use, args=(name,)))
+                threads[-1].start()
+                while agent_pool.stats()["leases"]["waiting"] < len(threads):
+                    sleep(0.001)
+            self.assertEqual(order, [])
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(order, ["first", "second", "third"])
+        stats = agent_pool.stats()["leases"]
+        self.assertEqual(stats["acquired"], 4)
+        self.assertEqual(stats["contended"], 3)
+        self.assertEqual(stats["waiting"], 0)
+        self.assertEqual(agent_pool.info(1).in_flight, 0)
+        self.assertEqual(agent_pool.contention()[0]["id"], 1)
+        self.assertEqual(agent_pool.contention()[0]["contended"], 3)
+
+    def test_use_timeout(self):
+        agent_pool = AgentPool(lease_timeout=0.01)
+        agent_pool[1] = requests.Session()
+
+        with agent_pool.use(1):
+            with self.assertRaises(LeaseTimeout):
+                with agent_pool.use(1):
+                    pass
+        with agent_pool.use(1):
+            pass
+
+        self.assertEqual(agent_pool.stats()["leases"]["timeouts"], 1)
+        self.assertEqual(agent_pool.info(1).timeouts, 1)
+        self.assertEqual(agent_pool.info(1).in_flight, 0)
+
+    def test_use_max_parallel(self):
+        agent_pool = AgentPool(max_parallel=2, lease_timeout=0.01)
+        agent_pool[1] = requests.Session()
+
+        with agent_pool.use(1), agent_pool.use(1):
+            self.assertEqual(agent_pool.info(1).in_flight, 2)
+            with self.assertRaises(LeaseTimeout):
+                with agent_pool.use(1):
+                    pass
+
+        agent_pool.max_parallel = 0
+        with agent_pool.use(1), agent_pool.use(1), agent_pool.use(1):
+            self.assertEqual(agent_pool.info(1).in_flight, 3)
+
+    def test_use_missing_agent(self):
+        agent_pool = AgentPool()
+
+        with self.assertRaises(AgentNotFound):
+            with agent_pool.use(1):
+                pass
+
+        self.assertEqual(agent_pool.stats()["leases"]["acquired"], 0)
+
+    def test_use_removed_agent(self):
+        agent_pool = AgentPool()
+        agent_pool[1] = requests.Session()
+        used = []
+
+        def use():
+            with agent_pool.use(1) as agent:
+                used.append(agent)
+
+        with agent_pool.use(1):
+            thread = Thread(target=use)
+            thread.start()
+            while not agent_pool.stats()["leases"]["waiting"]:
+                sleep(0.001)
+            # Waiting requests get the removed agent instead of waiting for the timeout
+            agent_pool.pop(1)
+            thread.join(1)
+
+        self.assertEqual(len(used), 1)
+
+    def _agent(self, name, domain, expires):
+        agent = requests.Session()
+        agent.cookies.set_cookie(self._cookie(name, domain, expires))
+        return agent
+
+    @staticmethod
+    def _cookie(name, domain, expires):
+        return Cookie(
+            version=0,
+            name=name,
+            value="value",
+            port=None,
+            port_specified=False,
+            domain=domain,
+            domain_specified=True,
+            domain_initial_dot=domain.startswith("."),
+            path="/",
+            path_specified=True,
+            secure=True,
+            expires=expires,
+            discard=expires is None,
+            comment=None,
+            comment_url=None,
+            rest={},
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,53 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+from utils.agent_pool import AgentPool
+from utils.agent_reserve import AgentReserve
+
+FIREFOX = {"browser": {"browser": "firefox", "platform": "linux"}}
+CHROME = {"browser": {"browser": "chrome", "platform": "windows"}}
+
+
+class TestAgentReserve(unittest.TestCase):
+    def test_refill_and_take(self):
+        with patch("utils.agent_reserve.cloudscraper") as mock_cloudscraper:
+            mock_cloudscraper.create_scraper.side_effect = lambda **kwargs: MagicMock()
+            reserve = AgentReserve([FIREFOX, CHROME], low_watermark=1, high_watermark=2)
+
+            self.assertEqual(reserve.refill(), 4)
+            self.assertEqual(reserve.refill(), 0)
+            mock_cloudscraper.create_scraper.assert_any_call(**FIREFOX)
+            mock_cloudscraper.create_scraper.assert_any_call(**CHROME)
+
+            self.assertIsNotNone(reserve.take(FIREFOX))
+            self.assertIsNotNone(reserve.take(FIREFOX))
+            self.assertIsNone(reserve.take(FIREFOX))
+            self.assertIsNone(reserve.take({"interpreter": "js2py"}))
+
+            # Refill only the reserves below the low watermark
+            self.assertEqual(reserve.refill(), 2)
+
+            stats = reserve.stats()
+            self.assertEqual(stats["size"], 4)
+            self.assertEqual(stats["hits"], 2)
+            self.assertEqual(stats["misses"], 2)
+            self.assertEqual(stats["hit_rate"], 0.5)
+            self.assertEqual(stats["refills"], 6)
+
+    def test_agent_pool_generate(self):
+        reserve = MagicMock()
+        reserve_agent = MagicMock()
+        reserve.take.side_effect = [reserve_agent, None]
+        with patch("utils.agent_pool.cloudscraper") as mock_cloudscraper:
+            agent_pool = AgentPool(reserve=reserve)
+
+            self.assertEqual(agent_pool.generate(**FIREFOX), (1, reserve_agent))
+            mock_cloudscraper.create_scraper.assert_not_called()
+
+            agent_id, agent = agent_pool.generate(**FIREFOX)
+            self.assertEqual(agent, mock_cloudscraper.create_scraper.return_value)
+            reserve.take.assert_called_with(FIREFOX)
+
+
+if __name__ == "__main__":
+    unittest.main()
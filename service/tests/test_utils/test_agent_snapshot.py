@@ -0,0 +1,110 @@
+import os
+import tempfile
+import unittest
+from time import time
+from unittest.mock import patch
+
+import requests
+from utils.agent_pool import AgentPool, AgentState
+from utils.agent_snapshot import dump_snapshot, load_snapshot
+from utils.egress import EgressPool
+
+UA = "Mozilla/5.0 (X11; Linux x86_64; rv:56.0; Waterfox) Gecko/20100101 Firefox/56.2.4"
+FIREFOX = {"browser": {"browser": "firefox", "platform": "linux"}}
+
+
+class TestAgentSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "agents.json.gz")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_dump_and_load(self):
+        with patch("utils.agent_pool.cloudscraper") as mock_cloudscraper:
+            mock_cloudscraper.create_scraper.side_effect = lambda **kwargs: (
+                requests.Session()
+            )
+            agent_pool = AgentPool()
+            agent_id, agent = agent_pool.generate(**FIREFOX)
+            agent.headers["User-Agent"] = UA
+            agent.cookies.set(
+                "cf_clearance", "value", domain=".example.com", expires=int(time()) + 60
+            )
+            agent.cookies.set(
+                "expired", "value", domain=".example.com", expires=int(time()) - 60
+            )
+            agent_pool.generate()
+            agent_pool.pop(2)
+
+            self.assertEqual(dump_snapshot(agent_pool, self.path), 1)
+
+            restored_pool = AgentPool()
+            self.assertEqual(load_snapshot(restored_pool, self.path), 1)
+            self.assertEqual(restored_pool.agent_id, 2)
+            self.assertEqual(restored_pool.info(agent_id).kwargs, FIREFOX)
+
+            # Scrapers are built lazily, the state is enough for routing
+            mock_cloudscraper.create_scraper.reset_mock()
+            self.assertIsInstance(restored_pool.values()[0], AgentState)
+            self.assertEqual(restored_pool.route("www.example.com"), agent_id)
+            mock_cloudscraper.create_scraper.assert_not_called()
+
+            restored = restored_pool[agent_id]
+            mock_cloudscraper.create_scraper.assert_called_once_with(**FIREFOX)
+            self.assertIsInstance(restored, requests.Session)
+            self.assertEqual(restored.headers["User-Agent"], UA)
+            self.assertEqual(restored.cookies.get("cf_clearance"), "value")
+            self.assertIsNone(restored.cookies.get("expired"))
+
+    def test_dump_and_load_cookie_attributes(self):
+        with patch("utils.agent_pool.cloudscraper") as mock_cloudscraper:
+            mock_cloudscraper.create_scraper.side_effect = lambda **kwargs: (
+                requests.Session()
+            )
+            agent_pool = AgentPool()
+            agent_id, agent = agent_pool.generate()
+            cookie = requests.cookies.create_cookie(
+                "session", "value", domain="www.example.com", rest={"HttpOnly": None}
+            )
+            cookie.domain_specified = False
+            agent.cookies.set_cookie(cookie)
+            dump_snapshot(agent_pool, self.path)
+
+            restored_pool = AgentPool()
+            load_snapshot(restored_pool, self.path)
+
+            restored = next(iter(restored_pool[agent_id].cookies))
+            self.assertFalse(restored.domain_specified)
+            self.assertFalse(restored.domain_initial_dot)
+            self.assertTrue(restored.has_nonstandard_attr("HttpOnly"))
+
+    def test_dump_and_load_egress(self):
+        egress = "http://127.0.0.1:3128"
+        with patch("utils.agent_pool.cloudscraper") as mock_cloudscraper:
+            mock_cloudscraper.create_scraper.side_effect = lambda **kwargs: (
+                requests.Session()
+            )
+            agent_pool = AgentPool(egress=EgressPool([{"url": egress}]))
+            agent_id, _ = agent_pool.generate()
+            dump_snapshot(agent_pool, self.path)
+
+            egress_pool = EgressPool([{"url": egress}])
+            restored_pool = AgentPool(egress=egress_pool)
+            load_snapshot(restored_pool, self.path)
+
+            self.assertEqual(egress_pool.get(egress).agents, 1)
+            self.assertEqual(restored_pool.info(agent_id).egress, egress)
+            self.assertEqual(restored_pool[agent_id].proxies["https"], egress)
+
+    def test_load_unsupported_version(self):
+        agent_pool = AgentPool()
+        dump_snapshot(agent_pool, self.path)
+        with patch("utils.agent_snapshot.SNAPSHOT_VERSION", 0):
+            with self.assertRaises(ValueError):
+                load_snapshot(agent_pool, self.path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+from threading import Lock
+from time import sleep
+
+from utils.batch import iter_completed
+
+
+class TestBatch(unittest.TestCase):
+    def test_iter_completed_order(self):
+        def fn(index, delay):
+            sleep(delay)
+            return index
+
+        results = list(iter_completed(fn, [0.2, 0.0, 0.1], 3))
+
+        self.assertEqual(results, [1, 2, 0])
+
+    def test_iter_completed_concurrency(self):
+        lock = Lock()
+        running = []
+        peak = []
+
+        def fn(index, item):
+            with lock:
+                running.append(index)
+                peak.append(len(running))
+            sleep(0.01)
+            with lock:
+                running.remove(index)
+            return item
+
+        results = list(iter_completed(fn, list(range(10)), 3))
+
+        self.assertEqual(sorted(results), list(range(10)))
+        self.assertLessEqual(max(peak), 3)
+
+    def test_iter_completed_close(self):
+        calls = []
+
+        def fn(index, item):
+            calls.append(index)
+            sleep(0.01)
+            return item
+
+        results = iter_completed(fn, list(range(10)), 1)
+        next(results)
+        results.close()
+        sleep(0.05)
+
+        self.assertLess(len(calls), 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import shutil
+import sys
+import unittest
+from unittest.mock import patch
+
+from cloudscraper.interpreters import JavaScriptInterpreter, interpreters
+from utils.challenge_pool import ChallengePool, PooledInterpreter
+
+ECHO_WORKER = """
+import json, sys, time
+for line in sys.stdin:
+    request = json.loads(line)
+    if request.get("sleep"):
+        time.sleep(request["sleep"])
+    if "error" in request:
+        print(json.dumps({"error": request["error"]}), flush=True)
+    else:
+        print(json.dumps({"answer": request["answer"]}), flush=True)
+"""
+
+
+class TestChallengePool(unittest.TestCase):
+    def setUp(self):
+        self.pool = ChallengePool(size=2, timeout=5)
+        self.addCleanup(self.pool.close)
+
+    def test_call_reuses_workers(self):
+        with patch.object(
+            self.pool, "command", return_value=[sys.executable, "-c", ECHO_WORKER]
+        ):
+            self.assertEqual(self.pool.call("python", {"answer": "1.5"}), "1.5")
+            self.assertEqual(self.pool.call("python", {"answer": "2.5"}), "2.5")
+
+            with self.assertRaises(RuntimeError):
+                self.pool.call("python", {"error": "Bad challenge."})
+
+        stats = self.pool.stats()
+        self.assertEqual(stats["spawned"], 1)
+        self.assertEqual(stats["workers"], 1)
+        self.assertEqual(stats["solves"], 2)
+        self.assertEqual(stats["failures"], 1)
+        self.assertEqual(stats["queued"], 0)
+        self.assertEqual(stats["in_flight"], 0)
+
+    def test_call_timeout(self):
+        self.pool.timeout = 0.2
+        with patch.object(
+            self.pool, "command", return_value=[sys.executable, "-c", ECHO_WORKER]
+        ):
+            with self.assertRaises(RuntimeError):
+                self.pool.call("python", {"answer": "1", "sleep": 5})
+            # The killed worker is replaced
+            self.pool.timeout = 5
+            self.assertEqual(self.pool.call("python", {"answer": "2"}), "2")
+
+        self.assertEqual(self.pool.stats()["spawned"], 2)
+
+    def test_python_worker(self):
+        with self.assertRaises(RuntimeError):
+            self.pool.call(
+                "python", {"interpreter": "native", "body": "", "domain": "example.com"}
+            )
+        # The worker survives the failed challenge
+        self.assertEqual(self.pool.stats()["workers"], 1)
+
+    @unittest.skipIf(shutil.which("node") is None, "Node.js isn't installed.")
+    def test_nodejs_worker(self):
+        self.assertEqual(
+            self.pool.call("nodejs", {"js": "atob('MQ==') * 2 + 0.5"}), "2.5"
+        )
+
+    def test_install(self):
+        original = dict(interpreters)
+        self.addCleanup(interpreters.update, original)
+        self.addCleanup(interpreters.clear)
+
+        self.pool.install(("native",))
+        interpreter = JavaScriptInterpreter.dynamicImport("native")
+
+        self.assertIsInstance(interpreter, PooledInterpreter)
+        with patch.object(self.pool, "evaluate", return_value="42") as mock_evaluate:
+            self.assertEqual(
+                interpreter.solveChallenge("body", "example.com"), "42.0000000000"
+            )
+        mock_evaluate.assert_called_once_with("native", "body", "example.com")
+
+
+if __name__ == "__main__":
+    unittest.main()
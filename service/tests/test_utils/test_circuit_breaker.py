@@ -0,0 +1,98 @@
+import unittest
+from time import sleep
+
+from utils.circuit_breaker import CircuitBreaker, CircuitOpen, merge
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_opens(self):
+        circuit_breaker = CircuitBreaker(failures=2, open_seconds=60)
+
+        circuit_breaker.before("example.com")
+        circuit_breaker.record("example.com", False)
+        self.assertEqual(circuit_breaker.state("example.com"), "closed")
+        circuit_breaker.record("example.com", False)
+
+        self.assertEqual(circuit_breaker.state("example.com"), "open")
+        with self.assertRaises(CircuitOpen) as context:
+            circuit_breaker.before("example.com")
+        self.assertGreater(context.exception.retry_after, 59)
+        # Other hosts aren't affected
+        circuit_breaker.before("example.org")
+        stats = circuit_breaker.stats()
+        self.assertEqual(stats["open"], 1)
+        self.assertEqual(stats["rejected"], 1)
+        self.assertEqual(stats["transitions"]["open"], 1)
+
+    def test_success_resets(self):
+        circuit_breaker = CircuitBreaker(failures=2)
+
+        circuit_breaker.record("example.com", False)
+        circuit_breaker.record("example.com", True)
+        circuit_breaker.record("example.com", False)
+
+        self.assertEqual(circuit_breaker.state("example.com"), "closed")
+        self.assertEqual(circuit_breaker.stats()["hosts"][0]["failures"], 1)
+
+    def test_half_open(self):
+        circuit_breaker = CircuitBreaker(failures=1, open_seconds=0.01)
+        circuit_breaker.record("example.com", False)
+        sleep(0.02)
+
+        # One probe is let through at once
+        circuit_breaker.before("example.com")
+        self.assertEqual(circuit_breaker.state("example.com"), "half_open")
+        with self.assertRaises(CircuitOpen):
+            circuit_breaker.before("example.com")
+        circuit_breaker.record("example.com", False)
+        self.assertEqual(circuit_breaker.state("example.com"), "open")
+
+        sleep(0.02)
+        circuit_breaker.before("example.com")
+        circuit_breaker.record("example.com", True)
+        self.assertEqual(circuit_breaker.state("example.com"), "closed")
+        self.assertEqual(circuit_breaker.stats()["hosts"], [])
+
+    def test_probe_not_sent(self):
+        circuit_breaker = CircuitBreaker(failures=1, open_seconds=0.01)
+        circuit_breaker.record("example.com", False)
+        sleep(0.02)
+
+        circuit_breaker.before("example.com")
+        circuit_breaker.record("example.com", None)
+
+        # The next request probes the host instead
+        circuit_breaker.before("example.com")
+        self.assertEqual(circuit_breaker.state("example.com"), "half_open")
+
+    def test_max_hosts(self):
+        circuit_breaker = CircuitBreaker(failures=1, max_hosts=2)
+        circuit_breaker.record("a.example.com", False)
+        circuit_breaker.record("b.example.com", False)
+        circuit_breaker.record("c.example.com", False)
+
+        # Open circuits aren't forgotten
+        self.assertEqual(len(circuit_breaker.stats()["hosts"]), 3)
+
+        circuit_breaker = CircuitBreaker(failures=2, max_hosts=2)
+        for host in ["a.example.com", "b.example.com", "c.example.com"]:
+            circuit_breaker.record(host, False)
+        self.assertEqual(
+            [host["host"] for host in circuit_breaker.stats()["hosts"]],
+            ["b.example.com", "c.example.com"],
+        )
+
+    def test_merge(self):
+        first, second = CircuitBreaker(failures=1), CircuitBreaker(failures=1)
+        first.record("example.com", False)
+        second.record("example.org", False)
+
+        merged = merge([first.stats(), second.stats()])
+
+        self.assertEqual(merged["open"], 2)
+        self.assertEqual(merged["transitions"]["open"], 2)
+        self.assertEqual(len(merged["hosts"]), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
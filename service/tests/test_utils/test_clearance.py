@@ -0,0 +1,119 @@
+import unittest
+from time import time
+from unittest.mock import MagicMock, patch
+
+import requests
+from cloudscraper.exceptions import CloudflareIUAMError
+from utils.clearance import (
+    Clearance,
+    ClearanceCache,
+    share_clearance,
+    solve_clearance,
+)
+from utils.profile_selector import ProfileSelector
+
+UA = "Mozilla/5.0 (X11; Linux x86_64; rv:56.0; Waterfox) Gecko/20100101 Firefox/56.2.4"
+
+
+class TestClearance(unittest.TestCase):
+    def test_solve_clearance(self):
+        with patch("utils.clearance.cloudscraper") as mock_cloudscraper:
+            cookie = MagicMock(domain=".example.com", value="value", expires=42)
+            cookie.name = "cf_clearance"
+            scraper = mock_cloudscraper.create_scraper.return_value
+            scraper.get.return_value.url = "https://www.example.com/"
+            scraper.cookies = [cookie]
+            scraper.headers = {"User-Agent": UA}
+
+            clearance = solve_clearance("https://www.example.com/", interpreter="js2py")
+
+            mock_cloudscraper.create_scraper.assert_called_once_with(interpreter="js2py")
+            self.assertEqual(clearance.cf_clearance, "value")
+            self.assertEqual(clearance.user_agent, UA)
+            self.assertEqual(clearance.expires, 42)
+
+            scraper.cookies = []
+            with self.assertRaises(CloudflareIUAMError):
+                solve_clearance("https://www.example.com/")
+
+    def test_share_clearance(self):
+        source, target = requests.Session(), requests.Session()
+        source.headers["User-Agent"] = UA
+        source.cookies.set("cf_clearance", "value", domain=".example.com")
+        source.cookies.set("session", "value", domain=".example.com")
+
+        self.assertFalse(share_clearance(source, target, "other.com"))
+        self.assertNotEqual(target.headers["User-Agent"], UA)
+
+        self.assertTrue(share_clearance(source, target, "www.example.com"))
+        self.assertEqual(target.headers["User-Agent"], UA)
+        self.assertEqual(target.cookies.get("cf_clearance"), "value")
+        self.assertIsNone(target.cookies.get("session"))
+
+    def test_cache_key(self):
+        self.assertEqual(
+            ClearanceCache.key("https://example.com/a", {"b": 1, "a": 2}),
+            ClearanceCache.key("https://example.com/b", {"a": 2, "b": 1}),
+        )
+        self.assertNotEqual(
+            ClearanceCache.key("https://example.com/", {"a": 1}),
+            ClearanceCache.key("https://example.com/", {"a": 2}),
+        )
+
+    def test_cache_expiry(self):
+        cache = ClearanceCache(margin=30)
+        cache.set(("a", "{}"), Clearance("a", UA, time() + 60))
+        cache.set(("b", "{}"), Clearance("b", UA, time() + 10))
+        cache.set(("c", "{}"), Clearance("c", UA, None))
+
+        self.assertEqual(cache.get(("a", "{}")).cf_clearance, "a")
+        self.assertIsNone(cache.get(("b", "{}")))
+        self.assertEqual(cache.get(("c", "{}")).cf_clearance, "c")
+        self.assertIsNone(cache.get(("d", "{}")))
+
+    def test_cache_lru(self):
+        cache = ClearanceCache(max_size=2)
+        cache.set(("a", "{}"), Clearance("a", UA, None))
+        cache.set(("b", "{}"), Clearance("b", UA, None))
+        cache.get(("a", "{}"))
+        cache.set(("c", "{}"), Clearance("c", UA, None))
+
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get(("b", "{}")))
+        self.assertIsNotNone(cache.get(("a", "{}")))
+
+    def test_cache_solve(self):
+        with patch("utils.clearance.solve_clearance") as mock_solve_clearance:
+            mock_solve_clearance.return_value = Clearance("value", UA, None)
+            cache = ClearanceCache()
+
+            cache.solve("https://example.com", {"interpreter": "js2py"})
+            cache.solve("https://example.com", {"interpreter": "js2py"})
+            mock_solve_clearance.assert_called_once_with(
+                "https://example.com", interpreter="js2py"
+            )
+
+            cache.solve("https://example.com", {"interpreter": "js2py"}, refresh=True)
+            self.assertEqual(mock_solve_clearance.call_count, 2)
+
+    def test_cache_solve_scores_profile(self):
+        profiles = [{"interpreter": "js2py"}, {"interpreter": "nodejs"}]
+        profile_selector = ProfileSelector(profiles)
+        cache = ClearanceCache(profile_selector=profile_selector)
+        with patch("utils.clearance.solve_clearance") as mock_solve_clearance:
+            mock_solve_clearance.return_value = Clearance("value", UA, None)
+            cache.solve("https://example.com", profiles[0])
+            cache.solve("https://example.com", profiles[0])
+            mock_solve_clearance.side_effect = CloudflareIUAMError()
+            with self.assertRaises(CloudflareIUAMError):
+                cache.solve("https://example.com", profiles[1])
+
+        first, second = profile_selector.stats("example.com")
+        # Cached clearances aren't solves
+        self.assertEqual(first["challenges"], 1)
+        self.assertEqual(first["blocked"], 0)
+        self.assertEqual(second["blocked"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+from time import time
+from unittest.mock import MagicMock
+
+import requests
+from utils.agent_pool import AgentPool
+from utils.clearance_refresher import ClearanceRefresher
+
+
+class TestClearanceRefresher(unittest.TestCase):
+    def setUp(self):
+        self.agent_pool = AgentPool()
+        self.refresher = ClearanceRefresher(
+            self.agent_pool, lead_time=60, active_window=600
+        )
+
+    def _agent(self, agent_id, expires):
+        agent = requests.Session()
+        agent.get = MagicMock()
+        agent.cookies.set("cf_clearance", "old", domain=".example.com", expires=expires)
+        self.agent_pool[agent_id] = agent
+        self.agent_pool.index(agent_id, "https://www.example.com/page")
+        return agent
+
+    def test_due(self):
+        self._agent(1, int(time()) + 30)
+        self._agent(2, int(time()) + 30)
+        self._agent(3, int(time()) + 3600)
+        self._agent(4, int(time()) + 30)
+        self.agent_pool.info(2).last_used -= 3600
+        self.agent_pool.pop(4)
+
+        self.assertEqual(self.refresher.due(), [(1, "example.com")])
+        self.assertEqual(self.refresher.stats()["skipped"], 1)
+        self.assertEqual(self.refresher.stats()["scheduled"], 1)
+
+    def test_due_busy_agent(self):
+        self._agent(1, int(time()) + 30)
+        with self.agent_pool.use(1):
+            self.assertEqual(self.refresher.due(), [])
+        self.assertEqual(self.refresher.stats()["scheduled"], 1)
+
+    def test_refresh(self):
+        agent = self._agent(1, int(time()) + 30)
+        last_used = self.agent_pool.info(1).last_used
+        new_expires = int(time()) + 3600
+
+        def get(url):
+            self.assertIsNone(agent.cookies.get("cf_clearance"))
+            agent.cookies.set(
+                "cf_clearance", "new", domain=".example.com", expires=new_expires
+            )
+
+        agent.get.side_effect = get
+
+        self.assertTrue(self.refresher.refresh(1, "example.com"))
+        agent.get.assert_called_once_with("https://www.example.com/")
+        self.assertEqual(agent.cookies.get("cf_clearance"), "new")
+        self.assertEqual(self.agent_pool.info(1).domains["example.com"], new_expires)
+        self.assertEqual(self.agent_pool.info(1).last_used, last_used)
+        self.assertEqual(self.refresher.stats()["refreshed"], 1)
+        # The renewed cookie is scheduled for the next refresh
+        self.assertEqual(self.refresher._heap[-1][0], new_expires - 60)
+
+    def test_refresh_failed(self):
+        agent = self._agent(1, int(time()) + 30)
+        agent.get.side_effect = requests.ConnectionError()
+
+        self.assertFalse(self.refresher.refresh(1, "example.com"))
+        self.assertEqual(agent.cookies.get("cf_clearance"), "old")
+        self.assertEqual(self.refresher.stats()["failed"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+
+from utils.flight_recorder import FlightRecord, FlightRecorder, merge
+
+
+def finished_record(duration: float, started: float = 0) -> FlightRecord:
+    record = FlightRecord("GET", "/proxy", 0)
+    record.started = started
+    record.duration = duration
+    return record
+
+
+class TestFlightRecorder(unittest.TestCase):
+    def test_record_slowest(self):
+        flight_recorder = FlightRecorder(slowest=2, sample_size=0)
+
+        for duration in (0.3, 0.1, 0.5, 0.2):
+            flight_recorder.record(finished_record(duration))
+
+        entries = flight_recorder.entries()
+        self.assertEqual(entries["recorded"], 4)
+        self.assertEqual(
+            [record["duration"] for record in entries["slowest"]], [0.5, 0.3]
+        )
+        self.assertEqual(entries["sample"], [])
+
+    def test_record_sample(self):
+        flight_recorder = FlightRecorder(slowest=1, sample_size=2, sample_rate=1)
+
+        for started in range(3):
+            flight_recorder.record(finished_record(0.1, started))
+
+        self.assertEqual(
+            [record["started"] for record in flight_recorder.entries()["sample"]],
+            [2, 1],
+        )
+
+        flight_recorder.clear()
+        self.assertEqual(
+            flight_recorder.entries(), {"recorded": 0, "slowest": [], "sample": []}
+        )
+
+    def test_stage(self):
+        record = FlightRecord("GET", "/proxy", 0)
+        record.stage("upstream", 0.25)
+        record.stage("upstream", 0.5)
+
+        self.assertEqual(record.to_dict()["stages"], {"upstream": 0.75})
+
+    def test_merge(self):
+        first = {
+            "recorded": 2,
+            "slowest": [{"duration": 3}, {"duration": 1}],
+            "sample": [{"started": 1}],
+        }
+        second = {"recorded": 1, "slowest": [{"duration": 2}], "sample": [{"started": 2}]}
+
+        self.assertEqual(
+            merge([first, second], slowest=2, sample_size=1),
+            {
+                "recorded": 3,
+                "slowest": [{"duration": 3}, {"duration": 2}],
+                "sample": [{"started": 2}],
+            },
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
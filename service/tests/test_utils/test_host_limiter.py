@@ -0,0 +1,118 @@
+import unittest
+from threading import Thread
+from time import monotonic, sleep
+
+from utils.host_limiter import HostLimiter, HostLimitTimeout, merge
+
+
+class TestHostLimiter(unittest.TestCase):
+    def test_unlimited(self):
+        host_limiter = HostLimiter([{"pattern": "*.example.com", "rate": 1}])
+
+        with host_limiter.acquire("example.org") as waited:
+            self.assertEqual(waited, 0)
+        self.assertEqual(host_limiter.stats()["hosts"], [])
+
+    def test_rule(self):
+        host_limiter = HostLimiter(
+            [{"pattern": "*.example.com", "rate": 2}, {"pattern": "*"}],
+            max_concurrency=4,
+        )
+
+        self.assertEqual(host_limiter.rule("WWW.Example.com").rate, 2)
+        self.assertEqual(host_limiter.rule("WWW.Example.com").max_concurrency, 4)
+        self.assertEqual(host_limiter.rule("example.org").pattern, "*")
+        self.assertEqual(host_limiter.rule("example.org").rate, 0)
+
+    def test_rate(self):
+        host_limiter = HostLimiter([], rate=20, burst=2)
+
+        start = monotonic()
+        for _ in range(4):
+            with host_limiter.acquire("example.com"):
+                pass
+
+        # The burst goes at once, the rest at the rate
+        self.assertGreaterEqual(monotonic() - start, 0.09)
+        stats = host_limiter.stats()["hosts"][0]
+        self.assertEqual(stats["delayed"], 2)
+        self.assertLess(stats["tokens"], 1)
+
+    def test_concurrency(self):
+        host_limiter = HostLimiter([], max_concurrency=2)
+        active = []
+        peak = []
+
+        def call():
+            with host_limiter.acquire("example.com"):
+                active.append(1)
+                peak.append(len(active))
+                sleep(0.01)
+                active.pop()
+
+        threads = [Thread(target=call) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(max(peak), 2)
+        self.assertEqual(host_limiter.stats()["active"], 0)
+
+    def test_fair_across_agents(self):
+        host_limiter = HostLimiter([], max_concurrency=1)
+        order = []
+
+        def call(agent_id):
+            with host_limiter.acquire("example.com", agent_id):
+                order.append(agent_id)
+
+        with host_limiter.acquire("example.com", "a"):
+            threads = []
+            for agent_id in ["a", "a", "a", "b"]:
+                threads.append(Thread(target=call, args=(agent_id,)))
+                threads[-1].start()
+                while host_limiter.stats()["queued"] < len(threads):
+                    sleep(0.001)
+            self.assertEqual(host_limiter.stats()["hosts"][0]["agents"], 2)
+        for thread in threads:
+            thread.join()
+
+        # b doesn't wait for all the requests of a queued before it
+        self.assertEqual(order, ["a", "b", "a", "a"])
+
+    def test_timeout(self):
+        host_limiter = HostLimiter([], max_concurrency=1, max_wait=0.01)
+
+        with host_limiter.acquire("example.com"):
+            with self.assertRaises(HostLimitTimeout):
+                with host_limiter.acquire("example.com"):
+                    pass
+
+        stats = host_limiter.stats()
+        self.assertEqual(stats["queued"], 0)
+        self.assertEqual(stats["hosts"][0]["timeouts"], 1)
+        self.assertEqual(host_limiter.patterns()["*"]["timeouts"], 1)
+
+    def test_shared_by_workers(self):
+        host_limiter = HostLimiter([], rate=10, burst=3, max_concurrency=1, shards=4)
+
+        rule = host_limiter.rule("example.com")
+        self.assertEqual(rule.rate, 2.5)
+        self.assertEqual(rule.burst, 1)
+        self.assertEqual(rule.max_concurrency, 1)
+
+    def test_merge(self):
+        host_limiter = HostLimiter([], max_concurrency=1)
+        with host_limiter.acquire("example.com"):
+            stats = host_limiter.stats()
+
+        merged = merge([stats, stats])
+
+        self.assertEqual(merged["active"], 2)
+        self.assertEqual(merged["hosts"][0]["active"], 2)
+        self.assertIsNone(merged["hosts"][0]["tokens"])
+
+
+if __name__ == "__main__":
+    unittest.main()
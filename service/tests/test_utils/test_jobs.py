@@ -0,0 +1,91 @@
+import unittest
+from threading import Event
+from time import sleep
+
+from utils.jobs import JobQueue
+
+
+class TestJobQueue(unittest.TestCase):
+    def test_run(self):
+        job_queue = JobQueue(concurrency=2)
+
+        def fn(item):
+            if item < 0:
+                raise ValueError("negative")
+            return {"value": item * 2}
+
+        job = job_queue.submit("test", fn, [1, -1, 3])
+        self.assertEqual(job.status, "queued")
+        self.assertIsNone(job.to_dict()["results"])
+
+        job_queue.run(*job_queue._queue.get())
+
+        state = job.to_dict()
+        self.assertEqual(state["status"], "done")
+        self.assertEqual(state["completed"], 3)
+        self.assertEqual(state["failed"], 1)
+        self.assertEqual(
+            state["results"], [{"value": 2}, {"error": "negative"}, {"value": 6}]
+        )
+        self.assertIsNotNone(state["finished"])
+
+    def test_run_all_failed(self):
+        job_queue = JobQueue()
+
+        def fn(item):
+            raise ValueError()
+
+        job = job_queue.submit("test", fn, [1, 2])
+        job_queue.run(*job_queue._queue.get())
+
+        self.assertEqual(job.status, "failed")
+        self.assertEqual(job.results, [{"error": "ValueError"}] * 2)
+
+    def test_submit_full_queue(self):
+        job_queue = JobQueue(max_queued=1)
+
+        self.assertIsNotNone(job_queue.submit("test", dict, [1]))
+        self.assertIsNone(job_queue.submit("test", dict, [1]))
+        self.assertEqual(job_queue.stats()["rejected"], 1)
+
+    def test_sharded_ids(self):
+        job_queue = JobQueue(shard=1, shards=3)
+
+        ids = [job_queue.submit("test", dict, []).id for _ in range(3)]
+
+        self.assertEqual(ids, [1, 4, 7])
+
+    def test_wait(self):
+        job_queue = JobQueue()
+        release = Event()
+
+        def fn(item):
+            release.wait(5)
+            return {"value": item}
+
+        job_queue.start()
+        self.addCleanup(job_queue.stop)
+        job = job_queue.submit("test", fn, [1])
+
+        # Times out while the job is running
+        self.assertEqual(job_queue.wait(job.id, 0.01).status, "running")
+        release.set()
+        self.assertEqual(job_queue.wait(job.id, 5).results, [{"value": 1}])
+        self.assertIsNone(job_queue.wait(job.id + 1, 0.01))
+
+    def test_ttl(self):
+        job_queue = JobQueue(ttl=0.05)
+        job = job_queue.submit("test", dict, [])
+        job_queue.run(*job_queue._queue.get())
+        self.assertIs(job_queue.get(job.id), job)
+
+        sleep(0.06)
+
+        self.assertIsNone(job_queue.get(job.id))
+        stats = job_queue.stats()
+        self.assertEqual(stats["expired"], 1)
+        self.assertEqual(stats["finished"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
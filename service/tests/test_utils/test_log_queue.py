@@ -0,0 +1,130 @@
+import io
+import json
+import logging
+import time
+import unittest
+from unittest.mock import patch
+
+import structlog
+from utils.log_queue import LogQueue, render_json
+from utils.logger import AccessLogSampler
+
+
+def lines(stream: io.BytesIO) -> list[dict]:
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+class TestLogQueue(unittest.TestCase):
+    def test_flush_batches(self):
+        stream = io.BytesIO()
+        log_queue = LogQueue(stream, batch_size=2)
+        for index in range(3):
+            log_queue.put({"event": "Event.", "index": index})
+
+        self.assertEqual(log_queue.flush(), 2)
+        self.assertEqual(log_queue.flush(), 1)
+        self.assertEqual(log_queue.flush(), 0)
+
+        self.assertEqual([line["index"] for line in lines(stream)], [0, 1, 2])
+        self.assertEqual(log_queue.stats(), {"queued": 0, "written": 3, "dropped": 0})
+
+    def test_drop_when_full(self):
+        stream = io.BytesIO()
+        log_queue = LogQueue(stream, max_size=2)
+
+        self.assertEqual(
+            [log_queue.put({"event": "Event."}) for _ in range(3)], [True, True, False]
+        )
+        self.assertEqual(log_queue.dropped, 1)
+
+        log_queue.flush()
+        warning = lines(stream)[-1]
+        self.assertEqual(warning["level"], "warning")
+        self.assertEqual(warning["dropped"], 1)
+        # The drops are reported once
+        log_queue.flush()
+        self.assertEqual(len(lines(stream)), 3)
+
+    def test_processor_drops_event(self):
+        log_queue = LogQueue(io.BytesIO())
+
+        with self.assertRaises(structlog.DropEvent):
+            log_queue(None, "info", {"event": "Event."})
+        self.assertEqual(len(log_queue), 1)
+
+    def test_render_failure(self):
+        stream = io.BytesIO()
+
+        def render(event_dict: dict) -> bytes:
+            raise ValueError("Broken renderer.")
+
+        log_queue = LogQueue(stream, render=render)
+        log_queue.put({"event": "Event."})
+        log_queue.flush()
+
+        self.assertIn("Broken renderer.", lines(stream)[0]["error"])
+
+    def test_writer(self):
+        stream = io.BytesIO()
+        log_queue = LogQueue(stream, flush_interval=0.01)
+        log_queue.start()
+        try:
+            log_queue.put({"event": "Event."})
+            deadline = time.monotonic() + 5
+            while not stream.getvalue() and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(lines(stream), [{"event": "Event."}])
+        finally:
+            log_queue.stop()
+        # Events queued before stopping are written
+        log_queue.put({"event": "Last."})
+        log_queue.start()
+        log_queue.stop()
+        self.assertEqual(lines(stream)[-1], {"event": "Last."})
+
+    def test_handler(self):
+        log_queue = LogQueue(io.BytesIO())
+        logger = logging.getLogger("test_log_queue")
+        logger.propagate = False
+        logger.addHandler(log_queue.handler())
+        try:
+            logger.warning("Plain %s.", "record")
+        finally:
+            logger.handlers.clear()
+
+        event_dict = log_queue._events.popleft()
+        self.assertEqual(event_dict["event"], "Plain record.")
+        self.assertEqual(event_dict["level"], "warning")
+        self.assertEqual(event_dict["logger"], "test_log_queue")
+
+    def test_render_json(self):
+        self.assertEqual(
+            json.loads(render_json({"event": "Event.", "error": ValueError("x")})),
+            {"event": "Event.", "error": "ValueError('x')"},
+        )
+
+
+class TestAccessLogSampler(unittest.TestCase):
+    def test_sample(self):
+        event_dict = {"event": "Processing request.", "status": 200}
+
+        with patch("utils.logger.random", return_value=0.7):
+            with self.assertRaises(structlog.DropEvent):
+                AccessLogSampler(0.5)(None, "info", dict(event_dict))
+        with patch("utils.logger.random", return_value=0.3):
+            self.assertEqual(
+                AccessLogSampler(0.5)(None, "info", dict(event_dict))["sample_rate"], 0.5
+            )
+        self.assertEqual(AccessLogSampler(1)(None, "info", dict(event_dict)), event_dict)
+
+    def test_keep_failed_and_other_events(self):
+        sampler = AccessLogSampler(0)
+
+        failed = {"event": "Processing request.", "status": 502}
+        self.assertEqual(sampler(None, "info", dict(failed)), failed)
+        other = {"event": "Couldn't create an agent."}
+        self.assertEqual(sampler(None, "error", dict(other)), other)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+import unittest
+from unittest.mock import patch
+
+from utils.profile_selector import ProfileSelector, merge, reward, select_profile
+
+PROFILES = [
+    {"browser": {"browser": "firefox", "platform": "linux"}},
+    {"browser": {"browser": "firefox", "platform": "windows"}},
+    {"browser": {"browser": "firefox", "platform": "darwin"}},
+]
+
+
+class TestProfileSelector(unittest.TestCase):
+    def test_reward(self):
+        self.assertEqual(reward(None, False, 10), 1)
+        self.assertEqual(reward(10, False, 10), 0.5)
+        self.assertEqual(reward(None, True, 10), 0)
+
+    def test_untried_first(self):
+        profile_selector = ProfileSelector(PROFILES, exploration=0)
+        profile_selector.observe("example.com", PROFILES[0], 5)
+
+        # The others still score 1 as they were never tried
+        for _ in range(10):
+            self.assertNotEqual(profile_selector.select("example.com"), PROFILES[0])
+
+    def test_exploits_best(self):
+        profile_selector = ProfileSelector(PROFILES, exploration=0)
+        profile_selector.observe("example.com", PROFILES[0], 20)
+        profile_selector.observe("example.com", PROFILES[1], 2)
+        profile_selector.observe("example.com", PROFILES[2], blocked=True)
+
+        selected = [profile_selector.select("example.com") for _ in range(10)]
+
+        self.assertEqual(selected, [PROFILES[1]] * 10)
+        # Hosts without their own outcomes are scored by all the hosts
+        self.assertEqual(profile_selector.select("example.org"), PROFILES[1])
+        self.assertEqual(profile_selector.select(), PROFILES[1])
+
+    def test_per_host(self):
+        profile_selector = ProfileSelector(PROFILES, exploration=0)
+        for profile in PROFILES:
+            profile_selector.observe("example.com", profile)
+            profile_selector.observe("example.org", profile)
+        profile_selector.observe("example.com", PROFILES[0], blocked=True)
+        profile_selector.observe("example.org", PROFILES[1], blocked=True)
+
+        self.assertNotEqual(profile_selector.select("example.com"), PROFILES[0])
+        self.assertNotEqual(profile_selector.select("example.org"), PROFILES[1])
+
+    def test_exploration(self):
+        profile_selector = ProfileSelector(PROFILES, exploration=0.5)
+        profile_selector.observe("example.com", PROFILES[0])
+        for profile in PROFILES[1:]:
+            profile_selector.observe("example.com", profile, blocked=True)
+
+        with patch("utils.profile_selector.random", return_value=0.4):
+            with patch("utils.profile_selector.randrange", return_value=2):
+                self.assertEqual(profile_selector.select("example.com"), PROFILES[2])
+        with patch("utils.profile_selector.random", return_value=0.6):
+            self.assertEqual(profile_selector.select("example.com"), PROFILES[0])
+
+    def test_unknown_config(self):
+        profile_selector = ProfileSelector(PROFILES)
+
+        profile_selector.observe("example.com", PROFILES[0] | {"delay": 5})
+
+        self.assertEqual(profile_selector.stats(), [])
+
+    def test_stats(self):
+        profile_selector = ProfileSelector(PROFILES, max_hosts=1, decay=0.5)
+        profile_selector.observe("example.com", PROFILES[1], 10)
+        profile_selector.observe("example.com", PROFILES[1])
+        profile_selector.observe("example.org", PROFILES[1], blocked=True)
+
+        stats = profile_selector.stats()
+
+        # example.com was forgotten
+        self.assertEqual([entry["host"] for entry in stats], ["*", "example.org"])
+        self.assertEqual(stats[0]["profile"], 1)
+        self.assertEqual(stats[0]["config"], PROFILES[1])
+        self.assertEqual(stats[0]["requests"], 3)
+        self.assertEqual(stats[0]["challenges"], 1)
+        self.assertEqual(stats[0]["challenge_seconds"], 10)
+        self.assertEqual(stats[0]["blocked"], 1)
+        self.assertEqual(stats[0]["score"], 0.375)
+        self.assertEqual(profile_selector.stats("example.com"), [])
+
+    def test_merge(self):
+        first = ProfileSelector(PROFILES)
+        second = ProfileSelector(PROFILES)
+        first.observe("example.com", PROFILES[0])
+        second.observe("example.com", PROFILES[0], blocked=True)
+        second.observe("example.com", PROFILES[0], blocked=True)
+        second.observe("example.com", PROFILES[0], blocked=True)
+
+        merged = merge([first.stats("example.com"), second.stats("example.com")])
+
+        self.assertEqual(len(merged), 1)
+        self.assertEqual(merged[0]["requests"], 4)
+        self.assertEqual(merged[0]["blocked"], 3)
+        self.assertEqual(merged[0]["score"], 0.25)
+
+    def test_select_profile(self):
+        self.assertIn(select_profile(PROFILES, None), PROFILES)
+        self.assertEqual(
+            select_profile(PROFILES[:1], ProfileSelector(PROFILES[:1])), PROFILES[0]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import unittest
+from threading import Event, Thread
+from unittest.mock import MagicMock
+
+from utils.profiler import (
+    PROFILE_HEADER,
+    PROFILE_ID_HEADER,
+    RequestProfiler,
+    StackSampler,
+)
+
+
+def busy_loop(stop: Event):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+class TestStackSampler(unittest.TestCase):
+    def test_profile(self):
+        stop = Event()
+        thread = Thread(target=busy_loop, args=(stop,))
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(stop.set)
+
+        stacks = StackSampler(interval=0.001).profile(0.1)
+
+        busy = [
+            stack for stack in stacks if "busy_loop (test_utils/test_profiler.py" in stack
+        ]
+        self.assertTrue(busy)
+        self.assertTrue(all(stack.startswith("running;") for stack in busy))
+
+    def test_profile_busy(self):
+        stack_sampler = StackSampler()
+        stack_sampler._lock.acquire()
+
+        self.assertIsNone(stack_sampler.profile(0.1))
+
+
+class TestRequestProfiler(unittest.TestCase):
+    def test_profile(self):
+        request_profiler = RequestProfiler(max_profiles=1, shard=1, shards=2)
+        request = MagicMock(headers={PROFILE_HEADER: "1"})
+        response = MagicMock(headers={})
+
+        request_profiler.start(request)
+        sum(range(1000))
+        request_profiler.finish(request, response)
+
+        self.assertEqual(response.headers[PROFILE_ID_HEADER], "1")
+        self.assertIn("function calls", request_profiler.get(1))
+
+        response = MagicMock(headers={})
+        request_profiler.start(request)
+        request_profiler.finish(request, response)
+
+        # The ids follow the sharding and only the latest profiles are kept
+        self.assertEqual(response.headers[PROFILE_ID_HEADER], "3")
+        self.assertIsNone(request_profiler.get(1))
+
+    def test_profile_forwarded(self):
+        request_profiler = RequestProfiler()
+        request = MagicMock(headers={PROFILE_HEADER: "1"})
+        # The worker that handled the forwarded request made the profile
+        response = MagicMock(headers={PROFILE_ID_HEADER: "2"})
+
+        request_profiler.start(request)
+        request_profiler.finish(request, response)
+
+        self.assertEqual(response.headers[PROFILE_ID_HEADER], "2")
+        self.assertIsNone(request_profiler.get(1))
+
+    def test_profile_not_requested(self):
+        request_profiler = RequestProfiler()
+        request = MagicMock(headers={}, profile=None)
+        response = MagicMock(headers={})
+
+        request_profiler.start(request)
+        request_profiler.finish(request, response)
+
+        self.assertEqual(response.headers, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,198 @@
+import tempfile
+import unittest
+from email.utils import formatdate
+from time import time
+
+from requests.cookies import RequestsCookieJar, create_cookie
+from utils.response_cache import ResponseCache, freshness
+
+
+class TestResponseCache(unittest.TestCase):
+    def test_freshness(self):
+        now = time()
+        self.assertEqual(freshness({"Cache-Control": "max-age=60"}, now, 3600), 60)
+        self.assertEqual(
+            freshness({"Cache-Control": "public, s-maxage=30, max-age=60"}, now, 3600), 30
+        )
+        self.assertEqual(
+            freshness({"Cache-Control": "max-age=60", "Age": "20"}, now, 3600), 40
+        )
+        self.assertEqual(freshness({"Cache-Control": "max-age=7200"}, now, 3600), 3600)
+        self.assertEqual(freshness({"Cache-Control": "no-cache"}, now, 3600), 0)
+        self.assertIsNone(freshness({"Cache-Control": "no-store"}, now, 3600))
+        self.assertIsNone(freshness({"Cache-Control": "private, max-age=60"}, now, 3600))
+        self.assertAlmostEqual(
+            freshness(
+                {
+                    "Date": formatdate(now, usegmt=True),
+                    "Expires": formatdate(now + 120, usegmt=True),
+                },
+                now,
+                3600,
+            ),
+            120,
+            delta=1,
+        )
+        self.assertEqual(freshness({"Expires": "0"}, now, 3600), 0)
+        self.assertEqual(
+            freshness({"Cache-Control": "max-age=60", "Age": "abc"}, 0, 300), 60
+        )
+        # Heuristic freshness from Last-Modified
+        self.assertAlmostEqual(
+            freshness({"Last-Modified": formatdate(now - 1000, usegmt=True)}, now, 3600),
+            100,
+            delta=1,
+        )
+        self.assertEqual(freshness({}, now, 3600), 0)
+
+    def test_store_and_get(self):
+        cache = ResponseCache()
+        headers = {"Cache-Control": "max-age=60", "ETag": '"v1"'}
+
+        entry = cache.store("key", 200, headers, b"body", {})
+
+        self.assertIsNotNone(entry)
+        self.assertTrue(entry.fresh())
+        self.assertEqual(cache.get("key", {}).body, b"body")
+        self.assertEqual(entry.validators(), {"If-None-Match": '"v1"'})
+        self.assertIsNone(cache.get("other", {}))
+
+    def test_store_not_cacheable(self):
+        cache = ResponseCache(max_entry_size=10)
+        cacheable = {"Cache-Control": "max-age=60"}
+
+        self.assertIsNone(cache.store("key", 500, cacheable, b"", {}))
+        self.assertIsNone(
+            cache.store("key", 200, cacheable | {"Set-Cookie": "session=1"}, b"", {})
+        )
+        self.assertIsNone(cache.store("key", 200, cacheable | {"Vary": "*"}, b"", {}))
+        self.assertIsNone(cache.store("key", 200, cacheable, b"x" * 11, {}))
+        self.assertIsNone(cache.store("key", 200, {"Cache-Control": "no-store"}, b"", {}))
+        # Without freshness nor validators there is nothing to reuse
+        self.assertIsNone(cache.store("key", 200, {}, b"", {}))
+        self.assertIsNotNone(cache.store("key", 200, {"ETag": '"v1"'}, b"", {}))
+
+    def test_store_lowercase_headers(self):
+        cache = ResponseCache()
+
+        self.assertIsNone(
+            cache.store(
+                "key",
+                200,
+                {"Cache-Control": "max-age=600", "set-cookie": "session=abc"},
+                b"",
+                {},
+            )
+        )
+        self.assertIsNone(
+            cache.store(
+                "key",
+                200,
+                {"cache-control": "private", "Expires": formatdate(time() + 600)},
+                b"",
+                {},
+            )
+        )
+        entry = cache.store(
+            "key", 200, {"cache-control": "max-age=60", "etag": '"v1"'}, b"", {}
+        )
+        self.assertTrue(entry.fresh())
+        self.assertEqual(entry.validators(), {"If-None-Match": '"v1"'})
+
+    def test_vary(self):
+        cache = ResponseCache()
+        headers = {"Cache-Control": "max-age=60", "Vary": "Accept-Language"}
+
+        cache.store("key", 200, headers, b"body", {"Accept-Language": "en"})
+
+        self.assertIsNotNone(cache.get("key", {"Accept-Language": "en"}))
+        self.assertIsNone(cache.get("key", {"Accept-Language": "de"}))
+
+    def test_revalidate(self):
+        cache = ResponseCache()
+        entry = cache.store(
+            "key", 200, {"Cache-Control": "no-cache", "ETag": '"v1"'}, b"body", {}
+        )
+        self.assertFalse(entry.fresh())
+
+        refreshed = cache.revalidate("key", entry, {"Cache-Control": "max-age=60"})
+
+        self.assertTrue(refreshed.fresh())
+        self.assertEqual(refreshed.body, b"body")
+        self.assertEqual(dict(refreshed.headers)["ETag"], '"v1"')
+        self.assertIs(cache.get("key", {}), refreshed)
+
+    def test_key(self):
+        jar = RequestsCookieJar()
+        jar.set_cookie(create_cookie("cf_clearance", "token", domain=".example.com"))
+        jar.set_cookie(create_cookie("other", "value", domain="other.com"))
+        url = "https://www.example.com/catalog"
+
+        # Cloudflare and other sites' cookies don't split the cache
+        self.assertEqual(ResponseCache.key(url, jar, {}), url)
+
+        jar.set_cookie(create_cookie("session", "1", domain="www.example.com"))
+        session_key = ResponseCache.key(url, jar, {})
+        self.assertNotEqual(session_key, url)
+        self.assertNotEqual(ResponseCache.key(url, jar, {"lang": "en"}), session_key)
+
+    def test_bypass(self):
+        self.assertFalse(ResponseCache.bypass({}))
+        self.assertTrue(ResponseCache.bypass({"Authorization": "Bearer token"}))
+        self.assertTrue(ResponseCache.bypass({"If-None-Match": '"v1"'}))
+        self.assertTrue(ResponseCache.bypass({"Cache-Control": "no-cache"}))
+        self.assertTrue(ResponseCache.bypass({"Pragma": "no-cache"}))
+
+    def test_memory_eviction_to_disk(self):
+        with tempfile.TemporaryDirectory() as path:
+            cache = ResponseCache(
+                max_entries=2, disk_path=path, disk_max_size=1024 * 1024
+            )
+            headers = {"Cache-Control": "max-age=60"}
+            for key in ("a", "b", "c"):
+                cache.store(key, 200, headers, key.encode(), {})
+
+            stats = cache.stats()
+            self.assertEqual(stats["entries"], 2)
+            self.assertEqual(stats["evictions"], 1)
+            self.assertEqual(stats["disk"]["entries"], 1)
+
+            # The disk entry is promoted back to memory
+            self.assertEqual(cache.get("a", {}).body, b"a")
+            stats = cache.stats()
+            self.assertEqual(stats["entries"], 2)
+            self.assertEqual(stats["disk"]["entries"], 1)
+            self.assertIsNotNone(cache.get("c", {}))
+
+            cache.clear()
+            self.assertIsNone(cache.get("b", {}))
+            self.assertEqual(cache.stats()["disk"]["size"], 0)
+
+    def test_disk_budget(self):
+        with tempfile.TemporaryDirectory() as path:
+            cache = ResponseCache(max_entries=1, disk_path=path, disk_max_size=3000)
+            headers = {"Cache-Control": "max-age=60"}
+            for key in ("a", "b", "c", "d"):
+                cache.store(key, 200, headers, b"x" * 1000, {})
+
+            stats = cache.stats()
+            self.assertLessEqual(stats["disk"]["size"], 3000)
+            self.assertGreater(stats["disk"]["evictions"], 0)
+            self.assertIsNone(cache.get("a", {}))
+
+    def test_stats(self):
+        cache = ResponseCache()
+        cache.record("hit")
+        cache.record("revalidated")
+        cache.record("miss")
+        cache.record("miss")
+        cache.record("bypass")
+
+        stats = cache.stats()
+
+        self.assertEqual(stats["hit_ratio"], 0.5)
+        self.assertEqual(stats["bypass"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
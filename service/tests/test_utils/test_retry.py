@@ -0,0 +1,41 @@
+import unittest
+from time import monotonic
+
+from requests import ConnectionError, ConnectTimeout, ReadTimeout
+from utils.retry import DeadlineExceeded, backoff, deadline, retryable, timeouts
+
+
+class TestRetry(unittest.TestCase):
+    def test_deadline(self):
+        self.assertIsNone(deadline(0))
+        self.assertAlmostEqual(deadline(10) - monotonic(), 10, places=1)
+        # The header can only tighten the deadline
+        self.assertAlmostEqual(deadline(10, "2.5") - monotonic(), 2.5, places=1)
+        self.assertAlmostEqual(deadline(10, "20") - monotonic(), 10, places=1)
+        self.assertAlmostEqual(deadline(0, "20") - monotonic(), 20, places=1)
+        for header in ["0", "-1", "soon", "nan"]:
+            with self.assertRaises(ValueError):
+                deadline(10, header)
+
+    def test_timeouts(self):
+        self.assertEqual(timeouts(10, 0, None), (10, None))
+
+        connect, read = timeouts(10, 60, monotonic() + 5)
+        self.assertLessEqual(connect, 5)
+        self.assertLessEqual(read, 5)
+        with self.assertRaises(DeadlineExceeded):
+            timeouts(10, 60, monotonic() - 1)
+
+    def test_retryable(self):
+        self.assertTrue(retryable("GET", ConnectionError()))
+        self.assertTrue(retryable("PUT", None))
+        self.assertFalse(retryable("POST", ReadTimeout()))
+        self.assertTrue(retryable("POST", ConnectTimeout()))
+
+    def test_backoff(self):
+        for attempt in range(10):
+            self.assertLessEqual(backoff(attempt, 0.5, 5), min(0.5 * 2**attempt, 5))
+
+
+if __name__ == "__main__":
+    unittest.main()
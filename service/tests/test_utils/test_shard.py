@@ -0,0 +1,111 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+from http.server import BaseHTTPRequestHandler
+from socketserver import ThreadingUnixStreamServer
+from threading import Thread
+from unittest.mock import MagicMock, patch
+
+from flask import Flask, request
+from utils.agent_pool import AgentPool
+from utils.shard import FORWARDED_HEADER, ShardRouter
+from werkzeug.exceptions import ServiceUnavailable
+
+
+class ShardHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = json.dumps(
+            {"path": self.path, "shard": self.headers.get(FORWARDED_HEADER)}
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        return "unix"
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestShardRouter(unittest.TestCase):
+    def setUp(self):
+        self.socket_dir = tempfile.mkdtemp()
+        self.router = ShardRouter(0, 2, self.socket_dir, timeout=5)
+
+    def serve_shard(self, shard: int) -> None:
+        server = ThreadingUnixStreamServer(self.router.socket_path(shard), ShardHandler)
+        Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(os.unlink, self.router.socket_path(shard))
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+    def test_owner(self):
+        self.assertEqual(self.router.owner(4), 0)
+        self.assertEqual(self.router.owner(7), 1)
+        self.assertTrue(self.router.is_local(4))
+        self.assertFalse(self.router.is_local(7))
+
+    def test_agent_pool_sharded_ids(self):
+        with patch("utils.agent_pool.cloudscraper") as mock_cloudscraper:
+            mock_cloudscraper.create_scraper.side_effect = lambda **kwargs: MagicMock()
+            pools = [AgentPool(shard=shard, shards=3) for shard in range(3)]
+
+            for shard, pool in enumerate(pools):
+                ids = [pool.generate()[0] for _ in range(3)]
+                self.assertTrue(all(agent_id % 3 == shard for agent_id in ids))
+                self.assertEqual(len(set(ids)), 3)
+
+            # Restored counters stay aligned with the shard
+            pools[1].agent_id = 9
+            self.assertEqual(pools[1].generate()[0], 10)
+            pools[2].agent_id = sys.maxsize
+            self.assertEqual(pools[2].generate()[0], 2)
+
+    def test_forward_request(self):
+        self.serve_shard(1)
+        app = Flask(__name__)
+
+        with app.test_request_context("/proxy?agent_id=7&dst=https://example.com"):
+            self.assertIsNone(self.router.forward_request(request, 4))
+            self.assertIsNone(self.router.forward_request(request, None))
+
+            response = self.router.forward_request(request, 7)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                json.loads(b"".join(response.response)),
+                {"path": "/proxy?agent_id=7&dst=https://example.com", "shard": "0"},
+            )
+
+        # Forwarded requests are handled by the receiving worker
+        with app.test_request_context(
+            "/proxy?agent_id=7", headers={FORWARDED_HEADER: "1"}
+        ):
+            self.assertIsNone(self.router.forward_request(request, 7))
+
+    def test_forward_request_unavailable(self):
+        app = Flask(__name__)
+
+        with app.test_request_context("/proxy?agent_id=7"):
+            with self.assertRaises(ServiceUnavailable):
+                self.router.forward_request(request, 7)
+
+    def test_broadcast(self):
+        router = ShardRouter(0, 3, self.socket_dir, timeout=5)
+        self.serve_shard(1)
+
+        # Shard 2 is unreachable and skipped
+        responses = router.broadcast("GET", "/agent/persistent", {})
+
+        self.assertEqual(len(responses), 1)
+        status, body = responses[0]
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body)["path"], "/agent/persistent")
+
+
+if __name__ == "__main__":
+    unittest.main()
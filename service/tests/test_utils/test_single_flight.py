@@ -0,0 +1,100 @@
+import unittest
+from threading import Event, Thread
+from time import sleep
+
+from utils.single_flight import SingleFlight
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_do_coalesces_concurrent_calls(self):
+        single_flight = SingleFlight()
+        release = Event()
+        calls = []
+        results = []
+
+        def fn():
+            calls.append(1)
+            release.wait(5)
+            return "result"
+
+        def call():
+            results.append(single_flight.do("key", fn))
+
+        threads = [Thread(target=call) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        while single_flight._flights.get("key") is None or (
+            single_flight._flights["key"].waiters < 4
+        ):
+            sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(results), [("result", False)] + [("result", True)] * 4)
+        self.assertEqual(
+            single_flight.stats(), {"in_flight": 0, "flights": 1, "coalesced": 4}
+        )
+
+    def test_do_sequential_calls(self):
+        single_flight = SingleFlight()
+        self.assertEqual(single_flight.do("key", lambda x: x, 1), (1, False))
+        self.assertEqual(single_flight.do("key", lambda x: x, 2), (2, False))
+        self.assertEqual(single_flight.stats()["flights"], 2)
+
+    def test_do_shares_errors(self):
+        single_flight = SingleFlight()
+        release = Event()
+        errors = []
+
+        def fn():
+            release.wait(5)
+            raise ValueError("error")
+
+        def call():
+            try:
+                single_flight.do("key", fn)
+            except ValueError as err:
+                errors.append(err)
+
+        threads = [Thread(target=call) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        while single_flight._flights.get("key") is None or (
+            single_flight._flights["key"].waiters < 2
+        ):
+            sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(errors), 3)
+        self.assertEqual(single_flight.in_flight(), 0)
+
+    def test_do_window(self):
+        single_flight = SingleFlight(window=0.05)
+
+        self.assertEqual(single_flight.do("key", lambda x: x, 1), (1, False))
+        # Calls within the window share the completed result
+        self.assertEqual(single_flight.do("key", lambda x: x, 2), (1, True))
+        self.assertEqual(
+            single_flight.stats(), {"in_flight": 0, "flights": 1, "coalesced": 1}
+        )
+
+        sleep(0.06)
+        self.assertEqual(single_flight.do("key", lambda x: x, 3), (3, False))
+
+    def test_do_window_skips_errors(self):
+        single_flight = SingleFlight(window=5)
+
+        def fn():
+            raise ValueError("error")
+
+        with self.assertRaises(ValueError):
+            single_flight.do("key", fn)
+        self.assertEqual(single_flight.do("key", lambda: 1), (1, False))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+import gzip
+import unittest
+import zlib
+
+from utils.stream import (
+    GzipDecoder,
+    accepts,
+    decode,
+    is_decodable,
+    iter_decoded,
+    negotiate,
+    zstandard,
+)
+
+
+class TestStream(unittest.TestCase):
+    def test_iter_decoded_gzip(self):
+        content = b"response content" * 1000
+        compressed = gzip.compress(content)
+        chunks = [compressed[i : i + 100] for i in range(0, len(compressed), 100)]
+
+        decoded = list(iter_decoded(chunks, "gzip", 256))
+
+        self.assertEqual(b"".join(decoded), content)
+        self.assertTrue(all(len(chunk) <= 256 for chunk in decoded))
+
+    def test_iter_decoded_gzip_short_chunks(self):
+        content = b"response content"
+        compressed = gzip.compress(content)
+
+        # The first chunks may be too short to tell whether the body is gzipped
+        for chunks in [
+            [compressed[:1], compressed[1:]],
+            [b"", compressed[:1], b"", compressed[1:]],
+        ]:
+            self.assertEqual(b"".join(iter_decoded(chunks, "gzip", 1024)), content)
+
+    def test_iter_decoded_not_gzipped(self):
+        chunks = [b"response ", b"content"]
+        self.assertEqual(list(iter_decoded(chunks, "gzip", 256)), chunks)
+        self.assertEqual(b"".join(iter_decoded([b"", b"x"], "gzip", 256)), b"x")
+
+    def test_iter_decoded_unsupported_encoding(self):
+        chunks = [b"response ", b"content"]
+        self.assertEqual(list(iter_decoded(chunks, None, 256)), chunks)
+        self.assertEqual(list(iter_decoded(chunks, "identity", 256)), chunks)
+
+    def test_gzip_decoder_bounded_output(self):
+        decoder = GzipDecoder(1024)
+        decoded = list(decoder.decode(gzip.compress(b"\x00" * 1024 * 1024)))
+        decoded.extend(decoder.flush())
+
+        self.assertEqual(sum(len(chunk) for chunk in decoded), 1024 * 1024)
+        self.assertTrue(all(len(chunk) <= 1024 for chunk in decoded))
+
+    def test_decode_gzip_members(self):
+        compressed = gzip.compress(b"a" * 10) + gzip.compress(b"b" * 10)
+        chunks = [compressed[i : i + 7] for i in range(0, len(compressed), 7)]
+
+        self.assertEqual(decode(compressed, "gzip"), b"a" * 10 + b"b" * 10)
+        self.assertEqual(b"".join(iter_decoded(chunks, "gzip", 4)), b"a" * 10 + b"b" * 10)
+
+    def test_iter_decoded_deflate(self):
+        content = b"response content" * 1000
+        raw = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+        # Some servers send a raw deflate stream without the zlib wrapper
+        for compressed in [zlib.compress(content), raw.compress(content) + raw.flush()]:
+            chunks = [compressed[i : i + 10] for i in range(0, len(compressed), 10)]
+            self.assertEqual(b"".join(iter_decoded(chunks, "deflate", 256)), content)
+            # An empty first chunk doesn't tell the stream kind
+            self.assertEqual(
+                b"".join(iter_decoded([b""] + chunks, "deflate", 256)), content
+            )
+
+    @unittest.skipIf(zstandard is None, "zstandard is not installed")
+    def test_iter_decoded_zstd(self):
+        compressor = zstandard.ZstdCompressor()
+        compressed = compressor.compress(b"response ") + compressor.compress(b"content")
+        chunks = [compressed[i : i + 5] for i in range(0, len(compressed), 5)]
+
+        self.assertEqual(b"".join(iter_decoded(chunks, "zstd", 256)), b"response content")
+
+    def test_decode_chained(self):
+        compressed = gzip.compress(zlib.compress(b"response content"))
+
+        self.assertEqual(decode(compressed, "deflate, gzip"), b"response content")
+        self.assertEqual(decode(b"response content", None), b"response content")
+
+    def test_is_decodable(self):
+        self.assertTrue(is_decodable("gzip"))
+        self.assertTrue(is_decodable("deflate, GZIP"))
+        self.assertFalse(is_decodable(None))
+        self.assertFalse(is_decodable("identity"))
+        self.assertFalse(is_decodable("gzip, compress"))
+
+    def test_accepts(self):
+        self.assertTrue(accepts(None, None))
+        self.assertTrue(accepts("gzip", "identity"))
+        self.assertTrue(accepts("gzip, deflate", "gzip"))
+        self.assertTrue(accepts("*", "br"))
+        self.assertTrue(accepts("gzip;q=0.5, deflate", "deflate, gzip"))
+        self.assertFalse(accepts(None, "gzip"))
+        self.assertFalse(accepts("gzip;q=0", "gzip"))
+        self.assertFalse(accepts("deflate", "gzip"))
+        self.assertFalse(accepts("*, gzip;q=0", "gzip"))
+
+    def test_negotiate(self):
+        self.assertEqual(negotiate("gzip, deflate"), "gzip, deflate")
+        self.assertEqual(negotiate("gzip, compress"), "gzip")
+        self.assertEqual(negotiate(None), "identity")
+        if zstandard is not None:
+            self.assertEqual(negotiate("gzip", zstd=True), "gzip")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,202 @@
+import unittest
+from unittest.mock import MagicMock
+
+from controller.admin_controller import construct_admin_blueprint
+from controller.persistent_agent_controller import construct_persistent_agent_blueprint
+from controller.proxy_controller import construct_proxy_blueprint
+from flask_testing import TestCase
+from main import create_app
+from requests.cookies import RequestsCookieJar, create_cookie
+from utils.flight_recorder import FlightRecorder
+from utils.profile_selector import ProfileSelector
+from utils.profiler import (
+    PROFILE_HEADER,
+    PROFILE_ID_HEADER,
+    RequestProfiler,
+    StackSampler,
+)
+
+
+class TestAdminController(TestCase):
+    def create_app(self):
+        app, _ = create_app()
+        app.config["TESTING"] = True
+
+        self.mock_agent_pool = MagicMock()
+        self.mock_agent_pool.__contains__.side_effect = lambda key: key == 1
+        self.mock_agent_pool.route.return_value = None
+        self.mock_agent_pool.generate.return_value = (2, MagicMock())
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.headers = {"Content-Type": "text/plain"}
+        mock_response.content = b"response content"
+        cookies = RequestsCookieJar()
+
+        def request(method, url, **kwargs):
+            cookies.set_cookie(create_cookie("cf_clearance", url, domain=".example.com"))
+            return mock_response
+
+        self.mock_agent = MagicMock(request=request, cookies=cookies)
+        self.mock_agent_pool.use.return_value.__enter__.return_value = self.mock_agent
+
+        self.flight_recorder = FlightRecorder(slowest=10, sample_size=10, sample_rate=1)
+        app.register_blueprint(
+            construct_proxy_blueprint(
+                self.mock_agent_pool, flight_recorder=self.flight_recorder
+            )
+        )
+        app.register_blueprint(
+            construct_persistent_agent_blueprint(
+                self.mock_agent_pool, flight_recorder=self.flight_recorder
+            )
+        )
+        self.stack_sampler = StackSampler()
+        app.register_blueprint(
+            construct_admin_blueprint(
+                self.flight_recorder,
+                stack_sampler=self.stack_sampler,
+                request_profiler=RequestProfiler(),
+            )
+        )
+        return app
+
+    def test_requests(self):
+        self.client.get("/proxy?dst=http://example.com/")
+        self.client.post(
+            "/proxy?agent_id=1&dst=http://example.com/",
+            data=b"body",
+            content_type="text/plain",
+        )
+        self.client.post("/agent/persistent", content_type="application/json", json={})
+
+        response = self.client.get("/admin/requests")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["recorded"], 3)
+        self.assertEqual(len(response.json["slowest"]), 3)
+        proxied, posted, created = sorted(
+            response.json["sample"], key=lambda record: record["started"]
+        )
+        self.assertEqual(proxied["endpoint"], "/proxy")
+        self.assertEqual(proxied["agent_id"], 2)
+        self.assertEqual(proxied["host"], "example.com")
+        self.assertEqual(proxied["status"], 200)
+        self.assertEqual(proxied["bytes_out"], len(b"response content"))
+        self.assertTrue(proxied["challenge"])
+        self.assertEqual(
+            set(proxied["stages"]), {"agent", "lease", "challenge", "response"}
+        )
+        self.assertEqual(posted["method"], "POST")
+        self.assertEqual(posted["agent_id"], 1)
+        self.assertEqual(posted["bytes_in"], 4)
+        self.assertEqual(created["endpoint"], "/agent/persistent")
+        self.assertEqual(created["agent_id"], 2)
+
+        response = self.client.delete("/admin/requests")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get("/admin/requests").json["recorded"], 0)
+
+    def test_profile(self):
+        response = self.client.get("/admin/profile?seconds=0.05")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content_type, "text/plain; charset=utf-8")
+        # The request handler is sampling
+        self.assertIn("running;", response.data.decode())
+        self.assertRegex(response.data.decode().splitlines()[0], r" \d+$")
+
+    def test_profile_busy(self):
+        self.stack_sampler._lock.acquire()
+        self.addCleanup(self.stack_sampler._lock.release)
+
+        response = self.client.get("/admin/profile?seconds=0.05")
+
+        self.assertEqual(response.status_code, 409)
+
+    def test_request_profile(self):
+        response = self.client.get(
+            "/proxy?agent_id=1&dst=http://example.com/", headers={PROFILE_HEADER: "1"}
+        )
+        profile_id = response.headers[PROFILE_ID_HEADER]
+
+        response = self.client.get(f"/admin/profile/{profile_id}")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("proxy_controller.py", response.data.decode())
+        self.assertEqual(self.client.get("/admin/profile/99").status_code, 404)
+        self.assertNotIn(PROFILE_ID_HEADER, self.client.get("/admin/requests").headers)
+
+
+class TestAdminControllerSelection(TestCase):
+    def create_app(self):
+        app, _ = create_app()
+        app.config["TESTING"] = True
+
+        self.profiles = [
+            {"browser": {"browser": "firefox", "platform": "linux"}},
+            {"browser": {"browser": "firefox", "platform": "windows"}},
+        ]
+        self.profile_selector = ProfileSelector(self.profiles, exploration=0)
+        generated = {}
+
+        def generate(**kwargs):
+            generated[2] = kwargs
+            return 2, MagicMock()
+
+        self.mock_agent_pool = MagicMock()
+        self.mock_agent_pool.__contains__.side_effect = lambda key: key in generated
+        self.mock_agent_pool.route.return_value = None
+        self.mock_agent_pool.generate.side_effect = generate
+        self.mock_agent_pool.info.side_effect = lambda agent_id: MagicMock(
+            kwargs=generated[agent_id]
+        )
+        self.mock_agent_pool.egress = None
+        mock_response = MagicMock()
+        mock_response.status_code = 403
+        mock_response.headers = {"Content-Type": "text/plain"}
+        mock_response.content = b"blocked"
+        cookies = RequestsCookieJar()
+
+        def request(method, url, **kwargs):
+            cookies.set_cookie(create_cookie("cf_clearance", url, domain=".example.com"))
+            return mock_response
+
+        self.mock_agent = MagicMock(request=request, cookies=cookies, headers={})
+        self.mock_agent_pool.use.return_value.__enter__.return_value = self.mock_agent
+
+        app.register_blueprint(
+            construct_proxy_blueprint(
+                self.mock_agent_pool,
+                self.profiles,
+                profile_selector=self.profile_selector,
+            )
+        )
+        app.register_blueprint(
+            construct_admin_blueprint(profile_selector=self.profile_selector)
+        )
+        return app
+
+    def test_selection(self):
+        self.client.get("/proxy?dst=http://www.example.com/")
+
+        response = self.client.get("/admin/selection?host=www.example.com")
+
+        self.assertEqual(response.status_code, 200)
+        (entry,) = response.json
+        profile = self.mock_agent_pool.generate.call_args.kwargs
+        self.assertEqual(entry["config"], profile)
+        self.assertEqual(entry["profile"], self.profiles.index(profile))
+        self.assertEqual(entry["selected"], 1)
+        self.assertEqual(entry["requests"], 1)
+        self.assertEqual(entry["challenges"], 1)
+        self.assertEqual(entry["blocked"], 1)
+        self.assertEqual(entry["score"], 0)
+        # The total of all hosts comes first
+        self.assertEqual(self.client.get("/admin/selection").json[0]["host"], "*")
+        # The blocked profile is avoided on the host by the new agents
+        self.app.test_client().get("/proxy?dst=http://www.example.com/")
+        self.assertNotEqual(self.mock_agent_pool.generate.call_args.kwargs, profile)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -7,6 +7,7 @@ from controller.ephemeral_agent_controller import (
 from flask_testing import TestCase
 from main import create_app
 from parameterized import parameterized
+from utils.clearance import Clearance
 from utils.dotdict import dotdict
 
 UA = "Mozilla/5.0 (X11; Linux x86_64; rv:56.0; Waterfox) Gecko/20100101 Firefox/56.2.4"
@@ -76,8 +77,10 @@ class TestEphemeralAgentController(TestCase):
         ]
     )
     def test_agent_request_post(self, name, url, params, expected):
-        with patch("cloudscraper.get_cookie_string") as mock_get_cookie_string:
-            mock_get_cookie_string.return_value = ("some_cf_clearance_value", UA)
+        with patch("utils.clearance.solve_clearance") as mock_solve_clearance:
+            mock_solve_clearance.return_value = Clearance(
+                "some_cf_clearance_value", UA, None
+            )
             response = self.client.post(
                 url,
                 content_type="application/json",
@@ -86,6 +89,27 @@ class TestEphemeralAgentController(TestCase):
             self.assertEqual(response.status_code, expected.status_code)
             self.assertEqual(response.json, expected.json)
 
+    def test_agent_request_post_cached(self):
+        with patch("utils.clearance.solve_clearance") as mock_solve_clearance:
+            mock_solve_clearance.return_value = Clearance(
+                "some_cf_clearance_value", UA, None
+            )
+            for url in [
+                "/agent/ephemeral?url=http://example.com",
+                "/agent/ephemeral?url=http://example.com/page",
+            ]:
+                response = self.client.post(url, content_type="application/json", json={})
+                self.assertEqual(response.status_code, 201)
+            mock_solve_clearance.assert_called_once_with("http://example.com")
+
+            response = self.client.post(
+                "/agent/ephemeral?url=http://example.com&refresh=true",
+                content_type="application/json",
+                json={},
+            )
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(mock_solve_clearance.call_count, 2)
+
 
 if __name__ == "__main__":
     unittest.main()
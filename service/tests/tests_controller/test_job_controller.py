@@ -0,0 +1,135 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+from controller.job_controller import construct_job_blueprint
+from flask_testing import TestCase
+from main import create_app
+from utils.clearance import Clearance
+from utils.config import JobConfigSchema
+from utils.jobs import JobQueue
+
+UA = "Mozilla/5.0 (X11; Linux x86_64; rv:56.0; Waterfox) Gecko/20100101 Firefox/56.2.4"
+
+
+class TestJobController(TestCase):
+    def create_app(self):
+        app, _ = create_app()
+        app.config["TESTING"] = True
+
+        # Mock agent functionality
+        self.mock_agent = MagicMock()
+        self.mock_agent.cookies.get_dict.return_value = {"cf_clearance": "value"}
+        self.mock_agent.headers.get.return_value = UA
+
+        # Mock agent pool functionality
+        self.mock_agent_pool = MagicMock()
+        self.mock_agent_pool.generate.side_effect = [(1, self.mock_agent), (2, None)]
+        self.mock_agent_pool.use.return_value.__enter__.return_value = self.mock_agent
+
+        self.job_queue = JobQueue(max_queued=2)
+        app.register_blueprint(
+            construct_job_blueprint(
+                self.mock_agent_pool,
+                self.job_queue,
+                job_config=JobConfigSchema().load({"max_items": 2}),
+            )
+        )
+        return app
+
+    def start_job_queue(self):
+        self.job_queue.start()
+        self.addCleanup(self.job_queue.stop)
+
+    def test_persistent_agents(self):
+        self.start_job_queue()
+        response = self.client.post(
+            "/job/agent/persistent",
+            content_type="application/json",
+            json={"count": 2, "url": "http://example.com"},
+        )
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json["kind"], "persistent")
+        self.assertEqual(response.json["total"], 2)
+        self.assertIn(f"/job/{response.json['id']}", response.headers["Location"])
+
+        response = self.client.get(f"/job/{response.json['id']}?wait=5")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["status"], "done")
+        self.assertEqual(
+            sorted(response.json["results"], key=lambda result: result["id"]),
+            [
+                {"id": 1, "user_agent": UA, "cf_clearance": "value"},
+                {"id": 2, "user_agent": UA, "cf_clearance": "value"},
+            ],
+        )
+        self.mock_agent_pool.use.assert_called_with(2, "http://example.com")
+        self.mock_agent.get.assert_called_with("http://example.com", timeout=(10, 60))
+
+    def test_persistent_agents_failed_challenge(self):
+        self.start_job_queue()
+        self.mock_agent.get.side_effect = RuntimeError("Challenge failed.")
+
+        response = self.client.post(
+            "/job/agent/persistent", content_type="application/json", json={"url": "x"}
+        )
+        response = self.client.get(f"/job/{response.json['id']}?wait=5")
+
+        self.assertEqual(response.json["status"], "failed")
+        self.assertEqual(response.json["results"], [{"error": "Challenge failed."}])
+        # The agent without clearance isn't kept
+        self.mock_agent_pool.pop.assert_called_once_with(1, None)
+
+    def test_ephemeral_agents(self):
+        self.start_job_queue()
+        with patch("utils.clearance.solve_clearance") as mock_solve_clearance:
+            mock_solve_clearance.return_value = Clearance("value", UA, None)
+            response = self.client.post(
+                "/job/agent/ephemeral",
+                content_type="application/json",
+                json={"urls": ["http://example.com", "http://example.org"]},
+            )
+            self.assertEqual(response.status_code, 202)
+
+            response = self.client.get(f"/job/{response.json['id']}?wait=5")
+
+        self.assertEqual(
+            response.json["results"],
+            [
+                {"url": "http://example.com", "user_agent": UA, "cf_clearance": "value"},
+                {"url": "http://example.org", "user_agent": UA, "cf_clearance": "value"},
+            ],
+        )
+        self.assertEqual(mock_solve_clearance.call_count, 2)
+
+    def test_too_many_items(self):
+        response = self.client.post(
+            "/job/agent/persistent", content_type="application/json", json={"count": 3}
+        )
+
+        self.assertEqual(response.status_code, 422)
+
+    def test_queue_full(self):
+        for status_code in (202, 202, 503):
+            response = self.client.post(
+                "/job/agent/persistent", content_type="application/json", json={}
+            )
+            self.assertEqual(response.status_code, status_code)
+
+        self.assertEqual(self.job_queue.stats()["rejected"], 1)
+
+    def test_not_found(self):
+        response = self.client.get("/job/99")
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_stats(self):
+        response = self.client.get("/job/stats")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["queued"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
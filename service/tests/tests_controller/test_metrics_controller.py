@@ -0,0 +1,107 @@
+import gzip
+import unittest
+from unittest.mock import MagicMock
+
+from controller.metrics_controller import construct_metrics_blueprint
+from controller.proxy_controller import construct_proxy_blueprint
+from flask_testing import TestCase
+from main import create_app
+from requests.cookies import RequestsCookieJar, create_cookie
+from utils.metrics import Metrics
+
+
+class TestMetricsController(TestCase):
+    def create_app(self):
+        app, _ = create_app()
+        app.config["TESTING"] = True
+
+        self.mock_agent_pool = MagicMock()
+        self.mock_agent_pool.__contains__.side_effect = lambda key: key == 1
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.headers = {"Content-Encoding": "gzip"}
+        mock_response.content = gzip.compress(b"response content")
+        cookies = RequestsCookieJar()
+
+        def request(method, url, **kwargs):
+            if not cookies:
+                # The first request solves the challenge
+                cookies.set_cookie(
+                    create_cookie("cf_clearance", "value", domain=".example.com")
+                )
+            return mock_response
+
+        self.mock_agent = MagicMock(request=request, cookies=cookies)
+        self.mock_agent_pool.use.return_value.__enter__.return_value = self.mock_agent
+        self.mock_agent_pool.__len__.return_value = 1
+        self.mock_agent_pool.created = 1
+        self.mock_agent_pool.stats.return_value = {
+            "memory": 1024,
+            "evictions": {"capacity": 0, "memory": 0, "ttl": 0},
+            "leases": {
+                "acquired": 2,
+                "contended": 0,
+                "timeouts": 0,
+                "wait_seconds": 0.0,
+                "waiting": 0,
+            },
+        }
+        self.metrics = Metrics()
+        self.metrics.track_pool(self.mock_agent_pool)
+
+        app.register_blueprint(construct_metrics_blueprint(self.metrics))
+        app.register_blueprint(
+            construct_proxy_blueprint(self.mock_agent_pool, metrics=self.metrics)
+        )
+        return app
+
+    def test_metrics(self):
+        for _ in range(2):
+            response = self.client.get("/proxy?agent_id=1&dst=http://example.com/")
+            self.assertEqual(response.data, b"response content")
+
+        response = self.client.get("/metrics")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith("text/plain; version=0.0.4"))
+        text = response.data.decode()
+        for stage, count in [
+            ("agent", 2),
+            ("challenge", 1),
+            ("upstream", 1),
+            ("decompression", 2),
+            ("response", 2),
+        ]:
+            self.assertIn(
+                f'cloudscraper_proxy_stage_seconds_count{{stage="{stage}"}} {count}\n',
+                text,
+            )
+        self.assertIn(
+            'cloudscraper_proxy_upstream_responses_total{host="example.com",status="200"} 2\n',
+            text,
+        )
+        self.assertIn(
+            'cloudscraper_proxy_request_seconds_count{endpoint="proxy.proxy",method="GET"} 2\n',
+            text,
+        )
+        # The metrics request itself is in flight
+        self.assertIn(
+            'cloudscraper_proxy_requests_in_flight{endpoint="metrics.get"} 1\n', text
+        )
+        self.assertIn("cloudscraper_proxy_upstream_requests_in_flight 0\n", text)
+        self.assertIn("cloudscraper_proxy_agents 1\n", text)
+
+    def test_upstream_error(self):
+        self.mock_agent.request = MagicMock(side_effect=ConnectionError())
+
+        with self.assertRaises(ConnectionError):
+            self.client.get("/proxy?agent_id=1&dst=http://example.com/")
+
+        self.assertIn(
+            'cloudscraper_proxy_upstream_responses_total{host="example.com",status="error"} 1\n',
+            self.client.get("/metrics").data.decode(),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
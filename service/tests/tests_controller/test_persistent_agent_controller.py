@@ -72,6 +72,31 @@ class TestPersistentAgentController(TestCase):
         self.assertEqual(response.status_code, expected.status_code)
         self.assertEqual(response.json, expected.json)
 
+    def test_agent_pool_stats(self):
+        stats = {"size": 2, "memory": 1024, "created": 5, "evictions": {"capacity": 1, "memory": 0, "ttl": 3}}
+        self.mock_agent_pool.stats.return_value = stats
+        response = self.client.get("/agent/persistent/stats")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json, stats)
+
+    def test_agent_contention(self):
+        contention = [
+            {
+                "id": 1,
+                "in_flight": 1,
+                "waiting": 2,
+                "leases": 10,
+                "contended": 4,
+                "timeouts": 0,
+                "wait_seconds": 0.5,
+            }
+        ]
+        self.mock_agent_pool.contention.return_value = contention
+        response = self.client.get("/agent/persistent/contention?limit=5")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json, contention)
+        self.mock_agent_pool.contention.assert_called_once_with(5)
+
     @parameterized.expand(
         [
             (
@@ -1,4 +1,10 @@
+import gzip
+import json
 import unittest
+from base64 import b64decode
+from contextlib import nullcontext
+from threading import Event, Thread
+from time import sleep
 from unittest.mock import MagicMock
 
 from controller.proxy_controller import (
@@ -10,7 +16,19 @@ from controller.proxy_controller import (
 from flask_testing import TestCase
 from main import create_app
 from parameterized import parameterized
+from requests import ConnectionError as RequestsConnectionError
+from requests import ConnectTimeout
+from requests.cookies import RequestsCookieJar
+from utils.agent_pool import AgentNotFound, LeaseTimeout
+from utils.circuit_breaker import CircuitBreaker
+from utils.config import (
+    CollapseConfigSchema,
+    EncodingConfigSchema,
+    UpstreamConfigSchema,
+)
 from utils.dotdict import dotdict
+from utils.host_limiter import HostLimiter
+from utils.response_cache import ResponseCache
 
 
 class TestProxyController(TestCase):
@@ -20,8 +38,8 @@ class TestProxyController(TestCase):
 
         # Mock agent pool functionality
         self.mock_agent_pool = MagicMock()
-        self.mock_agent_pool.__contains__.side_effect = (
-            lambda key: True if key == 1 else False
+        self.mock_agent_pool.__contains__.side_effect = lambda key: (
+            True if key == 1 else False
         )
         self.mock_agent_pool.generate.return_value = (1, MagicMock())
         mock_response = MagicMock()
@@ -29,9 +47,14 @@ class TestProxyController(TestCase):
         mock_response.headers = {"Content-Type": "text/plain"}
         mock_response.content = b"response content"
         mock_response.iter_content.return_value = [mock_response.content]
-        self.mock_agent_pool.__getitem__.return_value = MagicMock(
-            request=MagicMock(return_value=mock_response)
+        mock_response.raw.stream.return_value = [mock_response.content]
+        self.mock_response = mock_response
+        self.mock_agent_pool.route.return_value = None
+        self.mock_agent = MagicMock(
+            request=MagicMock(return_value=mock_response),
+            headers={"Accept-Encoding": "gzip, deflate"},
         )
+        self.mock_agent_pool.use.return_value.__enter__.return_value = self.mock_agent
 
         app.register_blueprint(construct_proxy_blueprint(self.mock_agent_pool))
         return app
@@ -88,13 +111,144 @@ class TestProxyController(TestCase):
         if expected.cookie is not None:
             self.assertEqual(response.headers.get("Set-Cookie"), expected.cookie)
         if name == "agent-not-specified":
+            self.mock_agent_pool.route.assert_called_once_with("example.com")
             self.mock_agent_pool.generate.assert_called_once_with()
+        if name == "valid-agent":
+            self.mock_agent_pool.route.assert_not_called()
+            self.mock_agent_pool.use.assert_called_once_with(1, "http://example.com")
+
+    def test_proxy_request_routed(self):
+        self.mock_agent_pool.route.return_value = 7
+        response = self.client.get("/proxy?dst=http://www.example.com/page")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.headers.get("Set-Cookie"), "cloudscraper-agent-id=7; Path=/"
+        )
+        self.mock_agent_pool.route.assert_called_once_with("www.example.com")
+        self.mock_agent_pool.generate.assert_not_called()
+        self.mock_agent_pool.use.assert_called_once_with(7, "http://www.example.com/page")
+
+    def test_proxy_request_agent_busy(self):
+        self.mock_agent_pool.use.side_effect = LeaseTimeout("Agent 1 is busy.")
+        response = self.client.get("/proxy?agent_id=1&dst=http://example.com")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json["message"], "Agent 1 is busy.")
+        self.mock_agent.request.assert_not_called()
+
+    def test_proxy_request_agent_removed(self):
+        self.mock_agent_pool.use.side_effect = AgentNotFound("Agent 1 not found.")
+        response = self.client.get("/proxy?agent_id=1&dst=http://example.com")
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json["message"], "Agent 1 not found.")
+        self.mock_agent.request.assert_not_called()
+
+    def test_proxy_request_stream(self):
+        response = self.client.get("/proxy?agent_id=1&dst=http://example.com&stream=true")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.data, b"response content")
+        self.assertEqual(
+            response.headers.get("Set-Cookie"), "cloudscraper-agent-id=1; Path=/"
+        )
+        self.mock_response.close.assert_called_once()
+        _, kwargs = self.mock_agent.request.call_args
+        self.assertTrue(kwargs["stream"])
+
+    def test_proxy_request_stream_holds_lease(self):
+        lease = self.mock_agent_pool.use.return_value
+
+        response = self.client.get("/proxy?agent_id=1&dst=http://example.com&stream=true")
+
+        # The agent is leased until the body is sent
+        lease.__exit__.assert_not_called()
+        self.assertEqual(response.data, b"response content")
+        response.close()
+        lease.__exit__.assert_called_once()
+
+    def test_proxy_request_stream_gzip(self):
+        self.mock_response.headers = {
+            "Content-Type": "text/plain",
+            "Content-Encoding": "gzip",
+            "Content-Length": "42",
+        }
+        self.mock_response.raw.stream.return_value = [gzip.compress(b"response content")]
+        response = self.client.get("/proxy?agent_id=1&dst=http://example.com&stream=true")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, b"response content")
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertNotIn("Content-Length", response.headers)
+
+    def test_proxy_request_negotiated_encoding(self):
+        self.mock_agent.headers = {"Accept-Encoding": "gzip, deflate, compress"}
+        self.client.get("/proxy?agent_id=1&dst=http://example.com")
+        _, kwargs = self.mock_agent.request.call_args
+        self.assertEqual(kwargs["headers"]["Accept-Encoding"], "gzip, deflate")
+
+    def test_proxy_batch(self):
+        self.mock_agent_pool.generate.return_value = (2, MagicMock())
+        response = self.client.post(
+            "/proxy/batch",
+            json={
+                "items": [
+                    {"dst": "http://example.com/1", "agent_id": 1},
+                    {
+                        "method": "POST",
+                        "dst": "http://example.com/2",
+                        "headers": {"X-Custom-Header": "value", "Host": "proxy"},
+                        "body": "payload",
+                    },
+                ],
+                "concurrency": 2,
+            },
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, "application/x-ndjson")
+        results = sorted(
+            (json.loads(line) for line in response.data.splitlines()),
+            key=lambda result: result["index"],
+        )
+        self.assertEqual([result["agent_id"] for result in results], [1, 2])
+        self.assertEqual([result["status"] for result in results], [200, 200])
+        self.assertEqual(b64decode(results[0]["body"]), b"response content")
+        self.assertEqual(results[1]["dst"], "http://example.com/2")
+        self.mock_agent.request.assert_any_call(
+            "POST",
+            "http://example.com/2",
+            headers={"X-Custom-Header": "value"},
+            data=b"payload",
+            stream=False,
+            timeout=(10, 60),
+        )
+
+    def test_proxy_batch_item_error(self):
+        self.mock_agent.request.side_effect = ConnectionError("Connection refused.")
+        response = self.client.post(
+            "/proxy/batch", json={"items": [{"dst": "http://example.com", "agent_id": 1}]}
+        )
+
+        self.assertEqual(response.status_code, 200)
+        result = json.loads(response.data)
+        self.assertEqual(result["index"], 0)
+        self.assertEqual(result["error"], "Connection refused.")
+
+    def test_proxy_batch_invalid(self):
+        self.assertEqual(
+            self.client.post("/proxy/batch", json={"items": []}).status_code, 422
+        )
+        self.assertEqual(
+            self.client.post(
+                "/proxy/batch", json={"items": [{"dst": "http://example.com"}] * 1001}
+            ).status_code,
+            422,
+        )
 
     def test_filter_headers(self):
         headers = {
             "Accept": "text/html",
             "Accept-Encoding": "gzip, deflate",
             "Connection": "keep-alive",
+            "Cookie": "cloudscraper-agent-id=0; custom_cookie=custom-value",
             "Host": "example.com",
             "User-Agent": "test-agent",
             "X-Custom-Header": "custom-value",
@@ -104,6 +258,7 @@ class TestProxyController(TestCase):
         self.assertNotIn("Accept", filtered)
         self.assertNotIn("Accept-Encoding", filtered)
         self.assertNotIn("Connection", filtered)
+        self.assertNotIn("Cookie", filtered)
         self.assertNotIn("Host", filtered)
         self.assertNotIn("User-Agent", filtered)
         self.assertIn("X-Custom-Header", filtered)
@@ -116,5 +271,526 @@ class TestProxyController(TestCase):
         self.assertEqual(filtered["custom_cookie"], "custom-value")
 
 
+class TestProxyControllerEncoding(TestCase):
+    def create_app(self):
+        app, _ = create_app()
+        app.config["TESTING"] = True
+
+        self.mock_agent_pool = MagicMock()
+        self.mock_agent_pool.__contains__.side_effect = lambda key: key == 1
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        # Bodies read without the passthrough are already decoded by requests
+        mock_response.content = b"response content"
+        self.mock_response = mock_response
+        self.mock_agent = MagicMock(
+            request=MagicMock(return_value=mock_response),
+            headers={"Accept-Encoding": "gzip, deflate"},
+        )
+        self.mock_agent_pool.use.return_value.__enter__.return_value = self.mock_agent
+
+        app.register_blueprint(
+            construct_proxy_blueprint(
+                self.mock_agent_pool,
+                encoding_config=EncodingConfigSchema().load({"passthrough": True}),
+            )
+        )
+        return app
+
+    def test_proxy_request_stream_gzip_passthrough(self):
+        compressed = gzip.compress(b"response content")
+        self.mock_response.headers = {
+            "Content-Encoding": "gzip",
+            "Content-Length": str(len(compressed)),
+        }
+        self.mock_response.raw.stream.return_value = [compressed]
+        response = self.client.get(
+            "/proxy?agent_id=1&dst=http://example.com&stream=true",
+            headers={"Accept-Encoding": "gzip, deflate"},
+        )
+        self.assertEqual(response.data, compressed)
+        self.assertEqual(response.headers.get("Content-Encoding"), "gzip")
+        self.assertEqual(response.headers.get("Content-Length"), str(len(compressed)))
+        self.assertEqual(response.headers.get("Vary"), "Accept-Encoding")
+
+    @parameterized.expand(
+        [
+            ("passthrough", "gzip", True),
+            ("not-accepted", "br", False),
+            ("no-accept-encoding", None, False),
+        ]
+    )
+    def test_proxy_request_gzip(self, name, accept_encoding, passthrough):
+        compressed = gzip.compress(b"response content")
+        self.mock_response.headers = {
+            "Content-Encoding": "gzip",
+            "Content-Length": str(len(compressed)),
+        }
+        self.mock_response._content_consumed = False
+        self.mock_response.raw.read.return_value = compressed
+        headers = {"Accept-Encoding": accept_encoding} if accept_encoding else {}
+        response = self.client.get(
+            "/proxy?agent_id=1&dst=http://example.com", headers=headers
+        )
+
+        self.assertEqual(response.status_code, 200)
+        if passthrough:
+            self.assertEqual(response.data, compressed)
+            self.assertEqual(response.headers.get("Content-Encoding"), "gzip")
+            self.assertEqual(response.headers.get("Vary"), "Accept-Encoding")
+        else:
+            self.assertEqual(response.data, b"response content")
+            self.assertNotIn("Content-Encoding", response.headers)
+        self.assertEqual(response.headers.get("Content-Length"), str(len(response.data)))
+        _, kwargs = self.mock_agent.request.call_args
+        self.assertEqual(kwargs["stream"], accept_encoding is not None)
+        if accept_encoding is not None:
+            self.mock_response.raw.read.assert_called_once_with(decode_content=False)
+            self.mock_response.raw.release_conn.assert_called_once()
+
+
+class TestProxyControllerCache(TestCase):
+    def create_app(self):
+        app, _ = create_app()
+        app.config["TESTING"] = True
+
+        self.mock_agent_pool = MagicMock()
+        self.mock_agent_pool.__contains__.side_effect = lambda key: key == 1
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.headers = {
+            "Content-Type": "text/plain",
+            "Cache-Control": "max-age=60",
+            "ETag": '"v1"',
+        }
+        mock_response.content = b"response content"
+        self.mock_response = mock_response
+        self.mock_agent = MagicMock(
+            request=MagicMock(return_value=mock_response), cookies=RequestsCookieJar()
+        )
+        self.mock_agent_pool.use.return_value.__enter__.return_value = self.mock_agent
+        self.response_cache = ResponseCache()
+
+        app.register_blueprint(
+            construct_proxy_blueprint(
+                self.mock_agent_pool, response_cache=self.response_cache
+            )
+        )
+        return app
+
+    def test_proxy_request_cached(self):
+        url = "/proxy?agent_id=1&dst=http://example.com/catalog"
+
+        first = self.client.get(url)
+        second = self.client.get(url)
+
+        self.assertEqual(first.headers.get("X-Cache"), "MISS")
+        self.assertEqual(second.headers.get("X-Cache"), "HIT")
+        self.assertEqual(second.data, b"response content")
+        self.assertEqual(second.headers.get("ETag"), '"v1"')
+        self.assertEqual(
+            second.headers.get("Set-Cookie"), "cloudscraper-agent-id=1; Path=/"
+        )
+        self.mock_agent.request.assert_called_once()
+
+        stats = self.client.get("/proxy/cache").json
+        self.assertEqual(stats["hit"], 1)
+        self.assertEqual(stats["miss"], 1)
+        self.assertEqual(stats["hit_ratio"], 0.5)
+
+    def test_proxy_request_cached_without_lease(self):
+        self.mock_agent_pool.route.return_value = None
+        self.mock_agent_pool.generate.return_value = (1, self.mock_agent)
+        url = "/proxy?dst=http://example.com/catalog"
+        self.client.get(url)
+        self.client.delete_cookie("cloudscraper-agent-id")
+        self.mock_agent_pool.reset_mock()
+
+        cookieless = self.client.get(url)
+        self.client.set_cookie("cloudscraper-agent-id", "1")
+        with_agent = self.client.get(url)
+
+        self.assertEqual(cookieless.headers.get("X-Cache"), "HIT")
+        self.assertNotIn("Set-Cookie", cookieless.headers)
+        self.assertEqual(with_agent.headers.get("X-Cache"), "HIT")
+        self.mock_agent_pool.generate.assert_not_called()
+        self.mock_agent_pool.use.assert_not_called()
+
+    def test_proxy_request_revalidated(self):
+        self.mock_response.headers["Cache-Control"] = "no-cache"
+        url = "/proxy?agent_id=1&dst=http://example.com/catalog"
+        self.client.get(url)
+
+        not_modified = MagicMock(status_code=304, headers={"Cache-Control": "no-cache"})
+        self.mock_agent.request.return_value = not_modified
+        response = self.client.get(url)
+
+        self.assertEqual(response.headers.get("X-Cache"), "REVALIDATED")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, b"response content")
+        _, kwargs = self.mock_agent.request.call_args
+        self.assertEqual(kwargs["headers"]["If-None-Match"], '"v1"')
+
+    def test_proxy_request_bypass(self):
+        url = "/proxy?agent_id=1&dst=http://example.com/catalog"
+        self.client.get(url)
+
+        response = self.client.get(url, headers={"Authorization": "Bearer token"})
+        post = self.client.post(url)
+
+        self.assertEqual(response.headers.get("X-Cache"), "BYPASS")
+        self.assertNotIn("X-Cache", post.headers)
+        self.assertEqual(self.mock_agent.request.call_count, 3)
+        self.assertEqual(self.response_cache.stats()["bypass"], 1)
+
+        self.assertEqual(self.client.delete("/proxy/cache").status_code, 200)
+        self.assertEqual(self.client.get(url).headers.get("X-Cache"), "MISS")
+
+
+class TestProxyControllerCollapse(TestCase):
+    def create_app(self):
+        app, _ = create_app()
+        app.config["TESTING"] = True
+
+        self.release = Event()
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.headers = {"Content-Type": "text/plain"}
+        mock_response.content = b"response content"
+
+        def request(*args, **kwargs):
+            self.release.wait(5)
+            return mock_response
+
+        self.mock_agent_pool = MagicMock()
+        self.mock_agent_pool.__contains__.side_effect = lambda key: key in {1, 2}
+        self.mock_agent = MagicMock(request=MagicMock(side_effect=request), cookies=[])
+        self.mock_agent_pool.use.return_value.__enter__.return_value = self.mock_agent
+
+        app.register_blueprint(
+            construct_proxy_blueprint(
+                self.mock_agent_pool,
+                collapse_config=CollapseConfigSchema().load({"enabled": True}),
+            )
+        )
+        return app
+
+    def test_proxy_request_collapsed(self):
+        responses = []
+
+        def call(agent_id, headers):
+            with self.app.test_client() as client:
+                responses.append(
+                    client.get(
+                        f"/proxy?agent_id={agent_id}&dst=http://example.com/catalog",
+                        headers=headers,
+                    )
+                )
+
+        threads = [
+            Thread(target=call, args=(1, {"X-Request-Id": "a"})),
+            Thread(target=call, args=(2, {"X-Request-Id": "b"})),
+            Thread(target=call, args=(1, {})),
+        ]
+        for thread in threads:
+            thread.start()
+        while self.mock_agent_pool.use.call_count < 3:
+            sleep(0.001)
+        sleep(0.05)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.mock_agent.request.call_count, 1)
+        self.assertEqual([r.data for r in responses], [b"response content"] * 3)
+        self.assertEqual(
+            sorted(r.headers.get("Set-Cookie") for r in responses),
+            [
+                "cloudscraper-agent-id=1; Path=/",
+                "cloudscraper-agent-id=1; Path=/",
+                "cloudscraper-agent-id=2; Path=/",
+            ],
+        )
+        self.assertEqual(self.client.get("/proxy/collapse").json["coalesced"], 2)
+
+    def test_proxy_request_not_collapsed(self):
+        self.release.set()
+
+        self.client.get("/proxy?agent_id=1&dst=http://example.com/catalog")
+        self.client.get(
+            "/proxy?agent_id=1&dst=http://example.com/catalog",
+            headers={"X-Custom-Header": "value"},
+        )
+        self.client.post("/proxy?agent_id=1&dst=http://example.com/catalog")
+
+        self.assertEqual(self.mock_agent.request.call_count, 3)
+
+
+class TestProxyControllerHostLimit(TestCase):
+    def create_app(self):
+        app, _ = create_app()
+        app.config["TESTING"] = True
+
+        self.release = Event()
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.headers = {"Content-Type": "text/plain"}
+        mock_response.content = b"response content"
+
+        def request(*args, **kwargs):
+            self.release.wait(5)
+            return mock_response
+
+        self.mock_agent_pool = MagicMock()
+        self.mock_agent_pool.__contains__.side_effect = lambda key: key in {1, 2}
+        self.mock_agent = MagicMock(
+            request=MagicMock(side_effect=request), cookies=[], headers={}
+        )
+        self.mock_agent_pool.use.return_value.__enter__.return_value = self.mock_agent
+        self.host_limiter = HostLimiter(
+            [{"pattern": "*.example.com", "max_concurrency": 1}], max_wait=0.05
+        )
+
+        app.register_blueprint(
+            construct_proxy_blueprint(
+                self.mock_agent_pool, host_limiter=self.host_limiter
+            )
+        )
+        return app
+
+    def test_proxy_request_host_limited(self):
+        responses = []
+
+        def call():
+            with self.app.test_client() as client:
+                responses.append(
+                    client.get("/proxy?agent_id=1&dst=http://www.example.com/page")
+                )
+
+        thread = Thread(target=call)
+        thread.start()
+        while self.mock_agent.request.call_count < 1:
+            sleep(0.001)
+
+        stats = self.client.get("/proxy/limit").json
+        self.assertEqual(stats["active"], 1)
+        self.assertEqual(stats["hosts"][0]["host"], "www.example.com")
+        self.assertEqual(stats["hosts"][0]["pattern"], "*.example.com")
+
+        # Other hosts aren't limited
+        self.release.set()
+        response = self.client.get("/proxy?agent_id=2&dst=http://example.org/page")
+        self.assertEqual(response.status_code, 200)
+        thread.join()
+        self.assertEqual(responses[0].status_code, 200)
+
+    def test_proxy_request_host_limit_timeout(self):
+        with self.host_limiter.acquire("www.example.com"):
+            response = self.client.get("/proxy?agent_id=1&dst=http://www.example.com/")
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(
+            response.json["message"], "Too many requests to www.example.com are queued."
+        )
+        self.mock_agent.request.assert_not_called()
+        self.assertEqual(self.client.get("/proxy/limit").json["hosts"][0]["timeouts"], 1)
+
+
+class TestProxyControllerChallenge(TestCase):
+    def create_app(self):
+        app, _ = create_app()
+        app.config["TESTING"] = True
+
+        self.release = Event()
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.headers = {"Content-Type": "text/plain"}
+        mock_response.content = b"response content"
+        self.mock_response = mock_response
+        self.agents = {
+            agent_id: MagicMock(
+                request=MagicMock(return_value=mock_response),
+                cookies=RequestsCookieJar(),
+                headers={"User-Agent": f"agent {agent_id}"},
+                proxies={},
+            )
+            for agent_id in [1, 2]
+        }
+        self.mock_agent_pool = MagicMock()
+        self.mock_agent_pool.__contains__.return_value = False
+        self.mock_agent_pool.route.return_value = None
+        self.mock_agent_pool.generate.side_effect = [(1, None), (2, None)]
+        self.mock_agent_pool.use.side_effect = lambda agent_id, url: nullcontext(
+            self.agents[agent_id]
+        )
+
+        app.register_blueprint(
+            construct_proxy_blueprint(
+                self.mock_agent_pool,
+                upstream_config=UpstreamConfigSchema().load({"retries": 0}),
+            )
+        )
+        return app
+
+    def concurrent_requests(self) -> list:
+        """Make a request with the first new agent and another one while it's in flight."""
+
+        responses = {}
+
+        def call(agent_id):
+            with self.app.test_client() as client:
+                responses[agent_id] = client.get("/proxy?dst=http://example.com/")
+
+        first = Thread(target=call, args=(1,))
+        first.start()
+        while self.agents[1].request.call_count < 1:
+            sleep(0.001)
+        second = Thread(target=call, args=(2,))
+        second.start()
+        # Let the second request join the flight
+        sleep(0.05)
+        self.release.set()
+        first.join()
+        second.join()
+
+        return [responses[1], responses[2]]
+
+    def test_proxy_request_challenge_shared(self):
+        def solve(*args, **kwargs):
+            self.release.wait(5)
+            self.agents[1].cookies.set("cf_clearance", "token", domain=".example.com")
+            return self.mock_response
+
+        self.agents[1].request.side_effect = solve
+
+        responses = self.concurrent_requests()
+
+        self.assertEqual([response.status_code for response in responses], [200, 200])
+        self.assertEqual(self.agents[2].cookies.get("cf_clearance"), "token")
+        self.assertEqual(self.agents[2].headers["User-Agent"], "agent 1")
+        self.agents[2].request.assert_called_once()
+
+    def test_proxy_request_no_challenge(self):
+        def request(*args, **kwargs):
+            self.release.wait(5)
+            return self.mock_response
+
+        self.agents[1].request.side_effect = request
+
+        responses = self.concurrent_requests()
+
+        self.assertEqual([response.status_code for response in responses], [200, 200])
+        self.assertIsNone(self.agents[2].cookies.get("cf_clearance"))
+        self.assertEqual(self.agents[2].headers["User-Agent"], "agent 2")
+        self.agents[2].request.assert_called_once()
+
+    def test_proxy_request_leader_failed(self):
+        def fail(*args, **kwargs):
+            self.release.wait(5)
+            raise RequestsConnectionError("Connection reset.")
+
+        self.agents[1].request.side_effect = fail
+
+        responses = self.concurrent_requests()
+
+        # The waiting agent made its own request instead of failing
+        self.assertEqual([response.status_code for response in responses], [502, 200])
+        self.agents[2].request.assert_called_once()
+
+
+class TestProxyControllerRetry(TestCase):
+    def create_app(self):
+        app, _ = create_app()
+        app.config["TESTING"] = True
+
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.headers = {"Content-Type": "text/plain"}
+        mock_response.content = b"response content"
+        self.mock_response = mock_response
+        self.mock_agent_pool = MagicMock()
+        self.mock_agent_pool.__contains__.side_effect = lambda key: key == 1
+        self.mock_agent = MagicMock(
+            request=MagicMock(return_value=mock_response), cookies=[], headers={}
+        )
+        self.mock_agent_pool.use.return_value.__enter__.return_value = self.mock_agent
+        self.circuit_breaker = CircuitBreaker(failures=2, open_seconds=60)
+
+        app.register_blueprint(
+            construct_proxy_blueprint(
+                self.mock_agent_pool,
+                upstream_config=UpstreamConfigSchema().load(
+                    {"retries": 2, "backoff": 0, "deadline": 0}
+                ),
+                circuit_breaker=self.circuit_breaker,
+            )
+        )
+        return app
+
+    def test_proxy_request_retried(self):
+        self.mock_agent.request.side_effect = [
+            RequestsConnectionError("Connection reset."),
+            self.mock_response,
+        ]
+
+        response = self.client.get("/proxy?agent_id=1&dst=http://example.com")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, b"response content")
+        self.assertEqual(self.mock_agent.request.call_count, 2)
+        self.assertEqual(self.circuit_breaker.state("example.com"), "closed")
+
+    def test_proxy_request_not_idempotent(self):
+        self.mock_agent.request.side_effect = RequestsConnectionError("Connection reset.")
+
+        response = self.client.post("/proxy?agent_id=1&dst=http://example.com")
+
+        self.assertEqual(response.status_code, 502)
+        self.assertEqual(response.json["message"], "Connection reset.")
+        self.mock_agent.request.assert_called_once()
+
+    def test_proxy_request_connect_timeout(self):
+        self.mock_agent.request.side_effect = ConnectTimeout("Connect timed out.")
+
+        # Requests that never connected are retried whatever the method
+        response = self.client.post("/proxy?agent_id=1&dst=http://example.com")
+
+        self.assertEqual(response.status_code, 504)
+        self.assertEqual(self.mock_agent.request.call_count, 2)
+
+    def test_proxy_request_circuit_open(self):
+        self.mock_response.status_code = 502
+
+        response = self.client.get("/proxy?agent_id=1&dst=http://example.com")
+
+        # The failed answer is passed through once the circuit opens
+        self.assertEqual(response.status_code, 502)
+        self.assertEqual(self.mock_agent.request.call_count, 2)
+        response = self.client.get("/proxy?agent_id=1&dst=http://example.com")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["Retry-After"], "60")
+        self.assertEqual(self.mock_agent.request.call_count, 2)
+        stats = self.client.get("/proxy/breaker").json
+        self.assertEqual(stats["open"], 1)
+        self.assertEqual(stats["hosts"][0]["host"], "example.com")
+        self.assertEqual(stats["hosts"][0]["rejected"], 1)
+
+    def test_proxy_request_timeout_header(self):
+        response = self.client.get(
+            "/proxy?agent_id=1&dst=http://example.com",
+            headers={"X-Cloudscraper-Proxy-Timeout": "5"},
+        )
+
+        self.assertEqual(response.status_code, 200)
+        _, kwargs = self.mock_agent.request.call_args
+        self.assertLessEqual(kwargs["timeout"][1], 5)
+        self.assertNotIn("X-Cloudscraper-Proxy-Timeout", kwargs["headers"])
+        response = self.client.get(
+            "/proxy?agent_id=1&dst=http://example.com",
+            headers={"X-Cloudscraper-Proxy-Timeout": "soon"},
+        )
+        self.assertEqual(response.status_code, 422)
+
+
 if __name__ == "__main__":
     unittest.main()
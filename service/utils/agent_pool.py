@@ -1,19 +1,193 @@
 """Agent pool for proxy service."""
 
 import sys
+from collections import OrderedDict, deque
+from collections.abc import Iterator
+from contextlib import contextmanager
+from http.cookiejar import Cookie
+from threading import Event, RLock, Thread
+from time import monotonic, time
+from urllib.parse import urlparse
 
 import cloudscraper
+from requests.cookies import RequestsCookieJar
+from requests.structures import CaseInsensitiveDict
+from utils.agent_reserve import AgentReserve
+from utils.egress import EgressPool, pin_egress
 
+# Rough footprint of a bare scraper: session, adapters, SSL context and headers
+AGENT_BASE_SIZE = 64 * 1024
 
-class AgentPool(dict):
-    def __init__(self, *args, **kwargs):
+
+def estimate_size(agent: cloudscraper.CloudScraper) -> int:
+    """Estimate the memory footprint of an agent in bytes.
+
+    Args:
+        agent (cloudscraper.CloudScraper): The agent.
+
+    Returns:
+        int: The approximate size of the agent.
+    """
+
+    size = AGENT_BASE_SIZE
+    try:
+        for cookie in agent.cookies:
+            size += len(cookie.name) + len(cookie.value or "") + len(cookie.domain)
+        for name, value in agent.headers.items():
+            size += len(name) + len(value)
+    except (AttributeError, TypeError):
+        pass
+
+    return size
+
+
+def clearance_domains(agent: cloudscraper.CloudScraper) -> dict[str, float]:
+    """Get the domains the agent holds a cf_clearance cookie for.
+
+    Args:
+        agent (cloudscraper.CloudScraper): The agent.
+
+    Returns:
+        dict[str, float]: Cookie domains without the leading dot mapped to the cookie expiry
+            timestamp. Session cookies never expire.
+    """
+
+    domains = {}
+    for cookie in agent.cookies:
+        if cookie.name == "cf_clearance" and cookie.value:
+            expires = float("inf") if cookie.expires is None else cookie.expires
+            domains[cookie.domain.lstrip(".")] = expires
+
+    return domains
+
+
+def parent_domains(host: str) -> list[str]:
+    """Get the host and its parent domains a cookie may be set for.
+
+    Example:
+        "www.example.com" -> ["www.example.com", "example.com"]
+    """
+
+    labels = host.split(".")
+    return [".".join(labels[i:]) for i in range(len(labels) - 1)] or [host]
+
+
+class LeaseTimeout(Exception):
+    """The agent wasn't free within the lease timeout."""
+
+
+class AgentNotFound(Exception):
+    """The agent isn't in the pool, e.g. it was deleted or evicted."""
+
+
+class AgentState:
+    """Portable state of an agent, built into a scraper on the first use."""
+
+    def __init__(
+        self,
+        kwargs: dict,
+        headers: dict,
+        cookies: RequestsCookieJar,
+        egress: str | None = None,
+    ):
+        self.kwargs = kwargs
+        self.headers = CaseInsensitiveDict(headers)
+        self.cookies = cookies
+        self.egress = egress
+
+    def build(self) -> cloudscraper.CloudScraper:
+        """Build the scraper from the state."""
+
+        agent = cloudscraper.create_scraper(**self.kwargs)
+        agent.headers.clear()
+        agent.headers.update(self.headers)
+        agent.cookies.update(self.cookies)
+        if self.egress is not None:
+            pin_egress(agent, self.egress)
+
+        return agent
+
+
+class AgentInfo:
+    """Bookkeeping data of a pooled agent."""
+
+    def __init__(self, kwargs: dict, size: int, egress: str | None = None):
+        self.kwargs = kwargs
+        self.size = size
+        # Url of the outbound proxy the agent is pinned to
+        self.egress = egress
+        self.created = time()
+        self.last_used = self.created
+        self.in_flight = 0
+        self.domains = {}
+        self.origins = {}
+        # Events of the requests waiting for the agent, in the arrival order
+        self.waiters = deque()
+        self.leases = 0
+        self.contended = 0
+        self.wait_seconds = 0.0
+        self.timeouts = 0
+
+
+class AgentPool(OrderedDict):
+    def __init__(
+        self,
+        *args,
+        max_agents: int = 0,
+        idle_ttl: float = 0,
+        max_memory: int = 0,
+        reserve: AgentReserve | None = None,
+        shard: int = 0,
+        shards: int = 1,
+        max_parallel: int = 1,
+        lease_timeout: float = 30,
+        egress: EgressPool | None = None,
+        **kwargs,
+    ):
         """Initialize the agent pool.
 
+        Agents are kept in the least recently used order, so the eviction is O(1).
+
         Args:
-            **kwargs: Keyword arguments for cloudscraper. See cloudscraper documentation for more details.
+            max_agents (int, optional): Maximum number of agents. 0 means unlimited.
+            idle_ttl (float, optional): Seconds an agent may stay unused before it expires.
+                0 means agents never expire.
+            max_memory (int, optional): Approximate memory budget of the pool in bytes.
+                0 means unlimited.
+            reserve (AgentReserve | None, optional): Reserve of pre-built agents to take
+                the generated agents from.
+            shard (int, optional): Shard of this pool. Generated agent ids satisfy
+                agent_id % shards == shard, so the owning worker is known from the id.
+            shards (int, optional): Number of shards, i.e. pools across the workers.
+            max_parallel (int, optional): Maximum number of requests using an agent at
+                once, the others wait for it in the arrival order. 1 gives out agents
+                exclusively, 0 means unlimited.
+            lease_timeout (float, optional): Seconds a request waits for a busy agent.
+            egress (EgressPool | None, optional): Outbound proxies the generated agents
+                are pinned to.
         """
 
-        dict.__init__(self, *args, **kwargs)
+        self._lock = RLock()
+        self._info = {}
+        self._domains = {}
+        self._memory = 0
+        self._expiry_stop = None
+        self.max_agents = max_agents
+        self.idle_ttl = idle_ttl
+        self.max_memory = max_memory
+        self.reserve = reserve
+        self.shard = shard
+        self.shards = shards
+        self.max_parallel = max_parallel
+        self.lease_timeout = lease_timeout
+        self.egress = egress
+        self.leases = {"acquired": 0, "contended": 0, "timeouts": 0, "wait_seconds": 0.0}
+        self._waiting = 0
+        # Clearance refresher tracking the cookie expiry, set by the refresher itself
+        self.refresher = None
+        self.evictions = {"capacity": 0, "memory": 0, "ttl": 0}
+        self.created = 0
+        OrderedDict.__init__(self, *args, **kwargs)
         self.agent_id = 0
 
     def generate(self, **kwargs) -> tuple[int, cloudscraper.CloudScraper]:
@@ -27,16 +201,430 @@ class AgentPool(dict):
             tuple(int, cloudscraper.CloudScraper): The agent id and the agent.
         """
 
-        if self.agent_id == sys.maxsize:
-            self.agent_id = 1
-        else:
-            self.agent_id += 1
-        self[self.agent_id] = cloudscraper.create_scraper(**kwargs)
+        agent = None
+        if self.reserve is not None:
+            agent = self.reserve.take(kwargs)
+        if agent is None:
+            agent = cloudscraper.create_scraper(**kwargs)
+        egress = self.egress.assign() if self.egress is not None else None
+        if egress is not None:
+            egress.pin(agent)
+        with self._lock:
+            agent_id = self.agent_id + 1
+            agent_id += (self.shard - agent_id) % self.shards
+            if agent_id > sys.maxsize:
+                agent_id = self.shard or self.shards
+            self.agent_id = agent_id
+            self.created += 1
+            self._insert(agent_id, agent, kwargs, egress.url if egress else None)
 
-        return self.agent_id, self[self.agent_id]
+        return agent_id, agent
+
+    def __setitem__(self, agent_id: int, agent: cloudscraper.CloudScraper) -> None:
+        with self._lock:
+            self._insert(agent_id, agent, {})
+
+    def __getitem__(self, agent_id: int) -> cloudscraper.CloudScraper:
+        """Get the agent and mark it as the most recently used."""
+
+        with self._lock:
+            agent = self._build(agent_id)
+            self.move_to_end(agent_id)
+            self._info[agent_id].last_used = time()
+
+        return agent
+
+    def __delitem__(self, agent_id: int) -> None:
+        with self._lock:
+            super().__delitem__(agent_id)
+            self._discard(agent_id)
+
+    def pop(self, agent_id: int, *args) -> cloudscraper.CloudScraper:
+        with self._lock:
+            agent = super().pop(agent_id, *args)
+            self._discard(agent_id)
+
+        return agent
+
+    def popitem(self, last: bool = True) -> tuple[int, cloudscraper.CloudScraper]:
+        with self._lock:
+            agent_id, agent = super().popitem(last)
+            self._discard(agent_id)
+
+        return agent_id, agent
+
+    def keys(self) -> list[int]:
+        with self._lock:
+            return list(super().keys())
+
+    def values(self) -> list[cloudscraper.CloudScraper]:
+        with self._lock:
+            return list(super().values())
+
+    def items(self) -> list[tuple[int, cloudscraper.CloudScraper]]:
+        with self._lock:
+            return list(super().items())
+
+    def restore(
+        self, agent_id: int, state: AgentState, created: float, last_used: float
+    ) -> None:
+        """Restore the agent from its portable state. The scraper is built lazily.
+
+        Args:
+            agent_id (int): The agent id.
+            state (AgentState): The agent state.
+            created (float): The agent creation timestamp.
+            last_used (float): The agent last use timestamp.
+        """
+
+        if self.egress is not None:
+            self.egress.pin(state.egress)
+        with self._lock:
+            self._insert(agent_id, state, state.kwargs, state.egress)
+            info = self._info.get(agent_id)
+            if info is not None:
+                info.created = created
+                info.last_used = last_used
+        self.index(agent_id)
+
+    def info(self, agent_id: int) -> AgentInfo | None:
+        """Get the bookkeeping data of the agent."""
+
+        return self._info.get(agent_id)
+
+    def cookies(self, agent_id: int) -> list[Cookie] | None:
+        """Get a copy of the agent cookies without leasing, building or touching it.
+
+        Args:
+            agent_id (int): The agent id.
+
+        Returns:
+            list[Cookie] | None: The agent cookies, None if there is no such agent.
+        """
+
+        with self._lock:
+            agent = super().get(agent_id)
+            if agent is None:
+                return None
+            return list(agent.cookies)
+
+    @contextmanager
+    def use(
+        self,
+        agent_id: int,
+        url: str | None = None,
+        touch: bool = True,
+        timeout: float | None = None,
+    ) -> Iterator[cloudscraper.CloudScraper]:
+        """Lease the agent for a request.
+
+        At most max_parallel requests use the agent at once, so they don't race on its
+        session and cookie jar. The others wait for it in the arrival order. The agent
+        is marked busy while in use, so it isn't routed to other requests, and its
+        cf_clearance domains are indexed afterwards.
+
+        Args:
+            agent_id (int): The agent id.
+            url (str | None, optional): The requested url.
+            touch (bool, optional): Mark the agent as the most recently used.
+                Background maintenance doesn't count as use.
+            timeout (float | None, optional): Seconds to wait for the agent, defaults
+                to lease_timeout.
+
+        Raises:
+            AgentNotFound: The agent isn't in the pool.
+            LeaseTimeout: The agent wasn't free in time.
+
+        Yields:
+            cloudscraper.CloudScraper: The agent.
+        """
+
+        with self._lock:
+            if agent_id not in self:
+                raise AgentNotFound(f"Agent {agent_id} not found.")
+            agent = self[agent_id] if touch else self._build(agent_id)
+            info = self._info[agent_id]
+            info.leases += 1
+            self.leases["acquired"] += 1
+            waiter = None
+            busy = self.max_parallel and info.in_flight >= self.max_parallel
+            # Queued requests go first, so nobody jumps the queue on a release
+            if busy or info.waiters:
+                waiter = Event()
+                info.waiters.append(waiter)
+                info.contended += 1
+                self.leases["contended"] += 1
+                self._waiting += 1
+            else:
+                info.in_flight += 1
+        if waiter is not None:
+            self._wait(agent_id, info, waiter, timeout)
+        try:
+            yield agent
+        finally:
+            try:
+                self.index(agent_id, url)
+            finally:
+                self._release(info)
+
+    def contention(self, limit: int = 10) -> list[dict]:
+        """Get the agents requests waited for the longest in total.
+
+        Args:
+            limit (int, optional): Maximum number of agents.
+
+        Returns:
+            list[dict]: The lease statistics of the agents, most contended first.
+        """
+
+        with self._lock:
+            contended = sorted(
+                (
+                    (agent_id, info)
+                    for agent_id, info in self._info.items()
+                    if info.contended
+                ),
+                key=lambda item: item[1].wait_seconds,
+                reverse=True,
+            )[:limit]
+
+            return [
+                {
+                    "id": agent_id,
+                    "in_flight": info.in_flight,
+                    "waiting": len(info.waiters),
+                    "leases": info.leases,
+                    "contended": info.contended,
+                    "timeouts": info.timeouts,
+                    "wait_seconds": info.wait_seconds,
+                }
+                for agent_id, info in contended
+            ]
+
+    def index(self, agent_id: int, url: str | None = None) -> None:
+        """Index the domains the agent holds a cf_clearance cookie for.
+
+        Args:
+            agent_id (int): The agent id.
+            url (str | None, optional): The requested url. Its origin is remembered
+                for the matching clearance domains.
+        """
+
+        changed = []
+        with self._lock:
+            if not super().__contains__(agent_id):
+                return
+            info = self._info[agent_id]
+            domains = clearance_domains(super().__getitem__(agent_id))
+            for domain in info.domains.keys() - domains.keys():
+                self._unindex(agent_id, domain)
+            for domain, expires in domains.items():
+                self._domains.setdefault(domain, {})[agent_id] = expires
+                if info.domains.get(domain) != expires:
+                    changed.append((domain, expires))
+            info.domains = domains
+            if url is not None:
+                parsed = urlparse(url)
+                for domain in parent_domains(parsed.hostname or ""):
+                    if domain in domains:
+                        info.origins[domain] = f"{parsed.scheme}://{parsed.netloc}/"
+
+        if self.refresher is not None:
+            for domain, expires in changed:
+                self.refresher.track(agent_id, domain, expires)
+
+    def route(self, host: str) -> int | None:
+        """Find an idle agent holding a valid cf_clearance for the host.
+
+        Args:
+            host (str): The destination host.
+
+        Returns:
+            int | None: The agent id or None if there is no suitable agent.
+        """
+
+        now = time()
+        with self._lock:
+            for domain in parent_domains(host):
+                agents = self._domains.get(domain)
+                if not agents:
+                    continue
+                for agent_id, expires in list(agents.items()):
+                    if expires <= now:
+                        self._unindex(agent_id, domain)
+                    elif self._info[agent_id].in_flight == 0:
+                        return agent_id
+
+        return None
+
+    def expire(self) -> int:
+        """Evict the agents idle for longer than idle_ttl.
+
+        Returns:
+            int: The number of expired agents.
+        """
+
+        if not self.idle_ttl:
+            return 0
+
+        expired = 0
+        deadline = time() - self.idle_ttl
+        with self._lock:
+            while len(self):
+                agent_id = self._oldest()
+                if self._info[agent_id].last_used > deadline:
+                    break
+                self.popitem(last=False)
+                expired += 1
+            self.evictions["ttl"] += expired
+
+        return expired
+
+    def start_expiry(self, interval: float) -> None:
+        """Start expiring idle agents in the background.
+
+        Args:
+            interval (float): Seconds between the expiry runs.
+        """
+
+        if not self.idle_ttl or self._expiry_stop is not None:
+            return
+
+        self._expiry_stop = Event()
+
+        def run(stop: Event):
+            while not stop.wait(interval):
+                self.expire()
+
+        Thread(target=run, args=(self._expiry_stop,), daemon=True).start()
+
+    def stop_expiry(self) -> None:
+        """Stop the background expiry."""
+
+        if self._expiry_stop is not None:
+            self._expiry_stop.set()
+            self._expiry_stop = None
+
+    def stats(self) -> dict:
+        """Get the pool statistics."""
+
+        with self._lock:
+            stats = {
+                "size": len(self),
+                "memory": self._memory,
+                "created": self.created,
+                "evictions": dict(self.evictions),
+                "leases": dict(self.leases, waiting=self._waiting),
+            }
+        if self.reserve is not None:
+            stats["reserve"] = self.reserve.stats()
+        if self.refresher is not None:
+            stats["refresh"] = self.refresher.stats()
+        if self.egress is not None:
+            stats["egress"] = self.egress.stats()
+
+        return stats
 
     def clear(self) -> None:
         """Clear the agent pool."""
 
-        self.agent_id = 0
-        return super().clear()
+        with self._lock:
+            self.agent_id = 0
+            self._info.clear()
+            self._domains.clear()
+            self._memory = 0
+            return super().clear()
+
+    def _insert(
+        self,
+        agent_id: int,
+        agent: cloudscraper.CloudScraper,
+        kwargs: dict,
+        egress: str | None = None,
+    ):
+        if super().__contains__(agent_id):
+            self._discard(agent_id)
+        super().__setitem__(agent_id, agent)
+        self.move_to_end(agent_id)
+        info = AgentInfo(kwargs, estimate_size(agent), egress)
+        self._info[agent_id] = info
+        self._memory += info.size
+        self._evict(keep=agent_id)
+
+    def _build(self, agent_id: int) -> cloudscraper.CloudScraper:
+        """Get the agent, building the scraper of a restored agent."""
+
+        agent = super().__getitem__(agent_id)
+        if isinstance(agent, AgentState):
+            agent = agent.build()
+            super().__setitem__(agent_id, agent)
+
+        return agent
+
+    def _wait(self, agent_id: int, info: AgentInfo, waiter: Event, timeout: float | None):
+        """Wait for the agent to be handed over by the previous holder."""
+
+        start = monotonic()
+        granted = waiter.wait(self.lease_timeout if timeout is None else timeout)
+        waited = monotonic() - start
+        with self._lock:
+            self._waiting -= 1
+            info.wait_seconds += waited
+            self.leases["wait_seconds"] += waited
+            # The agent may be handed over right after the wait timed out
+            if not granted and waiter in info.waiters:
+                info.waiters.remove(waiter)
+                info.timeouts += 1
+                self.leases["timeouts"] += 1
+                raise LeaseTimeout(f"Agent {agent_id} is busy.")
+
+    def _release(self, info: AgentInfo) -> None:
+        """Hand the agent over to the next waiting request."""
+
+        with self._lock:
+            if info.waiters:
+                info.waiters.popleft().set()
+            else:
+                info.in_flight -= 1
+
+    def _oldest(self) -> int:
+        return next(iter(super().keys()))
+
+    def _discard(self, agent_id: int) -> None:
+        info = self._info.pop(agent_id, None)
+        if info is not None:
+            # Requests waiting for a removed agent still get it, like the ones using it
+            while info.waiters:
+                info.in_flight += 1
+                info.waiters.popleft().set()
+            self._memory -= info.size
+            if self.egress is not None:
+                self.egress.release(info.egress)
+            for domain in list(info.domains):
+                self._unindex(agent_id, domain, info)
+
+    def _unindex(self, agent_id: int, domain: str, info: AgentInfo = None) -> None:
+        agents = self._domains.get(domain)
+        if agents is not None:
+            agents.pop(agent_id, None)
+            if not agents:
+                del self._domains[domain]
+        info = info or self._info.get(agent_id)
+        if info is not None:
+            info.domains.pop(domain, None)
+            info.origins.pop(domain, None)
+
+    def _evict(self, keep: int) -> None:
+        """Evict the least recently used agents until the pool fits its limits."""
+
+        while len(self) > 1:
+            if self.max_agents and len(self) > self.max_agents:
+                reason = "capacity"
+            elif self.max_memory and self._memory > self.max_memory:
+                reason = "memory"
+            else:
+                break
+            if self._oldest() == keep:
+                break
+            self.popitem(last=False)
+            self.evictions[reason] += 1
@@ -0,0 +1,144 @@
+"""Reserve of pre-built agents filled in the background."""
+
+import json
+from collections import deque
+from threading import Event, Lock, Thread
+from time import perf_counter, sleep
+
+import cloudscraper
+from structlog import get_logger
+
+
+class AgentReserve:
+    def __init__(
+        self, configs: list[dict], low_watermark: int = 2, high_watermark: int = 8
+    ):
+        """Initialize the agent reserve.
+
+        Args:
+            configs (list[dict]): Keyword arguments for cloudscraper to keep ready agents for.
+            low_watermark (int, optional): Refill a reserve once it has fewer agents than this.
+            high_watermark (int, optional): The number of agents a reserve is refilled to.
+        """
+
+        self.log = get_logger(__name__)
+        self.low_watermark = low_watermark
+        self.high_watermark = max(high_watermark, low_watermark)
+        self._lock = Lock()
+        self._configs = {self.key(config): config for config in configs}
+        self._agents = {key: deque() for key in self._configs}
+        self._wakeup = Event()
+        self._stop = None
+        self.hits = 0
+        self.misses = 0
+        self.refills = 0
+        self.refill_seconds = 0.0
+
+    @staticmethod
+    def key(config: dict) -> str:
+        """Build the reserve key from the agent configuration."""
+
+        return json.dumps(config, sort_keys=True)
+
+    def take(self, config: dict) -> cloudscraper.CloudScraper | None:
+        """Take a ready agent built with the configuration.
+
+        Args:
+            config (dict): Keyword arguments for cloudscraper.
+
+        Returns:
+            cloudscraper.CloudScraper | None: The agent or None if the reserve is empty.
+        """
+
+        key = self.key(config)
+        with self._lock:
+            agents = self._agents.get(key)
+            if not agents:
+                self.misses += 1
+                agent = None
+            else:
+                self.hits += 1
+                agent = agents.popleft()
+            low = agents is not None and len(agents) < self.low_watermark
+        if low:
+            self._wakeup.set()
+
+        return agent
+
+    def refill(self, stop: Event | None = None) -> int:
+        """Refill the reserves below the low watermark up to the high watermark.
+
+        Args:
+            stop (Event | None, optional): Interrupts the refill once set.
+
+        Returns:
+            int: The number of built agents.
+        """
+
+        built = 0
+        for key, config in self._configs.items():
+            agents = self._agents[key]
+            if len(agents) >= self.low_watermark:
+                continue
+            while len(agents) < self.high_watermark:
+                if stop is not None and stop.is_set():
+                    return built
+                start = perf_counter()
+                try:
+                    agent = cloudscraper.create_scraper(**config)
+                except Exception as err:
+                    self.log.error("Couldn't build a reserve agent.", error=err)
+                    break
+                agents.append(agent)
+                with self._lock:
+                    self.refills += 1
+                    self.refill_seconds += perf_counter() - start
+                built += 1
+                # Let the request handlers run between the builds
+                sleep(0)
+
+        return built
+
+    def start(self, interval: float = 5) -> None:
+        """Start refilling the reserves in the background.
+
+        Args:
+            interval (float, optional): Maximum seconds between the refill checks.
+        """
+
+        if self._stop is not None or not self.high_watermark:
+            return
+
+        self._stop = Event()
+
+        def run(stop: Event):
+            while not stop.is_set():
+                self.refill(stop)
+                self._wakeup.wait(interval)
+                self._wakeup.clear()
+
+        Thread(target=run, args=(self._stop,), daemon=True).start()
+
+    def stop(self) -> None:
+        """Stop the background refill."""
+
+        if self._stop is not None:
+            self._stop.set()
+            self._wakeup.set()
+            self._stop = None
+
+    def stats(self) -> dict:
+        """Get the reserve statistics."""
+
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "size": sum(len(agents) for agents in self._agents.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else 0.0,
+                "refills": self.refills,
+                "refill_seconds_avg": (
+                    self.refill_seconds / self.refills if self.refills else 0.0
+                ),
+            }
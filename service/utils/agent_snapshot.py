@@ -0,0 +1,190 @@
+"""Snapshots of the agent pool for warm restarts."""
+
+import gzip
+import json
+import os
+from threading import Event, Thread
+from time import time
+
+from requests.cookies import RequestsCookieJar, create_cookie
+from structlog import get_logger
+from utils.agent_pool import AgentPool, AgentState
+
+SNAPSHOT_VERSION = 3
+# Older versions still loaded, version 1 lacks the egress proxy of the agents and
+# versions 1 and 2 the host-only and HttpOnly attributes of the cookies
+COMPATIBLE_VERSIONS = {1, 2}
+
+
+def dump_snapshot(agent_pool: AgentPool, path: str) -> int:
+    """Save the portable state of the pooled agents.
+
+    The snapshot is written to a temporary file first and then atomically moved into place.
+
+    Args:
+        agent_pool (AgentPool): The agent pool.
+        path (str): The snapshot file path.
+
+    Returns:
+        int: The number of saved agents.
+    """
+
+    agents = []
+    for agent_id, agent in agent_pool.items():
+        info = agent_pool.info(agent_id)
+        if info is None:
+            continue
+        agents.append(
+            [
+                agent_id,
+                info.kwargs,
+                dict(agent.headers),
+                [
+                    [
+                        c.name,
+                        c.value,
+                        c.domain,
+                        c.path,
+                        c.expires,
+                        c.secure,
+                        c.domain_specified,
+                        c.domain_initial_dot,
+                        c._rest,
+                    ]
+                    for c in agent.cookies
+                ],
+                info.created,
+                info.last_used,
+                info.egress,
+            ]
+        )
+    data = {
+        "version": SNAPSHOT_VERSION,
+        "agent_id": agent_pool.agent_id,
+        "agents": agents,
+    }
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with gzip.open(tmp_path, "wt", encoding="utf8", compresslevel=1) as file:
+        json.dump(data, file, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+    return len(agents)
+
+
+def load_snapshot(agent_pool: AgentPool, path: str) -> int:
+    """Restore the agents from the snapshot. Scrapers are rebuilt lazily on the first use.
+
+    Args:
+        agent_pool (AgentPool): The agent pool.
+        path (str): The snapshot file path.
+
+    Raises:
+        ValueError: If the snapshot version isn't supported.
+
+    Returns:
+        int: The number of restored agents.
+    """
+
+    with gzip.open(path, "rt", encoding="utf8") as file:
+        data = json.load(file)
+    version = data.get("version")
+    if version != SNAPSHOT_VERSION and version not in COMPATIBLE_VERSIONS:
+        raise ValueError(f"Unsupported agent snapshot version: {version}.")
+
+    now = time()
+    for agent_id, kwargs, headers, cookies, created, last_used, *egress in data["agents"]:
+        jar = RequestsCookieJar()
+        for name, value, domain, path_, expires, secure, *attributes in cookies:
+            if expires is not None and expires <= now:
+                continue
+            cookie = create_cookie(
+                name, value, domain=domain, path=path_, expires=expires, secure=secure
+            )
+            if attributes:
+                # Host-only cookies aren't sent to the subdomains
+                cookie.domain_specified, cookie.domain_initial_dot, cookie._rest = (
+                    attributes
+                )
+            jar.set_cookie(cookie)
+        state = AgentState(kwargs, headers, jar, egress[0] if egress else None)
+        agent_pool.restore(agent_id, state, created, last_used)
+    agent_pool.agent_id = max(agent_pool.agent_id, data["agent_id"])
+
+    return len(data["agents"])
+
+
+class AgentSnapshotter:
+    def __init__(self, agent_pool: AgentPool, path: str):
+        """Initialize the agent pool snapshotter.
+
+        Args:
+            agent_pool (AgentPool): The agent pool.
+            path (str): The snapshot file path.
+        """
+
+        self.log = get_logger(__name__)
+        self.agent_pool = agent_pool
+        self.path = path
+        self._stop = None
+
+    def save(self) -> None:
+        """Save the snapshot, logging instead of raising on failure."""
+
+        try:
+            start = time()
+            saved = dump_snapshot(self.agent_pool, self.path)
+            self.log.info(
+                "Saved the agent snapshot.",
+                path=self.path,
+                agents=saved,
+                time_seconds=time() - start,
+            )
+        except Exception as err:
+            self.log.error("Couldn't save the agent snapshot.", path=self.path, error=err)
+
+    def restore(self) -> None:
+        """Restore the snapshot if it exists, logging instead of raising on failure."""
+
+        if not os.path.exists(self.path):
+            return
+
+        try:
+            start = time()
+            restored = load_snapshot(self.agent_pool, self.path)
+            self.log.info(
+                "Restored the agent snapshot.",
+                path=self.path,
+                agents=restored,
+                time_seconds=time() - start,
+            )
+        except Exception as err:
+            self.log.error(
+                "Couldn't restore the agent snapshot.", path=self.path, error=err
+            )
+
+    def start(self, interval: float) -> None:
+        """Start saving the snapshot periodically in the background.
+
+        Args:
+            interval (float): Seconds between the saves.
+        """
+
+        if self._stop is not None:
+            return
+
+        self._stop = Event()
+
+        def run(stop: Event):
+            while not stop.wait(interval):
+                self.save()
+
+        Thread(target=run, args=(self._stop,), daemon=True).start()
+
+    def stop(self) -> None:
+        """Stop the periodic saves."""
+
+        if self._stop is not None:
+            self._stop.set()
+            self._stop = None
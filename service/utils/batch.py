@@ -0,0 +1,49 @@
+"""Concurrent fan-out of batch items.
+
+Threading primitives are used, so the workers are greenlets once gevent has monkey
+patched the standard library.
+"""
+
+from collections.abc import Callable, Iterator
+from queue import Queue
+from threading import Event, Lock, Thread
+from typing import Any
+
+
+def iter_completed(
+    fn: Callable[[int, Any], Any], items: list, concurrency: int
+) -> Iterator[Any]:
+    """Run the function for every item concurrently, yielding the results as they complete.
+
+    The function must not raise, errors should be returned as results. Closing the
+    iterator stops the workers from picking up the remaining items.
+
+    Args:
+        fn (Callable[[int, Any], Any]): The function called with the item index and the item.
+        items (list): The items.
+        concurrency (int): Maximum number of items processed at once.
+
+    Yields:
+        Any: The function results in the completion order.
+    """
+
+    results = Queue()
+    stop = Event()
+    lock = Lock()
+    pending = iter(enumerate(items))
+
+    def worker():
+        while not stop.is_set():
+            with lock:
+                index, item = next(pending, (None, None))
+            if index is None:
+                return
+            results.put(fn(index, item))
+
+    for _ in range(min(concurrency, len(items))):
+        Thread(target=worker, daemon=True).start()
+    try:
+        for _ in range(len(items)):
+            yield results.get()
+    finally:
+        stop.set()
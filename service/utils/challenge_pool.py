@@ -0,0 +1,219 @@
+"""Process pool evaluating the JavaScript challenges outside of the request handlers.
+
+Pooled interpreters replace the cloudscraper ones in its registry, so agents keep their
+`interpreter` option. Challenges are sent to long-lived worker processes over pipes,
+which are cooperative once gevent has monkey patched the standard library, so a solve
+doesn't block the other requests.
+"""
+
+import json
+import os
+import subprocess
+import sys
+from threading import BoundedSemaphore, Lock, Timer
+from time import perf_counter
+
+from cloudscraper.interpreters import JavaScriptInterpreter
+from cloudscraper.interpreters.encapsulated import template
+from structlog import get_logger
+
+INTERPRETERS = ("native", "js2py", "nodejs")
+WORKER_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class ChallengeWorker:
+    """A long-lived worker process answering one JSON line request at a time."""
+
+    def __init__(self, command: list[str]):
+        self.process = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+
+    def call(self, request: dict, timeout: float) -> dict:
+        """Send the request and wait for the response.
+
+        Args:
+            request (dict): The request.
+            timeout (float): Seconds to wait before the worker is killed.
+
+        Raises:
+            RuntimeError: If the worker exited or was killed on the timeout.
+
+        Returns:
+            dict: The response.
+        """
+
+        timer = Timer(timeout, self.process.kill)
+        timer.start()
+        try:
+            self.process.stdin.write(json.dumps(request).encode() + b"\n")
+            self.process.stdin.flush()
+            line = self.process.stdout.readline()
+        finally:
+            timer.cancel()
+        if not line:
+            raise RuntimeError("The challenge worker exited.")
+
+        return json.loads(line)
+
+    def close(self) -> None:
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+
+
+class PooledInterpreter(JavaScriptInterpreter):
+    def __init__(self, name: str, pool: "ChallengePool"):
+        """Register the interpreter in the cloudscraper registry under the name."""
+
+        super().__init__(name)
+        self.name = name
+        self.pool = pool
+
+    def eval(self, body: str, domain: str) -> str:
+        return self.pool.evaluate(self.name, body, domain)
+
+
+class ChallengePool:
+    def __init__(self, size: int = 2, timeout: float = 10, node: str = "node"):
+        """Initialize the challenge pool.
+
+        Args:
+            size (int, optional): Maximum number of worker processes of each kind,
+                Python for the native and js2py interpreters and Node.js for nodejs.
+            timeout (float, optional): Seconds a challenge may take before its worker is killed.
+            node (str, optional): The Node.js executable.
+        """
+
+        self.log = get_logger(__name__)
+        self.size = size
+        self.timeout = timeout
+        self.node = node
+        self._lock = Lock()
+        self._slots = {"python": BoundedSemaphore(size), "nodejs": BoundedSemaphore(size)}
+        self._idle = {"python": [], "nodejs": []}
+        self.queued = 0
+        self.in_flight = 0
+        self.spawned = 0
+        self.solves = 0
+        self.failures = 0
+        self.solve_seconds = 0.0
+
+    def command(self, kind: str) -> list[str]:
+        """Get the command starting a worker process of the kind."""
+
+        if kind == "nodejs":
+            return [self.node, os.path.join(WORKER_DIR, "challenge_worker.js")]
+        return [sys.executable, os.path.join(WORKER_DIR, "challenge_worker.py")]
+
+    def install(self, interpreters: tuple[str, ...] = INTERPRETERS) -> None:
+        """Replace the cloudscraper interpreters with the pooled ones."""
+
+        for name in interpreters:
+            PooledInterpreter(name, self)
+
+    def evaluate(self, interpreter: str, body: str, domain: str) -> str:
+        """Evaluate the challenge in a worker process.
+
+        Args:
+            interpreter (str): The cloudscraper interpreter name.
+            body (str): The challenge page.
+            domain (str): The challenge domain.
+
+        Returns:
+            str: The challenge answer.
+        """
+
+        if interpreter == "nodejs":
+            return self.call("nodejs", {"js": template(body, domain)})
+        return self.call(
+            "python", {"interpreter": interpreter, "body": body, "domain": domain}
+        )
+
+    def call(self, kind: str, request: dict) -> str:
+        """Send the request to an idle worker of the kind, waiting for one if all are busy.
+
+        Args:
+            kind (str): The worker kind, python or nodejs.
+            request (dict): The worker request.
+
+        Raises:
+            RuntimeError: If the worker failed or couldn't evaluate the challenge.
+
+        Returns:
+            str: The challenge answer.
+        """
+
+        with self._lock:
+            self.queued += 1
+        self._slots[kind].acquire()
+        with self._lock:
+            self.queued -= 1
+            self.in_flight += 1
+            worker = self._idle[kind].pop() if self._idle[kind] else None
+
+        start = perf_counter()
+        response = None
+        try:
+            if worker is None:
+                worker = ChallengeWorker(self.command(kind))
+                with self._lock:
+                    self.spawned += 1
+            response = worker.call(request, self.timeout)
+        except Exception as err:
+            self.log.error("Challenge worker failed.", kind=kind, error=err)
+            response = {"error": str(err)}
+            if worker is not None:
+                worker.close()
+            worker = None
+        finally:
+            # A worker interrupted mid-request may still answer it, so it isn't reused
+            if worker is not None and response is None:
+                worker.close()
+                worker = None
+            with self._lock:
+                self.in_flight -= 1
+                if worker is not None:
+                    self._idle[kind].append(worker)
+            self._slots[kind].release()
+
+        with self._lock:
+            if "error" in response:
+                self.failures += 1
+            else:
+                self.solves += 1
+                self.solve_seconds += perf_counter() - start
+        if "error" in response:
+            raise RuntimeError(response["error"])
+
+        return response["answer"]
+
+    def close(self) -> None:
+        """Stop the idle worker processes."""
+
+        with self._lock:
+            workers = self._idle["python"] + self._idle["nodejs"]
+            self._idle = {"python": [], "nodejs": []}
+        for worker in workers:
+            worker.close()
+
+    def stats(self) -> dict:
+        """Get the challenge pool statistics."""
+
+        with self._lock:
+            return {
+                "workers": len(self._idle["python"])
+                + len(self._idle["nodejs"])
+                + self.in_flight,
+                "queued": self.queued,
+                "in_flight": self.in_flight,
+                "spawned": self.spawned,
+                "solves": self.solves,
+                "failures": self.failures,
+                "solve_seconds_avg": (
+                    self.solve_seconds / self.solves if self.solves else 0.0
+                ),
+            }
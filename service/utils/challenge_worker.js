@@ -0,0 +1,20 @@
+// Long-lived Node.js challenge worker.
+// Evaluates Cloudflare IUAM challenges the way the cloudscraper nodejs interpreter does.
+// Requests are read from stdin and responses are written to stdout, one JSON object per line.
+
+const readline = require("readline");
+const vm = require("vm");
+
+const atob = (str) => Buffer.from(str, "base64").toString("binary");
+const options = { filename: "iuam-challenge.js", timeout: 4000 };
+
+readline.createInterface({ input: process.stdin }).on("line", (line) => {
+    let response;
+    try {
+        const answer = vm.runInNewContext(JSON.parse(line).js, { atob: atob }, options);
+        response = { answer: String(answer) };
+    } catch (err) {
+        response = { error: String(err) };
+    }
+    process.stdout.write(JSON.stringify(response) + "\n");
+});
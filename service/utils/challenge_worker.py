@@ -0,0 +1,30 @@
+"""Long-lived challenge worker process.
+
+Evaluates Cloudflare IUAM challenges with the cloudscraper interpreters. Requests are
+read from stdin and responses are written to stdout, one JSON object per line.
+"""
+
+import json
+import sys
+
+from cloudscraper.interpreters import JavaScriptInterpreter
+
+
+def main():
+    for line in sys.stdin:
+        request = json.loads(line)
+        try:
+            answer = JavaScriptInterpreter.dynamicImport(request["interpreter"]).eval(
+                request["body"], request["domain"]
+            )
+            if isinstance(answer, bytes):
+                answer = answer.decode()
+            response = {"answer": str(answer)}
+        except Exception as err:
+            response = {"error": str(err) or err.__class__.__name__}
+        sys.stdout.write(json.dumps(response) + "\n")
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""Per-host circuit breaker failing the upstream requests fast while the host is down.
+
+Every gunicorn worker keeps its own circuits.
+"""
+
+from collections import Counter, OrderedDict
+from threading import Lock
+from time import monotonic
+
+from structlog import get_logger
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpen(Exception):
+    """The circuit of the host is open."""
+
+    def __init__(self, host: str, retry_after: float):
+        super().__init__(f"{host} is failing, the requests to it are paused.")
+        self.host = host
+        self.retry_after = retry_after
+
+
+class Circuit:
+    """State of the requests to a host."""
+
+    def __init__(self):
+        self.state = CLOSED
+        # Consecutive failures
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.rejected = 0
+
+
+class CircuitBreaker:
+    def __init__(
+        self, failures: int = 5, open_seconds: float = 30, max_hosts: int = 1000
+    ):
+        """Initialize the circuit breaker.
+
+        A host failing the given number of requests in a row gets its circuit opened,
+        its requests fail right away. After open_seconds one probe request is let
+        through half-open: the circuit closes if it succeeds and opens again if not.
+
+        Args:
+            failures (int, optional): Consecutive failures opening the circuit.
+            open_seconds (float, optional): Seconds the circuit stays open before the
+                probe.
+            max_hosts (int, optional): Failing hosts tracked, the least recently
+                failing closed ones are forgotten.
+        """
+
+        self.log = get_logger(__name__)
+        self.failures = failures
+        self.open_seconds = open_seconds
+        self.max_hosts = max_hosts
+        # Only the hosts with failures, the healthy ones have nothing to track
+        self._circuits = OrderedDict()
+        self.transitions = Counter({CLOSED: 0, OPEN: 0, HALF_OPEN: 0})
+        self.rejected = 0
+        self._lock = Lock()
+
+    def before(self, host: str) -> None:
+        """Check the circuit before a request to the host.
+
+        Every request let through must be followed by record().
+
+        Raises:
+            CircuitOpen: The circuit is open or its probe is in flight.
+        """
+
+        circuit = self._circuits.get(host)
+        if circuit is None or circuit.state == CLOSED:
+            return
+
+        with self._lock:
+            now = monotonic()
+            if circuit.state == OPEN and now - circuit.opened_at >= self.open_seconds:
+                self._transition(host, circuit, HALF_OPEN)
+                circuit.probing = True
+                return
+            if circuit.state == CLOSED:
+                return
+            circuit.rejected += 1
+            self.rejected += 1
+            retry_after = max(circuit.opened_at + self.open_seconds - now, 0)
+
+        raise CircuitOpen(host, retry_after)
+
+    def record(self, host: str, ok: bool | None) -> None:
+        """Record the outcome of the request to the host.
+
+        Args:
+            host (str): The destination host.
+            ok (bool | None): Whether the host answered, None if the request ended
+                before it told, e.g. it was never sent.
+        """
+
+        circuit = self._circuits.get(host)
+        if ok is None:
+            if circuit is not None and circuit.probing:
+                with self._lock:
+                    # The next request probes the host instead
+                    circuit.probing = False
+                    if circuit.state == HALF_OPEN:
+                        circuit.state = OPEN
+            return
+        if ok and circuit is None:
+            return
+
+        with self._lock:
+            circuit = self._circuits.get(host)
+            if ok:
+                if circuit is not None:
+                    if circuit.state != CLOSED:
+                        self._transition(host, circuit, CLOSED)
+                    del self._circuits[host]
+                return
+            if circuit is None:
+                circuit = self._circuits[host] = Circuit()
+            else:
+                self._circuits.move_to_end(host)
+            circuit.failures += 1
+            if circuit.state == HALF_OPEN or (
+                circuit.state == CLOSED and circuit.failures >= self.failures
+            ):
+                self._transition(host, circuit, OPEN)
+            while len(self._circuits) > self.max_hosts:
+                if not self._forget():
+                    break
+
+    def state(self, host: str) -> str:
+        """Get the circuit state of the host."""
+
+        circuit = self._circuits.get(host)
+        return CLOSED if circuit is None else circuit.state
+
+    def stats(self) -> dict:
+        """Get the circuits of the failing hosts and the state transitions."""
+
+        with self._lock:
+            now = monotonic()
+            hosts = [
+                {
+                    "host": host,
+                    "state": circuit.state,
+                    "failures": circuit.failures,
+                    "rejected": circuit.rejected,
+                    "retry_after": (
+                        max(circuit.opened_at + self.open_seconds - now, 0)
+                        if circuit.state == OPEN
+                        else None
+                    ),
+                }
+                for host, circuit in self._circuits.items()
+            ]
+            return {
+                "open": sum(host["state"] != CLOSED for host in hosts),
+                "rejected": self.rejected,
+                "transitions": dict(self.transitions),
+                "hosts": hosts,
+            }
+
+    def _transition(self, host: str, circuit: Circuit, state: str) -> None:
+        previous, circuit.state = circuit.state, state
+        if state == OPEN:
+            circuit.opened_at = monotonic()
+        if state != HALF_OPEN:
+            circuit.probing = False
+        self.transitions[state] += 1
+        log = self.log.warning if state == OPEN else self.log.info
+        log(
+            "Changed the circuit state of the host.",
+            host=host,
+            previous=previous,
+            state=state,
+            failures=circuit.failures,
+        )
+
+    def _forget(self) -> bool:
+        for host, circuit in self._circuits.items():
+            if circuit.state == CLOSED:
+                del self._circuits[host]
+                return True
+        return False
+
+
+def merge(stats: list[dict]) -> dict:
+    """Merge the circuits of several workers, listing every worker's circuits."""
+
+    transitions = Counter()
+    for worker in stats:
+        transitions.update(worker["transitions"])
+
+    return {
+        "open": sum(worker["open"] for worker in stats),
+        "rejected": sum(worker["rejected"] for worker in stats),
+        "transitions": dict(transitions),
+        "hosts": [host for worker in stats for host in worker["hosts"]],
+    }
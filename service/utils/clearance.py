@@ -0,0 +1,209 @@
+"""Cloudflare clearance solving and caching."""
+
+import json
+from collections import OrderedDict
+from copy import copy
+from threading import RLock
+from time import perf_counter, time
+from urllib.parse import urlparse
+
+import cloudscraper
+from cloudscraper.exceptions import CloudflareIUAMError
+from utils.agent_pool import parent_domains
+from utils.profile_selector import ProfileSelector
+from utils.single_flight import SingleFlight
+
+
+class Clearance:
+    """Solved Cloudflare clearance."""
+
+    def __init__(self, cf_clearance: str, user_agent: str, expires: float | None):
+        self.cf_clearance = cf_clearance
+        self.user_agent = user_agent
+        self.expires = expires
+
+
+def solve_clearance(url: str, **kwargs) -> Clearance:
+    """Solve the Cloudflare challenge for the url.
+
+    Args:
+        url (str): The url to solve the challenge for.
+        **kwargs: Keyword arguments for cloudscraper. See cloudscraper documentation for more details.
+
+    Raises:
+        CloudflareIUAMError: If the destination didn't set the cf_clearance cookie.
+
+    Returns:
+        Clearance: The obtained clearance.
+    """
+
+    scraper = cloudscraper.create_scraper(**kwargs)
+    try:
+        response = scraper.get(url)
+        response.raise_for_status()
+        domains = parent_domains(urlparse(response.url).hostname or "")
+        for cookie in scraper.cookies:
+            if cookie.name == "cf_clearance" and cookie.domain.lstrip(".") in domains:
+                return Clearance(
+                    cookie.value, scraper.headers["User-Agent"], cookie.expires
+                )
+    finally:
+        scraper.close()
+
+    raise CloudflareIUAMError(
+        "Unable to find Cloudflare cookies. Does the site actually "
+        "have Cloudflare IUAM (I'm Under Attack Mode) enabled?"
+    )
+
+
+def share_clearance(
+    source: cloudscraper.CloudScraper, target: cloudscraper.CloudScraper, host: str
+) -> bool:
+    """Share the cf_clearance cookies for the host between agents.
+
+    The clearance is only valid for the user agent it was solved with,
+    so the target agent adopts the source agent's User-Agent header as well.
+
+    Args:
+        source (cloudscraper.CloudScraper): The agent holding the clearance.
+        target (cloudscraper.CloudScraper): The agent to share the clearance with.
+        host (str): The destination host.
+
+    Returns:
+        bool: Whether the source agent held a clearance for the host.
+    """
+
+    domains = parent_domains(host)
+    shared = False
+    for cookie in source.cookies:
+        if cookie.name == "cf_clearance" and cookie.domain.lstrip(".") in domains:
+            target.cookies.set_cookie(copy(cookie))
+            shared = True
+    if shared:
+        target.headers["User-Agent"] = source.headers["User-Agent"]
+
+    return shared
+
+
+class ClearanceCache:
+    """LRU cache of clearances keyed by the destination host and the agent configuration."""
+
+    def __init__(
+        self,
+        max_size: int = 1024,
+        default_ttl: float = 1800,
+        margin: float = 30,
+        profile_selector: ProfileSelector | None = None,
+    ):
+        """Initialize the clearance cache.
+
+        Args:
+            max_size (int, optional): Maximum number of cached clearances. 0 disables the cache.
+            default_ttl (float, optional): Seconds to keep clearances without cookie expiry.
+            margin (float, optional): Seconds before the cookie expiry a clearance is considered stale.
+            profile_selector (ProfileSelector | None, optional): Scored by the solves.
+        """
+
+        self._lock = RLock()
+        self._entries = OrderedDict()
+        self.single_flight = SingleFlight("clearance")
+        self.max_size = max_size
+        self.default_ttl = default_ttl
+        self.margin = margin
+        self.profile_selector = profile_selector
+
+    @staticmethod
+    def key(url: str, config: dict) -> tuple[str, str]:
+        """Build the cache key from the destination host and the effective agent configuration."""
+
+        return urlparse(url).hostname or "", json.dumps(config, sort_keys=True)
+
+    def get(self, key: tuple[str, str]) -> Clearance | None:
+        """Get a fresh cached clearance.
+
+        Args:
+            key (tuple[str, str]): The cache key.
+
+        Returns:
+            Clearance | None: The clearance or None if it's missing or stale.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            clearance, expires = entry
+            if expires <= time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+
+        return clearance
+
+    def set(self, key: tuple[str, str], clearance: Clearance) -> None:
+        """Cache the clearance until its cookie expires.
+
+        Args:
+            key (tuple[str, str]): The cache key.
+            clearance (Clearance): The clearance.
+        """
+
+        if not self.max_size:
+            return
+
+        if clearance.expires is None:
+            expires = time() + self.default_ttl
+        else:
+            expires = clearance.expires - self.margin
+        with self._lock:
+            self._entries[key] = (clearance, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def solve(self, url: str, config: dict, refresh: bool = False) -> Clearance:
+        """Get the cached clearance for the url or solve a new one.
+
+        Concurrent solves for the same key are coalesced into one.
+
+        Args:
+            url (str): The url to solve the challenge for.
+            config (dict): Keyword arguments for cloudscraper.
+            refresh (bool, optional): Solve a new clearance even if a cached one is fresh.
+
+        Returns:
+            Clearance: The clearance.
+        """
+
+        key = self.key(url, config)
+        if not refresh:
+            clearance = self.get(key)
+            if clearance is not None:
+                return clearance
+
+        clearance, _ = self.single_flight.do(key, self._solve, key, url, config)
+
+        return clearance
+
+    def _solve(self, key: tuple[str, str], url: str, config: dict) -> Clearance:
+        start = perf_counter()
+        try:
+            clearance = solve_clearance(url, **config)
+        except Exception:
+            if self.profile_selector is not None:
+                self.profile_selector.observe(key[0], config, blocked=True)
+            raise
+        if self.profile_selector is not None:
+            self.profile_selector.observe(key[0], config, perf_counter() - start)
+        self.set(key, clearance)
+
+        return clearance
+
+    def clear(self) -> None:
+        """Clear the cache."""
+
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,201 @@
+"""Proactive refresh of cf_clearance cookies of the active agents."""
+
+import heapq
+from http.cookiejar import Cookie
+from threading import BoundedSemaphore, Event, Lock, Thread
+from time import time
+
+from structlog import get_logger
+from utils.agent_pool import AgentPool
+
+BUSY_RETRY_DELAY = 5
+
+
+def is_clearance(cookie: Cookie, domain: str) -> bool:
+    """Check whether the cookie is the cf_clearance cookie for the domain."""
+
+    return cookie.name == "cf_clearance" and cookie.domain.lstrip(".") == domain
+
+
+class ClearanceRefresher:
+    def __init__(
+        self,
+        agent_pool: AgentPool,
+        lead_time: float = 60,
+        active_window: float = 600,
+        max_concurrency: int = 4,
+    ):
+        """Initialize the clearance refresher.
+
+        Args:
+            agent_pool (AgentPool): The agent pool to refresh clearances in.
+            lead_time (float, optional): Seconds before the cookie expiry to refresh it.
+            active_window (float, optional): Only agents used within this many seconds are refreshed.
+            max_concurrency (int, optional): Maximum number of refreshes running at once.
+        """
+
+        self.log = get_logger(__name__)
+        self.agent_pool = agent_pool
+        self.lead_time = lead_time
+        self.active_window = active_window
+        self._lock = Lock()
+        self._heap = []
+        self._slots = BoundedSemaphore(max_concurrency)
+        self._wakeup = Event()
+        self._stop = None
+        self.refreshed = 0
+        self.skipped = 0
+        self.failed = 0
+        agent_pool.refresher = self
+
+    def track(self, agent_id: int, domain: str, expires: float) -> None:
+        """Schedule the refresh of the agent's clearance for the domain.
+
+        Args:
+            agent_id (int): The agent id.
+            domain (str): The cookie domain.
+            expires (float): The cookie expiry timestamp.
+        """
+
+        if expires == float("inf"):
+            return
+
+        refresh_at = expires - self.lead_time
+        with self._lock:
+            heapq.heappush(self._heap, (refresh_at, agent_id, domain, expires))
+            earliest = self._heap[0][0] == refresh_at
+        if earliest:
+            self._wakeup.set()
+
+    def due(self) -> list[tuple[int, str]]:
+        """Pop the refreshes that are due.
+
+        Returns:
+            list[tuple[int, str]]: Agent ids and cookie domains to refresh.
+        """
+
+        now = time()
+        due = []
+        retry = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                _, agent_id, domain, expires = heapq.heappop(self._heap)
+                info = self.agent_pool.info(agent_id)
+                # Skip the entries of removed agents and renewed cookies
+                if info is None or info.domains.get(domain) != expires:
+                    continue
+                if now - info.last_used > self.active_window:
+                    self.skipped += 1
+                    continue
+                if info.in_flight:
+                    # Don't touch the cookies of a busy agent, retry shortly
+                    retry.append((now + BUSY_RETRY_DELAY, agent_id, domain, expires))
+                    continue
+                due.append((agent_id, domain))
+            for entry in retry:
+                heapq.heappush(self._heap, entry)
+
+        return due
+
+    def refresh(self, agent_id: int, domain: str) -> bool:
+        """Solve a new clearance for the agent.
+
+        The current cookie is dropped to trigger the challenge and restored if no new one is set.
+
+        Args:
+            agent_id (int): The agent id.
+            domain (str): The cookie domain.
+
+        Returns:
+            bool: Whether the clearance was renewed.
+        """
+
+        info = self.agent_pool.info(agent_id)
+        if info is None or agent_id not in self.agent_pool:
+            return False
+        url = info.origins.get(domain, f"https://{domain}/")
+        expires = info.domains.get(domain)
+
+        try:
+            with self.agent_pool.use(agent_id, url, touch=False) as agent:
+                stale = [
+                    cookie for cookie in agent.cookies if is_clearance(cookie, domain)
+                ]
+                for cookie in stale:
+                    agent.cookies.clear(cookie.domain, cookie.path, cookie.name)
+                try:
+                    agent.get(url)
+                finally:
+                    if not any(is_clearance(cookie, domain) for cookie in agent.cookies):
+                        for cookie in stale:
+                            agent.cookies.set_cookie(cookie)
+        except Exception as err:
+            self.log.warning(
+                "Couldn't refresh the clearance.",
+                agent_id=agent_id,
+                domain=domain,
+                error=err,
+            )
+            renewed = False
+        else:
+            info = self.agent_pool.info(agent_id)
+            renewed = info is not None and info.domains.get(domain, expires) != expires
+
+        with self._lock:
+            if renewed:
+                self.refreshed += 1
+            else:
+                self.failed += 1
+
+        return renewed
+
+    def start(self, interval: float = 30) -> None:
+        """Start refreshing the clearances in the background.
+
+        Args:
+            interval (float, optional): Maximum seconds between the schedule checks.
+        """
+
+        if self._stop is not None:
+            return
+
+        self._stop = Event()
+
+        def worker(agent_id: int, domain: str):
+            try:
+                self.refresh(agent_id, domain)
+            finally:
+                self._slots.release()
+
+        def run(stop: Event):
+            while not stop.is_set():
+                for agent_id, domain in self.due():
+                    self._slots.acquire()
+                    Thread(target=worker, args=(agent_id, domain), daemon=True).start()
+                with self._lock:
+                    timeout = interval
+                    if self._heap:
+                        timeout = min(max(self._heap[0][0] - time(), 0), interval)
+                self._wakeup.wait(timeout)
+                self._wakeup.clear()
+
+        Thread(target=run, args=(self._stop,), daemon=True).start()
+
+    def stop(self) -> None:
+        """Stop the background refresh."""
+
+        if self._stop is not None:
+            self._stop.set()
+            self._wakeup.set()
+            self._stop = None
+
+    def stats(self) -> dict:
+        """Get the refresh statistics."""
+
+        with self._lock:
+            return {
+                "scheduled": len(self._heap),
+                "refreshed": self.refreshed,
+                "skipped": self.skipped,
+                "failed": self.failed,
+            }
@@ -0,0 +1,256 @@
+"""Pool of outbound proxies the agents leave through, with passive health scoring."""
+
+from random import choices
+from threading import Lock
+from time import monotonic
+from urllib.parse import urlparse
+
+from structlog import get_logger
+
+STRATEGIES = ("least_loaded", "weighted")
+
+
+def egress_name(url: str) -> str:
+    """Name the proxy by its address, leaving out the credentials."""
+
+    parsed = urlparse(url)
+    return f"{parsed.hostname}:{parsed.port}" if parsed.port else parsed.hostname or url
+
+
+def agent_egress(agent) -> str | None:
+    """Get the url of the outbound proxy the agent leaves through."""
+
+    return (agent.proxies or {}).get("https")
+
+
+def pin_egress(agent, url: str) -> None:
+    """Send the requests of the agent through the proxy."""
+
+    agent.proxies.update({"http": url, "https": url})
+    # The proxy environment variables would take precedence over the pinned proxy
+    agent.trust_env = False
+
+
+def is_error(status: int | None) -> bool:
+    """Check whether the upstream outcome counts against the proxy.
+
+    Server errors are told by the destination, not the proxy, so a failing destination
+    doesn't eject the proxies used for the other ones.
+
+    Args:
+        status (int | None): The response status code, None if the request couldn't
+            connect or timed out.
+    """
+
+    return status is None or status == 429
+
+
+class Egress:
+    """An outbound proxy and its health."""
+
+    def __init__(self, url: str, weight: float = 1, name: str | None = None):
+        self.url = url
+        self.weight = weight
+        self.name = name or egress_name(url)
+        # Agents pinned to the proxy
+        self.agents = 0
+        self.requests = 0
+        self.errors = 0
+        # Requests without a challenge solve and their total duration
+        self.timed = 0
+        self.seconds = 0.0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        # Moving averages since the last ejection
+        self.samples = 0
+        self.timed_samples = 0
+        self.error_rate = 0.0
+        self.latency = 0.0
+
+    def pin(self, agent) -> None:
+        """Send the requests of the agent through the proxy."""
+
+        pin_egress(agent, self.url)
+
+    def ejected(self, now: float) -> bool:
+        return self.ejected_until > now
+
+
+class EgressPool:
+    def __init__(
+        self,
+        proxies: list[dict],
+        strategy: str = "least_loaded",
+        error_threshold: float = 0.5,
+        latency_threshold: float = 10,
+        min_requests: int = 10,
+        eject_seconds: float = 60,
+        decay: float = 0.1,
+    ):
+        """Initialize the egress pool.
+
+        Agents are assigned a proxy when they are generated and keep it for their
+        lifetime, as the clearance is bound to the IP address it was solved from.
+        A proxy whose moving error rate or latency crosses the threshold is ejected
+        for a while, so new agents aren't assigned to it. Agents already using it
+        keep it.
+
+        Args:
+            proxies (list[dict]): The proxies, dicts with the url and optionally the
+                weight and name.
+            strategy (str, optional): least_loaded assigns the proxy with the fewest
+                agents per weight, weighted picks one at random by the weights.
+            error_threshold (float, optional): Moving error rate ejecting the proxy.
+            latency_threshold (float, optional): Moving request latency in seconds
+                ejecting the proxy. 0 disables it.
+            min_requests (int, optional): Requests the proxy has to make before it
+                can be ejected.
+            eject_seconds (float, optional): Seconds an ejected proxy isn't assigned.
+            decay (float, optional): Weight of the latest request in the moving
+                averages.
+        """
+
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown egress strategy: {strategy}.")
+
+        self.log = get_logger(__name__)
+        self.egresses = [Egress(**proxy) for proxy in proxies]
+        self.strategy = strategy
+        self.error_threshold = error_threshold
+        self.latency_threshold = latency_threshold
+        self.min_requests = min_requests
+        self.eject_seconds = eject_seconds
+        self.decay = decay
+        self._by_url = {egress.url: egress for egress in self.egresses}
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self.egresses)
+
+    def get(self, url: str | None) -> Egress | None:
+        """Get the proxy by its url."""
+
+        return self._by_url.get(url)
+
+    def assign(self) -> Egress | None:
+        """Pick the proxy for a new agent.
+
+        Returns:
+            Egress | None: The proxy or None if the pool is empty. If every proxy is
+                ejected, the one returning first is picked.
+        """
+
+        if not self.egresses:
+            return None
+
+        now = monotonic()
+        with self._lock:
+            healthy = [egress for egress in self.egresses if not egress.ejected(now)]
+            if not healthy:
+                egress = min(self.egresses, key=lambda egress: egress.ejected_until)
+            elif self.strategy == "weighted":
+                egress = choices(healthy, [egress.weight for egress in healthy])[0]
+            else:
+                egress = min(healthy, key=lambda egress: egress.agents / egress.weight)
+            egress.agents += 1
+
+        return egress
+
+    def pin(self, url: str | None) -> Egress | None:
+        """Count a restored agent using the proxy.
+
+        Returns:
+            Egress | None: The proxy or None if it's not in the pool.
+        """
+
+        egress = self.get(url)
+        if egress is not None:
+            with self._lock:
+                egress.agents += 1
+
+        return egress
+
+    def release(self, url: str | None) -> None:
+        """Stop counting a removed agent using the proxy."""
+
+        egress = self.get(url)
+        if egress is not None:
+            with self._lock:
+                egress.agents = max(egress.agents - 1, 0)
+
+    def observe(self, url: str | None, seconds: float | None, status: int | None) -> None:
+        """Score the proxy by the outcome of an upstream request made through it.
+
+        Args:
+            url (str | None): The proxy url.
+            seconds (float | None): The request duration, None if it doesn't tell
+                the proxy latency, e.g. as it included a challenge solve.
+            status (int | None): The response status code, None if the request
+                couldn't connect or timed out.
+        """
+
+        egress = self.get(url)
+        if egress is None:
+            return
+
+        error = is_error(status)
+        with self._lock:
+            egress.requests += 1
+            egress.errors += error
+            if egress.samples:
+                egress.error_rate += self.decay * (error - egress.error_rate)
+            else:
+                egress.error_rate = float(error)
+            if seconds is not None:
+                egress.seconds += seconds
+                egress.timed += 1
+                if egress.timed_samples:
+                    egress.latency += self.decay * (seconds - egress.latency)
+                else:
+                    egress.latency = seconds
+                egress.timed_samples += 1
+            egress.samples += 1
+            if egress.samples < self.min_requests:
+                return
+            if egress.error_rate >= self.error_threshold:
+                reason = "errors"
+            elif self.latency_threshold and egress.latency >= self.latency_threshold:
+                reason = "latency"
+            else:
+                return
+            egress.ejected_until = monotonic() + self.eject_seconds
+            egress.ejections += 1
+            # Scored again from scratch, so it's ejected again if it doesn't recover
+            egress.samples = egress.timed_samples = 0
+            error_rate, latency = egress.error_rate, egress.latency
+
+        self.log.warning(
+            "Ejected the egress proxy.",
+            egress=egress.name,
+            reason=reason,
+            error_rate=error_rate,
+            latency_seconds=latency,
+            eject_seconds=self.eject_seconds,
+        )
+
+    def stats(self) -> list[dict]:
+        """Get the statistics of the proxies."""
+
+        now = monotonic()
+        with self._lock:
+            return [
+                {
+                    "name": egress.name,
+                    "weight": egress.weight,
+                    "agents": egress.agents,
+                    "requests": egress.requests,
+                    "errors": egress.errors,
+                    "timed": egress.timed,
+                    "seconds": egress.seconds,
+                    "error_rate": egress.error_rate,
+                    "latency_seconds": egress.latency,
+                    "ejections": egress.ejections,
+                    "ejected": egress.ejected(now),
+                }
+                for egress in self.egresses
+            ]
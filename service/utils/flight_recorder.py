@@ -0,0 +1,171 @@
+"""In-memory recorder of the slowest and a sample of the recent requests."""
+
+import heapq
+from collections import deque
+from itertools import count
+from random import random
+from threading import Lock
+from time import time
+
+from flask import Request, Response, has_request_context, request
+
+
+class FlightRecord:
+    def __init__(self, method: str, endpoint: str, bytes_in: int):
+        """Initialize the request record.
+
+        Args:
+            method (str): The HTTP method.
+            endpoint (str): The endpoint rule.
+            bytes_in (int): The request body size.
+        """
+
+        self.started = time()
+        self.method = method
+        self.endpoint = endpoint
+        self.status = None
+        self.duration = None
+        self.stages = {}
+        self.agent_id = None
+        self.host = None
+        self.challenge = False
+        self.retries = 0
+        self.bytes_in = bytes_in
+        self.bytes_out = None
+
+    def stage(self, name: str, seconds: float) -> None:
+        """Add the time spent in the stage."""
+
+        self.stages[name] = self.stages.get(name, 0) + seconds
+
+    def to_dict(self) -> dict:
+        """Get the record."""
+
+        return {
+            "started": self.started,
+            "method": self.method,
+            "endpoint": self.endpoint,
+            "status": self.status,
+            "duration": self.duration,
+            "stages": self.stages,
+            "agent_id": self.agent_id,
+            "host": self.host,
+            "challenge": self.challenge,
+            "retries": self.retries,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+        }
+
+
+class FlightRecorder:
+    def __init__(
+        self, slowest: int = 50, sample_size: int = 100, sample_rate: float = 0.01
+    ):
+        """Initialize the flight recorder.
+
+        Args:
+            slowest (int, optional): Number of the slowest requests kept.
+            sample_size (int, optional): Number of the sampled recent requests kept.
+            sample_rate (float, optional): Share of the requests sampled.
+        """
+
+        self.slowest = slowest
+        self.sample_size = sample_size
+        self.sample_rate = sample_rate
+        self._lock = Lock()
+        self._slowest = []
+        self._sample = deque(maxlen=sample_size)
+        self._order = count()
+        self.recorded = 0
+
+    def start(self, request: Request) -> None:
+        """Start recording the request."""
+
+        request.flight_record = FlightRecord(
+            request.method,
+            request.url_rule.rule if request.url_rule is not None else request.path,
+            request.content_length or 0,
+        )
+
+    def finish(self, request: Request, response: Response) -> None:
+        """Finish recording the request.
+
+        Requests forwarded to other workers are recorded by the workers handling them.
+        """
+
+        record = getattr(request, "flight_record", None)
+        if record is None:
+            return
+        record.status = response.status_code
+        record.duration = time() - record.started
+        record.bytes_out = response.content_length
+        self.record(record)
+
+    def record(self, record: FlightRecord) -> None:
+        """Keep the finished record if it's among the slowest or sampled."""
+
+        entry = (record.duration, next(self._order), record)
+        with self._lock:
+            self.recorded += 1
+            if len(self._slowest) < self.slowest:
+                heapq.heappush(self._slowest, entry)
+            elif self._slowest and entry[0] > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, entry)
+            if self.sample_size and random() < self.sample_rate:
+                self._sample.append(record)
+
+    def entries(self) -> dict:
+        """Get the slowest requests, the slowest first, and the sampled ones, the latest first."""
+
+        with self._lock:
+            slowest = [record for _, _, record in sorted(self._slowest, reverse=True)]
+            sample = list(reversed(self._sample))
+
+        return {
+            "recorded": self.recorded,
+            "slowest": [record.to_dict() for record in slowest],
+            "sample": [record.to_dict() for record in sample],
+        }
+
+    def clear(self) -> None:
+        """Forget the recorded requests."""
+
+        with self._lock:
+            self._slowest.clear()
+            self._sample.clear()
+            self.recorded = 0
+
+
+def current_record() -> FlightRecord | None:
+    """Get the record of the request being handled, if it's recorded."""
+
+    if not has_request_context():
+        return None
+    return getattr(request, "flight_record", None)
+
+
+def merge(entries: list[dict], slowest: int, sample_size: int) -> dict:
+    """Merge the recorded requests of several workers.
+
+    Args:
+        entries (list[dict]): The recorded requests of every worker.
+        slowest (int): Number of the slowest requests kept.
+        sample_size (int): Number of the sampled requests kept.
+
+    Returns:
+        dict: The merged recorded requests.
+    """
+
+    return {
+        "recorded": sum(entry["recorded"] for entry in entries),
+        "slowest": sorted(
+            (record for entry in entries for record in entry["slowest"]),
+            key=lambda record: record["duration"],
+            reverse=True,
+        )[:slowest],
+        "sample": sorted(
+            (record for entry in entries for record in entry["sample"]),
+            key=lambda record: record["started"],
+            reverse=True,
+        )[:sample_size],
+    }
@@ -1,4 +1,40 @@
-workers = 1
+import os
+
+workers = int(os.getenv("CLOUDSCRAPER_PROXY_WORKERS", len(os.sched_getaffinity(0))))
 worker_class = "gevent"
 keepalive = 10
 logger_class = "utils.gunicorn_structlog.GunicornLogger"
+
+
+def pre_fork(server, worker):
+    """Assign the lowest shard not owned by a live worker, so a restarted worker takes over the shard of the dead one."""
+
+    taken = {getattr(w, "shard", None) for w in server.WORKERS.values()}
+    worker.shard = next(shard for shard in range(len(taken) + 1) if shard not in taken)
+
+
+def post_fork(server, worker):
+    """Expose the shard of the worker to the application config."""
+
+    os.environ["CLOUDSCRAPER_PROXY_SHARD"] = str(worker.shard)
+    os.environ["CLOUDSCRAPER_PROXY_WORKERS"] = str(server.num_workers)
+
+
+def post_worker_init(worker):
+    """Start the background work of the application once the worker loaded it."""
+
+    from main import start
+
+    start()
+
+
+def worker_exit(server, worker):
+    """Save the agent pool snapshot and write the queued log when the worker exits, e.g. on SIGTERM."""
+
+    from main import log_queue, save_snapshot, shard_router
+
+    save_snapshot()
+    if shard_router is not None:
+        shard_router.stop()
+    if log_queue is not None:
+        log_queue.stop()
@@ -1,7 +1,20 @@
 import structlog
+from utils.config import Config
+from utils.logger import setup_logging
 
-# DO NOT REMOVE, this invokes structlog configuration and avoids calling it twice
-from main import app  # noqa: F401
+# DO NOT REMOVE, this invokes structlog configuration in the gunicorn master.
+# The app itself is loaded by every worker, so each one owns its agent pool shard.
+config = Config.parse_config()
+setup_logging(
+    filename=config.log.path,
+    log_level=config.log.level,
+    dev=config.log.dev,
+    queue=config.log.queue,
+    queue_size=config.log.queue_size,
+    batch_size=config.log.batch_size,
+    flush_interval=config.log.flush_interval,
+    access_sample_rate=config.log.access_sample_rate,
+)
 
 
 class GunicornLogger(object):
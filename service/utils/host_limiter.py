@@ -0,0 +1,365 @@
+"""Rate and concurrency limits of the upstream requests per destination host.
+
+Threading primitives are used, so the queued requests are gevent greenlets waiting on
+events once gevent has monkey patched the standard library.
+"""
+
+from collections import OrderedDict, deque
+from collections.abc import Hashable, Iterator
+from contextlib import contextmanager
+from fnmatch import fnmatchcase
+from math import ceil
+from threading import Event, Lock
+from time import monotonic
+
+# Hosts tracked before the idle ones are forgotten
+MAX_IDLE_HOSTS = 1024
+
+
+class HostLimitTimeout(Exception):
+    """The request wasn't admitted to the destination host within the maximum wait."""
+
+
+class HostRule:
+    """Limits of the hosts matching the pattern."""
+
+    def __init__(
+        self, pattern: str, rate: float = 0, burst: int = 1, max_concurrency: int = 0
+    ):
+        """Initialize the rule.
+
+        Args:
+            pattern (str): Shell-style host pattern, e.g. *.example.com.
+            rate (float, optional): Requests per second, 0 is unlimited.
+            burst (int, optional): Requests made at once before the rate applies.
+            max_concurrency (int, optional): Requests in flight, 0 is unlimited.
+        """
+
+        self.pattern = pattern.lower()
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.max_concurrency = max_concurrency
+        # Counted here as well, as idle hosts are forgotten
+        self.delayed = 0
+        self.wait_seconds = 0.0
+        self.timeouts = 0
+
+    @property
+    def limited(self) -> bool:
+        return bool(self.rate or self.max_concurrency)
+
+    def matches(self, host: str) -> bool:
+        return fnmatchcase(host, self.pattern)
+
+
+class HostState:
+    """Token bucket, requests in flight and queued requests of a host."""
+
+    def __init__(self, rule: HostRule, now: float):
+        self.rule = rule
+        self.tokens = float(rule.burst)
+        self.updated = now
+        self.active = 0
+        # Queued requests by the agent, served round-robin
+        self.queues = OrderedDict()
+        self.queued = 0
+        self.delayed = 0
+        self.wait_seconds = 0.0
+        self.timeouts = 0
+
+    def refill(self, now: float) -> None:
+        if self.rule.rate:
+            self.tokens = min(
+                self.rule.burst, self.tokens + (now - self.updated) * self.rule.rate
+            )
+        self.updated = now
+
+    def admissible(self) -> bool:
+        rule = self.rule
+        if rule.max_concurrency and self.active >= rule.max_concurrency:
+            return False
+        return not rule.rate or self.tokens >= 1
+
+    def admit(self) -> None:
+        self.active += 1
+        if self.rule.rate:
+            self.tokens -= 1
+
+    def next_token(self) -> float | None:
+        """Seconds until the next token, None if the requests wait for a free slot."""
+
+        if (
+            self.rule.max_concurrency and self.active >= self.rule.max_concurrency
+        ) or not self.rule.rate:
+            return None
+        return max((1 - self.tokens) / self.rule.rate, 0)
+
+    def idle(self, now: float) -> bool:
+        if self.active or self.queued:
+            return False
+        if not self.rule.rate:
+            return True
+        return self.tokens + (now - self.updated) * self.rule.rate >= self.rule.burst
+
+
+class HostLimiter:
+    def __init__(
+        self,
+        rules: list[dict],
+        rate: float = 0,
+        burst: int = 1,
+        max_concurrency: int = 0,
+        max_wait: float = 30,
+        shards: int = 1,
+    ):
+        """Initialize the host limiter.
+
+        Every destination host gets its own token bucket and concurrency limit, from
+        the first rule its name matches or the default limits. Requests over the limits
+        are queued and admitted round-robin across the agents, so one busy agent doesn't
+        starve the others. Every gunicorn worker admits its share of the limits, at
+        least one request at once.
+
+        Args:
+            rules (list[dict]): The host rules, dicts with the pattern and optionally
+                the rate, burst and max_concurrency. Missing limits are the defaults.
+            rate (float, optional): Default requests per second per host, 0 is
+                unlimited.
+            burst (int, optional): Default requests made at once before the rate
+                applies.
+            max_concurrency (int, optional): Default requests in flight per host, 0 is
+                unlimited.
+            max_wait (float, optional): Seconds a request waits to be admitted.
+            shards (int, optional): The number of workers sharing the limits.
+        """
+
+        defaults = {"rate": rate, "burst": burst, "max_concurrency": max_concurrency}
+        self.rules = [
+            self._share(
+                HostRule(
+                    rule["pattern"],
+                    **{
+                        name: default if rule.get(name) is None else rule[name]
+                        for name, default in defaults.items()
+                    },
+                ),
+                shards,
+            )
+            for rule in rules
+        ]
+        self.default = self._share(HostRule("*", rate, burst, max_concurrency), shards)
+        self.max_wait = max_wait
+        self._hosts = {}
+        self._lock = Lock()
+
+    @staticmethod
+    def _share(rule: HostRule, shards: int) -> HostRule:
+        """Split the limits of the rule between the workers."""
+
+        if shards > 1:
+            rule.rate /= shards
+            rule.burst = ceil(rule.burst / shards)
+            rule.max_concurrency = ceil(rule.max_concurrency / shards)
+        return rule
+
+    def rule(self, host: str) -> HostRule:
+        """Get the rule limiting the host."""
+
+        host = host.lower()
+        for rule in self.rules:
+            if rule.matches(host):
+                return rule
+        return self.default
+
+    @contextmanager
+    def acquire(
+        self, host: str, agent_id: Hashable = None, timeout: float | None = None
+    ) -> Iterator[float]:
+        """Wait until the request to the host is admitted and hold its slot meanwhile.
+
+        Args:
+            host (str): The destination host.
+            agent_id (Hashable, optional): The agent making the request, the queued
+                requests are admitted round-robin by it.
+            timeout (float | None, optional): Seconds to wait, defaults to max_wait.
+
+        Raises:
+            HostLimitTimeout: The request wasn't admitted in time.
+
+        Yields:
+            float: Seconds the request waited.
+        """
+
+        host = host.lower()
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is None:
+                rule = self.rule(host)
+                if rule.limited:
+                    if len(self._hosts) >= MAX_IDLE_HOSTS:
+                        self._forget(monotonic())
+                    state = self._hosts[host] = HostState(rule, monotonic())
+            waiter = None
+            if state is not None:
+                state.refill(monotonic())
+                # Queued requests go first, so nobody jumps the queue
+                if not state.queued and state.admissible():
+                    state.admit()
+                else:
+                    waiter = Event()
+                    state.queues.setdefault(agent_id, deque()).append(waiter)
+                    state.queued += 1
+                    state.delayed += 1
+                    state.rule.delayed += 1
+
+        if state is None:
+            yield 0.0
+            return
+
+        waited = 0.0
+        if waiter is not None:
+            waited = self._wait(host, state, agent_id, waiter, timeout)
+        try:
+            yield waited
+        finally:
+            with self._lock:
+                state.active -= 1
+                self._dispatch(state, monotonic())
+
+    def stats(self) -> dict:
+        """Get the queue depths and counters of the limited hosts."""
+
+        with self._lock:
+            now = monotonic()
+            hosts = []
+            for host, state in self._hosts.items():
+                state.refill(now)
+                hosts.append(
+                    {
+                        "host": host,
+                        "pattern": state.rule.pattern,
+                        "queued": state.queued,
+                        "agents": len(state.queues),
+                        "active": state.active,
+                        "tokens": state.tokens if state.rule.rate else None,
+                        "delayed": state.delayed,
+                        "wait_seconds": state.wait_seconds,
+                        "timeouts": state.timeouts,
+                    }
+                )
+
+        return {
+            "queued": sum(host["queued"] for host in hosts),
+            "active": sum(host["active"] for host in hosts),
+            "hosts": sorted(hosts, key=lambda host: host["queued"], reverse=True),
+        }
+
+    def patterns(self) -> dict[str, dict]:
+        """Get the queue depths and counters summed by the rule pattern."""
+
+        totals = {}
+        with self._lock:
+            for rule in self.rules + [self.default]:
+                if not rule.limited:
+                    continue
+                total = totals.setdefault(
+                    rule.pattern,
+                    {
+                        "queued": 0,
+                        "active": 0,
+                        "delayed": 0,
+                        "wait_seconds": 0,
+                        "timeouts": 0,
+                    },
+                )
+                total["delayed"] += rule.delayed
+                total["wait_seconds"] += rule.wait_seconds
+                total["timeouts"] += rule.timeouts
+            for state in self._hosts.values():
+                totals[state.rule.pattern]["queued"] += state.queued
+                totals[state.rule.pattern]["active"] += state.active
+
+        return totals
+
+    def _wait(
+        self,
+        host: str,
+        state: HostState,
+        agent_id: Hashable,
+        waiter: Event,
+        timeout: float | None,
+    ) -> float:
+        """Wait until the request is admitted, refilling the bucket as the time passes."""
+
+        start = monotonic()
+        deadline = start + (self.max_wait if timeout is None else timeout)
+        while True:
+            with self._lock:
+                now = monotonic()
+                self._dispatch(state, now)
+                if waiter.is_set() or now >= deadline:
+                    waited = now - start
+                    state.wait_seconds += waited
+                    state.rule.wait_seconds += waited
+                    if waiter.is_set():
+                        return waited
+                    queue = state.queues[agent_id]
+                    queue.remove(waiter)
+                    if not queue:
+                        del state.queues[agent_id]
+                    state.queued -= 1
+                    state.timeouts += 1
+                    state.rule.timeouts += 1
+                    raise HostLimitTimeout(f"Too many requests to {host} are queued.")
+                delay = state.next_token()
+            remaining = deadline - now
+            waiter.wait(remaining if delay is None else min(delay, remaining))
+
+    def _dispatch(self, state: HostState, now: float) -> None:
+        """Admit the queued requests the limits allow, taking turns by the agent."""
+
+        state.refill(now)
+        while state.queued and state.admissible():
+            agent_id, queue = next(iter(state.queues.items()))
+            queue.popleft().set()
+            if queue:
+                state.queues.move_to_end(agent_id)
+            else:
+                del state.queues[agent_id]
+            state.queued -= 1
+            state.admit()
+
+    def _forget(self, now: float) -> None:
+        """Forget the idle hosts, their buckets are full again."""
+
+        for host in [host for host, state in self._hosts.items() if state.idle(now)]:
+            del self._hosts[host]
+
+
+def merge(stats: list[dict]) -> dict:
+    """Merge the statistics of several workers, summing them by the host."""
+
+    hosts = {}
+    for worker in stats:
+        for host in worker["hosts"]:
+            merged = hosts.get(host["host"])
+            if merged is None:
+                hosts[host["host"]] = dict(host)
+                continue
+            for name in [
+                "queued",
+                "agents",
+                "active",
+                "delayed",
+                "wait_seconds",
+                "timeouts",
+            ]:
+                merged[name] += host[name]
+            if host["tokens"] is not None:
+                merged["tokens"] = (merged["tokens"] or 0) + host["tokens"]
+
+    return {
+        "queued": sum(worker["queued"] for worker in stats),
+        "active": sum(worker["active"] for worker in stats),
+        "hosts": sorted(hosts.values(), key=lambda host: host["queued"], reverse=True),
+    }
@@ -0,0 +1,232 @@
+"""Asynchronous jobs for the long-running agent operations.
+
+Threading primitives are used, so the workers are greenlets once gevent has monkey
+patched the standard library.
+"""
+
+import sys
+from collections import deque
+from collections.abc import Callable
+from queue import Empty, Full, Queue
+from threading import Event, Lock, Thread
+from time import time
+from typing import Any
+
+from structlog import get_logger
+from utils.batch import iter_completed
+
+
+class Job:
+    def __init__(self, job_id: int, kind: str, items: list):
+        """Initialize the job.
+
+        Args:
+            job_id (int): The job id.
+            kind (str): The job kind.
+            items (list): The job items.
+        """
+
+        self.id = job_id
+        self.kind = kind
+        self.items = items
+        self.status = "queued"
+        self.results = [None] * len(items)
+        self.completed = 0
+        self.failed = 0
+        self.created = time()
+        self.finished = None
+        self.done = Event()
+
+    def to_dict(self) -> dict:
+        """Get the job state."""
+
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "total": len(self.items),
+            "completed": self.completed,
+            "failed": self.failed,
+            "created": self.created,
+            "finished": self.finished,
+            "results": self.results if self.done.is_set() else None,
+        }
+
+
+class JobQueue:
+    def __init__(
+        self,
+        workers: int = 4,
+        max_queued: int = 100,
+        ttl: float = 600,
+        concurrency: int = 4,
+        shard: int = 0,
+        shards: int = 1,
+    ):
+        """Initialize the job queue.
+
+        Job ids follow the agent ids sharding, so the jobs are owned by the workers
+        the same way the agents are.
+
+        Args:
+            workers (int, optional): Number of jobs run at once.
+            max_queued (int, optional): Maximum number of jobs waiting for a worker.
+            ttl (float, optional): Seconds the finished jobs are kept for.
+            concurrency (int, optional): Number of items of a job processed at once.
+            shard (int, optional): The shard of this worker.
+            shards (int, optional): The number of shards.
+        """
+
+        self.log = get_logger(__name__)
+        self.workers = workers
+        self.ttl = ttl
+        self.concurrency = concurrency
+        self.shard = shard
+        self.shards = shards
+        self.job_id = 0
+        self._queue = Queue(max_queued)
+        self._jobs = {}
+        self._finished = deque()
+        self._lock = Lock()
+        self._stop = None
+        self.running = 0
+        self.submitted = 0
+        self.rejected = 0
+        self.expired = 0
+
+    def submit(self, kind: str, fn: Callable[[Any], dict], items: list) -> Job | None:
+        """Queue a job.
+
+        Args:
+            kind (str): The job kind.
+            fn (Callable[[Any], dict]): The function called for every item. Errors are
+                recorded as the item results.
+            items (list): The job items.
+
+        Returns:
+            Job | None: The job or None if the queue is full.
+        """
+
+        with self._lock:
+            self._expire()
+            job_id = self.job_id + 1
+            job_id += (self.shard - job_id) % self.shards
+            if job_id > sys.maxsize:
+                job_id = self.shard or self.shards
+            job = Job(job_id, kind, items)
+            try:
+                self._queue.put_nowait((job, fn))
+            except Full:
+                self.rejected += 1
+                return None
+            self.job_id = job_id
+            self._jobs[job_id] = job
+            self.submitted += 1
+
+        return job
+
+    def get(self, job_id: int) -> Job | None:
+        """Get the job by the id."""
+
+        with self._lock:
+            self._expire()
+            return self._jobs.get(job_id)
+
+    def wait(self, job_id: int, timeout: float) -> Job | None:
+        """Wait until the job is finished.
+
+        Args:
+            job_id (int): The job id.
+            timeout (float): Maximum seconds to wait for.
+
+        Returns:
+            Job | None: The job, finished unless the timeout passed, or None if there is no such job.
+        """
+
+        job = self.get(job_id)
+        if job is not None and timeout > 0:
+            job.done.wait(timeout)
+
+        return job
+
+    def run(self, job: Job, fn: Callable[[Any], dict]) -> None:
+        """Run the job.
+
+        Args:
+            job (Job): The job.
+            fn (Callable[[Any], dict]): The function called for every item.
+        """
+
+        def run_item(index: int, item: Any) -> tuple[int, dict]:
+            try:
+                return index, fn(item)
+            except Exception as err:
+                self.log.error(
+                    "Job item failed.", job_id=job.id, kind=job.kind, error=err
+                )
+                return index, {"error": str(err) or type(err).__name__}
+
+        job.status = "running"
+        for index, result in iter_completed(run_item, job.items, self.concurrency):
+            job.results[index] = result
+            job.completed += 1
+            if "error" in result:
+                job.failed += 1
+        job.status = "failed" if job.items and job.failed == len(job.items) else "done"
+        job.finished = time()
+        with self._lock:
+            self._finished.append(job)
+        job.done.set()
+
+    def start(self) -> None:
+        """Start the job workers."""
+
+        if self._stop is not None:
+            return
+
+        self._stop = Event()
+
+        def worker(stop: Event):
+            while not stop.is_set():
+                try:
+                    job, fn = self._queue.get(timeout=1)
+                except Empty:
+                    continue
+                with self._lock:
+                    self.running += 1
+                try:
+                    self.run(job, fn)
+                finally:
+                    with self._lock:
+                        self.running -= 1
+
+        for _ in range(self.workers):
+            Thread(target=worker, args=(self._stop,), daemon=True).start()
+
+    def stop(self) -> None:
+        """Stop the job workers once they finish the running jobs."""
+
+        if self._stop is not None:
+            self._stop.set()
+            self._stop = None
+
+    def stats(self) -> dict:
+        """Get the job queue statistics."""
+
+        with self._lock:
+            self._expire()
+            return {
+                "queued": self._queue.qsize(),
+                "running": self.running,
+                "finished": len(self._finished),
+                "submitted": self.submitted,
+                "rejected": self.rejected,
+                "expired": self.expired,
+            }
+
+    def _expire(self) -> None:
+        deadline = time() - self.ttl
+        while self._finished and self._finished[0].finished <= deadline:
+            job = self._finished.popleft()
+            self._jobs.pop(job.id, None)
+            self.expired += 1
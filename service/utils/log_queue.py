@@ -0,0 +1,211 @@
+"""Queue of log events serialized and written in batches by a background writer."""
+
+import json
+import os
+import time
+from collections import deque
+from datetime import datetime, timezone
+from logging import Handler, LogRecord
+from traceback import format_exception
+from typing import BinaryIO, Callable
+
+from structlog import DropEvent
+from utils.profiler import original
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_encoder = json.JSONEncoder(
+    default=repr, ensure_ascii=False, check_circular=False, separators=(",", ":")
+)
+
+
+def render_json(event_dict: dict) -> bytes:
+    """Serialize the log event as a JSON line, using orjson when it's installed."""
+
+    if orjson is not None:
+        try:
+            return orjson.dumps(event_dict, default=repr)
+        except TypeError:
+            pass
+    return _encoder.encode(event_dict).encode()
+
+
+def timestamp(seconds: float) -> str:
+    """Format the time like the structlog ISO time stamper does."""
+
+    return datetime.fromtimestamp(seconds, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+class LogQueue:
+    def __init__(
+        self,
+        stream: BinaryIO,
+        render: Callable[[dict], bytes] = render_json,
+        max_size: int = 10000,
+        batch_size: int = 512,
+        flush_interval: float = 0.1,
+    ):
+        """Initialize the log queue.
+
+        Log events are only queued by the logging calls. A native thread renders and
+        writes them in batches, so the requests never wait for the serialization or
+        the disk. Events logged while the queue is full are dropped and counted.
+
+        Args:
+            stream (BinaryIO): The stream the log lines are written to.
+            render (Callable[[dict], bytes], optional): Serializes the log event.
+            max_size (int, optional): Maximum number of queued events.
+            batch_size (int, optional): Maximum number of events written at once.
+            flush_interval (float, optional): Seconds the writer waits when the queue
+                is empty.
+        """
+
+        self.stream = stream
+        self.render = render
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # deque appends and pops are atomic, so greenlets and native threads share it
+        self._events = deque()
+        self._running = False
+        self._stopped = []
+        self.written = 0
+        self.dropped = 0
+        self._dropped_reported = 0
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def __call__(self, logger, method_name: str, event_dict: dict) -> dict:
+        """Queue the event as the last structlog processor."""
+
+        self.put(event_dict)
+        raise DropEvent
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def put(self, event_dict: dict) -> bool:
+        """Queue the log event.
+
+        Returns:
+            bool: Whether the event was queued, False if it was dropped.
+        """
+
+        if len(self._events) >= self.max_size:
+            self.dropped += 1
+            return False
+        self._events.append(event_dict)
+        return True
+
+    def start(self) -> None:
+        """Start the background writer."""
+
+        if self._running:
+            return
+        self._running = True
+        self._stopped = []
+        original("_thread", "start_new_thread")(self._write, (self._stopped,))
+
+    def stop(self, timeout: float = 5) -> None:
+        """Stop the background writer after it writes the queued events."""
+
+        if not self._running:
+            return
+        self._running = False
+        deadline = time.monotonic() + timeout
+        # Sleep cooperatively, so a gevent worker keeps running meanwhile
+        while not self._stopped and time.monotonic() < deadline:
+            time.sleep(min(self.flush_interval, 0.01))
+
+    def flush(self) -> int:
+        """Write a batch of the queued events.
+
+        Returns:
+            int: The number of written events.
+        """
+
+        lines = []
+        while len(lines) < self.batch_size:
+            try:
+                event_dict = self._events.popleft()
+            except IndexError:
+                break
+            try:
+                lines.append(self.render(event_dict))
+            except Exception as err:
+                lines.append(render_json({"event": repr(event_dict), "error": repr(err)}))
+        dropped = self.dropped
+        if dropped != self._dropped_reported:
+            lines.append(
+                render_json(
+                    {
+                        "event": "Dropped log events, the log queue is full.",
+                        "dropped": dropped - self._dropped_reported,
+                        "level": "warning",
+                        "timestamp": timestamp(time.time()),
+                    }
+                )
+            )
+            self._dropped_reported = dropped
+        if not lines:
+            return 0
+
+        try:
+            self.stream.write(b"\n".join(lines) + b"\n")
+            self.stream.flush()
+        except (OSError, ValueError):
+            # Nowhere to report it, the log itself is broken
+            return 0
+        self.written += len(lines)
+        return len(lines)
+
+    def stats(self) -> dict:
+        """Get the log queue statistics."""
+
+        return {
+            "queued": len(self._events),
+            "written": self.written,
+            "dropped": self.dropped,
+        }
+
+    def handler(self) -> Handler:
+        """Get the logging handler queueing the records of the plain loggers."""
+
+        return LogQueueHandler(self)
+
+    def _write(self, stopped: list) -> None:
+        sleep = original("time", "sleep")
+        try:
+            while self._running:
+                if not self.flush():
+                    sleep(self.flush_interval)
+            while self.flush():
+                pass
+        finally:
+            stopped.append(True)
+
+    def _after_fork(self) -> None:
+        # The writer thread doesn't survive the fork, the forked process needs its own
+        self._events.clear()
+        if self._running:
+            self._running = False
+            self.start()
+
+
+class LogQueueHandler(Handler):
+    def __init__(self, log_queue: LogQueue):
+        super().__init__()
+        self.log_queue = log_queue
+
+    def emit(self, record: LogRecord) -> None:
+        event_dict = {
+            "event": record.getMessage(),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "timestamp": timestamp(record.created),
+        }
+        if record.exc_info:
+            event_dict["exception"] = "".join(format_exception(*record.exc_info))
+        self.log_queue.put(event_dict)
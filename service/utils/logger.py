@@ -3,8 +3,18 @@
 import logging
 import sys
 from logging import Handler, LogRecord
+from random import random
 
 import structlog
+from utils.log_queue import LogQueue, render_json
+
+ACCESS_EVENT = "Processing request."
+# Attributes every LogRecord has, the rest are the extra fields of the logging call
+LOG_RECORD_ATTRIBUTES = frozenset(
+    vars(LogRecord("", logging.INFO, "", 0, "", (), None))
+) | {"message", "asctime"}
+
+log_queue = None
 
 
 class StructlogHandler(Handler):
@@ -13,12 +23,41 @@ class StructlogHandler(Handler):
         self.structlog = structlog.get_logger("flask")
 
     def emit(self, record: LogRecord):
-        kwargs = record.__dict__.copy()
-        kwargs.pop("msg", None)
-        kwargs.pop("message", None)
+        # Level, logger name and time are added by structlog itself
+        kwargs = {
+            name: value
+            for name, value in record.__dict__.items()
+            if name not in LOG_RECORD_ATTRIBUTES
+        }
+        if record.exc_info:
+            kwargs["exc_info"] = record.exc_info
         self.structlog.log(record.levelno, record.getMessage(), **kwargs)
 
 
+class AccessLogSampler:
+    def __init__(self, rate: float):
+        """Initialize the structlog processor sampling the access log.
+
+        Only successful requests are sampled, the failed ones are always logged.
+        Sampled events tell the rate, so the counts can be scaled back.
+
+        Args:
+            rate (float): Share of the successful requests logged.
+        """
+
+        self.rate = rate
+
+    def __call__(self, logger, method_name: str, event_dict: dict) -> dict:
+        if event_dict.get("event") != ACCESS_EVENT or event_dict.get("status", 0) >= 400:
+            return event_dict
+        if self.rate >= 1:
+            return event_dict
+        if random() >= self.rate:
+            raise structlog.DropEvent
+        event_dict["sample_rate"] = self.rate
+        return event_dict
+
+
 class StructLoggerFactory(structlog.stdlib.LoggerFactory):
     def __init__(self, log_level: int):
         super().__init__()
@@ -30,7 +69,16 @@ class StructLoggerFactory(structlog.stdlib.LoggerFactory):
         return logger
 
 
-def setup_logging(filename: str, log_level: int = logging.INFO, dev: bool = False):
+def setup_logging(
+    filename: str,
+    log_level: int = logging.INFO,
+    dev: bool = False,
+    queue: bool = False,
+    queue_size: int = 10000,
+    batch_size: int = 512,
+    flush_interval: float = 0.1,
+    access_sample_rate: float = 1.0,
+) -> LogQueue | None:
     """Setup the global logging configuration.
 
     Args:
@@ -38,9 +86,42 @@ def setup_logging(filename: str, log_level: int = logging.INFO, dev: bool = Fals
         filename (str, optional): The log file name. If not specified, log writes to stdout.
         dev (bool, optional): Whether to use the pretty development renderer or not.
             Use with console output. Defaults to False.
+        queue (bool, optional): Render and write the log in batches on a background
+            writer instead of the logging threads. Defaults to False.
+        queue_size (int, optional): Maximum number of queued log events, the ones
+            over it are dropped.
+        batch_size (int, optional): Maximum number of log events written at once.
+        flush_interval (float, optional): Seconds the writer waits for new events.
+        access_sample_rate (float, optional): Share of the successful requests logged.
+
+    Returns:
+        LogQueue | None: The log queue when queued logging is enabled.
     """
 
-    if filename is None:
+    global log_queue
+
+    if queue and log_queue is None:
+        if filename is None:
+            stream = sys.stdout.buffer
+        else:
+            stream = open(filename, "ab")
+        render = render_json
+        if dev:
+            console = structlog.dev.ConsoleRenderer(colors=True, sort_keys=False)
+
+            def render(event_dict: dict) -> bytes:
+                return console(None, None, event_dict).encode()
+
+        log_queue = LogQueue(
+            stream,
+            render,
+            max_size=queue_size,
+            batch_size=batch_size,
+            flush_interval=flush_interval,
+        )
+        log_queue.start()
+        handler = log_queue.handler()
+    elif filename is None:
         handler = logging.StreamHandler(sys.stdout)
     else:
         handler = logging.FileHandler(filename)
@@ -50,6 +131,9 @@ def setup_logging(filename: str, log_level: int = logging.INFO, dev: bool = Fals
         root_logger.addHandler(handler)
 
     processors = [
+        # Skip the processors for the disabled levels
+        structlog.stdlib.filter_by_level,
+        AccessLogSampler(access_sample_rate),
         structlog.stdlib.add_log_level,
         structlog.stdlib.add_logger_name,
         structlog.processors.TimeStamper(fmt="iso"),
@@ -58,7 +142,9 @@ def setup_logging(filename: str, log_level: int = logging.INFO, dev: bool = Fals
         structlog.processors.UnicodeDecoder(),
     ]
 
-    if dev:
+    if log_queue is not None:
+        processors.append(log_queue)
+    elif dev:
         processors.append(structlog.dev.ConsoleRenderer(colors=True, sort_keys=False))
     else:
         processors.append(structlog.processors.JSONRenderer())
@@ -70,3 +156,5 @@ def setup_logging(filename: str, log_level: int = logging.INFO, dev: bool = Fals
         wrapper_class=structlog.stdlib.BoundLogger,
         cache_logger_on_first_use=True,
     )
+
+    return log_queue
@@ -0,0 +1,525 @@
+"""Prometheus metrics in the text exposition format.
+
+Every gunicorn worker keeps its own metrics. Threading primitives are used, so the
+locks are gevent aware once gevent has monkey patched the standard library.
+"""
+
+from bisect import bisect_left
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from threading import Lock
+from time import perf_counter
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+OTHER_HOST = "other"
+
+
+def escape(value: str) -> str:
+    """Escape the label value."""
+
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+
+def format_labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    """Format the labels of a sample."""
+
+    if not names:
+        return ""
+    labels = ",".join(
+        f'{name}="{escape(str(value))}"' for name, value in zip(names, values)
+    )
+    return "{" + labels + "}"
+
+
+def format_value(value: float) -> str:
+    """Format the value of a sample."""
+
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...] = ()):
+        """Initialize the metric.
+
+        Args:
+            name (str): The metric name.
+            description (str): The metric help text.
+            labels (tuple[str, ...], optional): The label names.
+        """
+
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._values = {}
+        self._function = None
+        self._lock = Lock()
+
+    def set_function(self, fn: Callable[[], float | dict[tuple, float]]) -> None:
+        """Collect the values with the function on every scrape.
+
+        Args:
+            fn (Callable[[], float | dict[tuple, float]]): Returns the value, or the values
+                by the label values of a labeled metric.
+        """
+
+        self._function = fn
+
+    def values(self) -> dict[tuple, float]:
+        """Get the values by the label values."""
+
+        if self._function is not None:
+            values = self._function()
+            return values if isinstance(values, dict) else {(): values}
+        with self._lock:
+            return dict(self._values)
+
+    def samples(self) -> Iterator[str]:
+        """Render the sample lines."""
+
+        for label_values, value in sorted(self.values().items()):
+            labels = format_labels(self.labels, label_values)
+            yield f"{self.name}{labels} {format_value(value)}"
+
+    def render(self) -> str:
+        """Render the metric family."""
+
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels[name]) for name in self.labels)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        """Increase the counter."""
+
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        """Set the gauge."""
+
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        """Increase the gauge."""
+
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        """Decrease the gauge."""
+
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels) -> Iterator[None]:
+        """Count the block as in progress."""
+
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        """Initialize the histogram.
+
+        Args:
+            name (str): The metric name.
+            description (str): The metric help text.
+            labels (tuple[str, ...], optional): The label names.
+            buckets (tuple[float, ...], optional): The bucket upper bounds.
+        """
+
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        """Observe the value."""
+
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0))
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """Observe the duration of the block in seconds."""
+
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start, **labels)
+
+    def values(self) -> dict[tuple, tuple[list[int], float]]:
+        with self._lock:
+            return {
+                key: (list(counts), total)
+                for key, (counts, total) in self._values.items()
+            }
+
+    def samples(self) -> Iterator[str]:
+        names = self.labels + ("le",)
+        for label_values, (counts, total) in sorted(self.values().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = format_labels(names, label_values + (format_value(bound),))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = format_labels(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {format_value(total)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Metrics:
+    def __init__(
+        self, max_hosts: int = 1000, buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    ):
+        """Initialize the service metrics.
+
+        Args:
+            max_hosts (int, optional): Maximum number of destination hosts labeled by name,
+                the requests to other hosts are labeled as "other".
+            buckets (tuple[float, ...], optional): The latency histogram bucket bounds.
+        """
+
+        self.max_hosts = max_hosts
+        self._hosts = set()
+        self._lock = Lock()
+        self._metrics = []
+        self.stage_seconds = self.add(
+            Histogram(
+                "cloudscraper_proxy_stage_seconds",
+                "Duration of the proxy request stages in seconds.",
+                ("stage",),
+                buckets,
+            )
+        )
+        self.request_seconds = self.add(
+            Histogram(
+                "cloudscraper_proxy_request_seconds",
+                "Duration of the requests in seconds until the response is returned.",
+                ("endpoint", "method"),
+                buckets,
+            )
+        )
+        self.requests_in_flight = self.add(
+            Gauge(
+                "cloudscraper_proxy_requests_in_flight",
+                "Requests being handled.",
+                ("endpoint",),
+            )
+        )
+        self.upstream_in_flight = self.add(
+            Gauge(
+                "cloudscraper_proxy_upstream_requests_in_flight",
+                "Requests being made to the destinations.",
+            )
+        )
+        self.upstream_responses = self.add(
+            Counter(
+                "cloudscraper_proxy_upstream_responses_total",
+                "Responses of the destinations by the host and the status code.",
+                ("host", "status"),
+            )
+        )
+        self.upstream_retries = self.add(
+            Counter(
+                "cloudscraper_proxy_upstream_retries_total",
+                "Upstream requests sent again after a failure by the host.",
+                ("host",),
+            )
+        )
+
+    def track_pool(self, agent_pool) -> None:
+        """Export the agent pool statistics.
+
+        Args:
+            agent_pool (AgentPool): The agent pool.
+        """
+
+        self.add(Gauge("cloudscraper_proxy_agents", "Agents in the pool.")).set_function(
+            lambda: len(agent_pool)
+        )
+        self.add(
+            Gauge(
+                "cloudscraper_proxy_agents_memory_bytes",
+                "Approximate memory footprint of the agent pool in bytes.",
+            )
+        ).set_function(lambda: agent_pool.stats()["memory"])
+        self.add(
+            Counter("cloudscraper_proxy_agents_created_total", "Generated agents.")
+        ).set_function(lambda: agent_pool.created)
+        self.add(
+            Counter(
+                "cloudscraper_proxy_agent_evictions_total",
+                "Agents evicted from the pool by the reason.",
+                ("reason",),
+            )
+        ).set_function(
+            lambda: {
+                (reason,): count
+                for reason, count in agent_pool.stats()["evictions"].items()
+            }
+        )
+        self.add(
+            Counter("cloudscraper_proxy_agent_leases_total", "Agent leases for requests.")
+        ).set_function(lambda: agent_pool.stats()["leases"]["acquired"])
+        self.add(
+            Counter(
+                "cloudscraper_proxy_agent_lease_contended_total",
+                "Agent leases that waited for a busy agent.",
+            )
+        ).set_function(lambda: agent_pool.stats()["leases"]["contended"])
+        self.add(
+            Counter(
+                "cloudscraper_proxy_agent_lease_timeouts_total",
+                "Requests that gave up waiting for a busy agent.",
+            )
+        ).set_function(lambda: agent_pool.stats()["leases"]["timeouts"])
+        self.add(
+            Counter(
+                "cloudscraper_proxy_agent_lease_wait_seconds_total",
+                "Seconds requests waited for busy agents.",
+            )
+        ).set_function(lambda: agent_pool.stats()["leases"]["wait_seconds"])
+        self.add(
+            Gauge(
+                "cloudscraper_proxy_agent_lease_waiting",
+                "Requests waiting for a busy agent.",
+            )
+        ).set_function(lambda: agent_pool.stats()["leases"]["waiting"])
+
+    def track_egress(self, egress_pool) -> None:
+        """Export the statistics of the outbound proxies.
+
+        Args:
+            egress_pool (EgressPool): The outbound proxy pool.
+        """
+
+        def collect(stat: str) -> Callable[[], dict[tuple, float]]:
+            return lambda: {
+                (egress["name"],): egress[stat] for egress in egress_pool.stats()
+            }
+
+        for metric, name, description, stat in [
+            (Gauge, "agents", "Agents pinned to the proxy.", "agents"),
+            (
+                Counter,
+                "requests_total",
+                "Upstream requests made through the proxy.",
+                "requests",
+            ),
+            (
+                Counter,
+                "errors_total",
+                "Upstream requests through the proxy failing to connect, timing out or getting 429.",
+                "errors",
+            ),
+            (
+                Counter,
+                "timed_requests_total",
+                "Upstream requests through the proxy without a challenge solve.",
+                "timed",
+            ),
+            (
+                Counter,
+                "request_seconds_total",
+                "Seconds of the upstream requests through the proxy without a challenge solve.",
+                "seconds",
+            ),
+            (
+                Counter,
+                "ejections_total",
+                "Times the proxy was ejected as unhealthy.",
+                "ejections",
+            ),
+            (Gauge, "ejected", "Whether the proxy is ejected.", "ejected"),
+        ]:
+            self.add(
+                metric(f"cloudscraper_proxy_egress_{name}", description, ("egress",))
+            ).set_function(collect(stat))
+
+    def track_limits(self, host_limiter) -> None:
+        """Export the queues of the destination host limits by the rule pattern.
+
+        Args:
+            host_limiter (HostLimiter): The destination host limiter.
+        """
+
+        def collect(stat: str) -> Callable[[], dict[tuple, float]]:
+            return lambda: {
+                (pattern,): totals[stat]
+                for pattern, totals in host_limiter.patterns().items()
+            }
+
+        for metric, name, description, stat in [
+            (Gauge, "queued", "Requests waiting for the host limits.", "queued"),
+            (Gauge, "active", "Upstream requests admitted by the host limits.", "active"),
+            (
+                Counter,
+                "delayed_total",
+                "Requests queued by the host limits.",
+                "delayed",
+            ),
+            (
+                Counter,
+                "wait_seconds_total",
+                "Seconds requests waited for the host limits.",
+                "wait_seconds",
+            ),
+            (
+                Counter,
+                "timeouts_total",
+                "Requests that gave up waiting for the host limits.",
+                "timeouts",
+            ),
+        ]:
+            self.add(
+                metric(f"cloudscraper_proxy_host_limit_{name}", description, ("pattern",))
+            ).set_function(collect(stat))
+
+    def track_breaker(self, circuit_breaker) -> None:
+        """Export the circuit breaker statistics.
+
+        Args:
+            circuit_breaker (CircuitBreaker): The circuit breaker.
+        """
+
+        self.add(
+            Gauge("cloudscraper_proxy_breaker_open_hosts", "Hosts with an open circuit.")
+        ).set_function(lambda: circuit_breaker.stats()["open"])
+        self.add(
+            Counter(
+                "cloudscraper_proxy_breaker_transitions_total",
+                "Circuit state changes by the new state.",
+                ("state",),
+            )
+        ).set_function(
+            lambda: {
+                (state,): count
+                for state, count in circuit_breaker.stats()["transitions"].items()
+            }
+        )
+        self.add(
+            Counter(
+                "cloudscraper_proxy_breaker_rejected_total",
+                "Requests failed right away by an open circuit.",
+            )
+        ).set_function(lambda: circuit_breaker.rejected)
+
+    def track_log(self, log_queue) -> None:
+        """Export the log queue statistics.
+
+        Args:
+            log_queue (LogQueue): The log queue.
+        """
+
+        self.add(
+            Gauge("cloudscraper_proxy_log_queued", "Log events waiting to be written.")
+        ).set_function(lambda: len(log_queue))
+        self.add(
+            Counter("cloudscraper_proxy_log_written_total", "Written log events.")
+        ).set_function(lambda: log_queue.written)
+        self.add(
+            Counter(
+                "cloudscraper_proxy_log_dropped_total",
+                "Log events dropped because the log queue was full.",
+            )
+        ).set_function(lambda: log_queue.dropped)
+
+    def add(self, metric: Metric) -> Metric:
+        """Register the metric."""
+
+        self._metrics.append(metric)
+        return metric
+
+    def host(self, host: str) -> str:
+        """Get the host label value, bounding the number of labeled hosts."""
+
+        if host in self._hosts:
+            return host
+        with self._lock:
+            if len(self._hosts) < self.max_hosts:
+                self._hosts.add(host)
+                return host
+        return OTHER_HOST
+
+    def render(self) -> str:
+        """Render all metrics in the text exposition format."""
+
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+def merge(texts: list[str]) -> str:
+    """Merge the metrics of several workers, summing the samples with the same labels.
+
+    Args:
+        texts (list[str]): The metrics in the text exposition format.
+
+    Returns:
+        str: The merged metrics in the text exposition format.
+    """
+
+    families = {}
+    for text in texts:
+        family = None
+        for line in text.splitlines():
+            if not line:
+                continue
+            if line.startswith("#"):
+                parts = line.split(" ", 3)
+                family = families.setdefault(parts[2], {"comments": [], "samples": {}})
+                if line not in family["comments"]:
+                    family["comments"].append(line)
+                continue
+            if family is None:
+                family = families.setdefault("", {"comments": [], "samples": {}})
+            sample, _, value = line.rpartition(" ")
+            value = float(value)
+            family["samples"][sample] = family["samples"].get(sample, 0) + value
+
+    lines = []
+    for family in families.values():
+        lines.extend(family["comments"])
+        lines.extend(
+            f"{sample} {format_value(value)}"
+            for sample, value in family["samples"].items()
+        )
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,253 @@
+"""Selection of the agent profiles, the proxy config entries, by their outcomes per host.
+
+An epsilon-greedy bandit: most agents get the profile scoring best on the destination
+host, a share of them a random one, so the scores keep up with changes.
+"""
+
+import json
+from collections import OrderedDict
+from random import choice, random, randrange
+from threading import Lock
+
+# Statuses telling the destination blocked the agent
+BLOCKED_STATUSES = {403, 429, 503}
+# Statistics of all hosts, scoring the profiles for hosts without their own yet
+ALL_HOSTS = "*"
+COUNTERS = ("selected", "requests", "challenges", "challenge_seconds", "blocked")
+
+
+def reward(challenge_seconds: float | None, blocked: bool, solve_seconds: float) -> float:
+    """Score the outcome of a request between 0 and 1.
+
+    Args:
+        challenge_seconds (float | None): Seconds of the challenge solve, None if the
+            request passed without a challenge.
+        blocked (bool): Whether the request failed or was blocked.
+        solve_seconds (float): Challenge solve seconds halving the score.
+    """
+
+    if blocked:
+        return 0.0
+    if challenge_seconds is None:
+        return 1.0
+    return 1 / (1 + challenge_seconds / solve_seconds)
+
+
+class ProfileStats:
+    """Outcomes of the requests made by the agents of a profile."""
+
+    def __init__(self):
+        self.selected = 0
+        self.requests = 0
+        self.challenges = 0
+        self.challenge_seconds = 0.0
+        self.blocked = 0
+        self.score = None
+
+    def observe(
+        self, challenge_seconds: float | None, blocked: bool, score: float, decay: float
+    ):
+        self.requests += 1
+        self.blocked += blocked
+        if challenge_seconds is not None:
+            self.challenges += 1
+            self.challenge_seconds += challenge_seconds
+        if self.score is None:
+            self.score = score
+        else:
+            self.score += decay * (score - self.score)
+
+    def to_dict(self) -> dict:
+        return {
+            "selected": self.selected,
+            "requests": self.requests,
+            "challenges": self.challenges,
+            "challenge_seconds": self.challenge_seconds,
+            "blocked": self.blocked,
+            "score": self.score,
+        }
+
+
+class ProfileSelector:
+    def __init__(
+        self,
+        profiles: list[dict],
+        exploration: float = 0.1,
+        decay: float = 0.1,
+        solve_seconds: float = 10,
+        max_hosts: int = 1000,
+    ):
+        """Initialize the profile selector.
+
+        Every request made by an agent of a profile scores it on the destination host:
+        1 if it passed, less the longer its challenge solve took, 0 if it failed or was
+        blocked. Profiles without outcomes on the host are scored by all the hosts,
+        untried ones score 1, so every profile gets tried.
+
+        Args:
+            profiles (list[dict]): The profiles, keyword arguments for cloudscraper.
+            exploration (float, optional): Share of the selections picking a random
+                profile.
+            decay (float, optional): Weight of the latest outcome in the scores.
+            solve_seconds (float, optional): Challenge solve seconds halving the score
+                of the request.
+            max_hosts (int, optional): Hosts the outcomes are kept for, the least
+                recently selected ones are forgotten.
+        """
+
+        self.profiles = profiles
+        self.exploration = exploration
+        self.decay = decay
+        self.solve_seconds = solve_seconds
+        self.max_hosts = max_hosts
+        self._indexes = {self.key(profile): i for i, profile in enumerate(profiles)}
+        self._hosts = OrderedDict()
+        self._all = self._new()
+        self._lock = Lock()
+
+    @staticmethod
+    def key(profile: dict) -> str:
+        return json.dumps(profile, sort_keys=True)
+
+    def index(self, profile: dict) -> int | None:
+        """Get the index of the profile, None if the agent config isn't one of them."""
+
+        return self._indexes.get(self.key(profile))
+
+    def select(self, host: str | None = None) -> dict:
+        """Select the profile for a new agent.
+
+        Args:
+            host (str | None, optional): The destination host, None if it's unknown.
+
+        Returns:
+            dict: The profile.
+        """
+
+        if len(self.profiles) < 2:
+            return self.profiles[0]
+
+        with self._lock:
+            stats = self._host(host) if host else self._all
+            if random() < self.exploration:
+                index = randrange(len(self.profiles))
+            else:
+                scores = [
+                    self._score(stats[i], self._all[i]) for i in range(len(self.profiles))
+                ]
+                best = max(scores)
+                index = choice([i for i, score in enumerate(scores) if score == best])
+            stats[index].selected += 1
+            if stats is not self._all:
+                self._all[index].selected += 1
+
+        return self.profiles[index]
+
+    def observe(
+        self,
+        host: str,
+        profile: dict,
+        challenge_seconds: float | None = None,
+        blocked: bool = False,
+    ) -> None:
+        """Score the profile by the outcome of a request made by its agent.
+
+        Args:
+            host (str): The destination host.
+            profile (dict): The config of the agent.
+            challenge_seconds (float | None, optional): Seconds of the challenge solve,
+                None if the request passed without a challenge.
+            blocked (bool, optional): Whether the request failed or was blocked.
+        """
+
+        index = self.index(profile)
+        if index is None:
+            return
+
+        score = reward(challenge_seconds, blocked, self.solve_seconds)
+        with self._lock:
+            for stats in [self._host(host), self._all]:
+                stats[index].observe(challenge_seconds, blocked, score, self.decay)
+
+    def stats(self, host: str | None = None) -> list[dict]:
+        """Get the outcomes and scores of the profiles by the host.
+
+        Args:
+            host (str | None, optional): Only the host, all hosts and their total if
+                None.
+        """
+
+        with self._lock:
+            if host is None:
+                hosts = [(ALL_HOSTS, self._all)] + list(self._hosts.items())
+            elif host in self._hosts:
+                hosts = [(host, self._hosts[host])]
+            else:
+                hosts = []
+            return [
+                {"host": name, "profile": i, "config": self.profiles[i]}
+                | profile_stats.to_dict()
+                for name, stats in hosts
+                for i, profile_stats in enumerate(stats)
+                if profile_stats.selected or profile_stats.requests
+            ]
+
+    def _new(self) -> list[ProfileStats]:
+        return [ProfileStats() for _ in self.profiles]
+
+    def _host(self, host: str) -> list[ProfileStats]:
+        stats = self._hosts.get(host)
+        if stats is None:
+            stats = self._hosts[host] = self._new()
+            while len(self._hosts) > self.max_hosts:
+                self._hosts.popitem(last=False)
+        else:
+            self._hosts.move_to_end(host)
+        return stats
+
+    @staticmethod
+    def _score(stats: ProfileStats, total: ProfileStats) -> float:
+        if stats.score is not None:
+            return stats.score
+        if total.score is not None:
+            return total.score
+        return 1.0
+
+
+def select_profile(
+    profiles: list[dict], selector: ProfileSelector | None, host: str | None = None
+) -> dict:
+    """Select the profile with the selector, or at random without one."""
+
+    if selector is None:
+        return choice(profiles)
+    return selector.select(host)
+
+
+def merge(stats: list[list[dict]]) -> list[dict]:
+    """Merge the statistics of several workers, summing them by the host and profile.
+
+    The scores are averaged weighted by the requests.
+    """
+
+    merged = {}
+    for worker in stats:
+        for entry in worker:
+            key = (entry["host"], entry["profile"])
+            total = merged.get(key)
+            if total is None:
+                merged[key] = dict(entry)
+                continue
+            requests = total["requests"] + entry["requests"]
+            if entry["score"] is not None:
+                if total["score"] is None or not requests:
+                    total["score"] = entry["score"]
+                else:
+                    total["score"] = (
+                        total["score"] * total["requests"]
+                        + entry["score"] * entry["requests"]
+                    ) / requests
+            for name in COUNTERS:
+                total[name] += entry[name]
+
+    return list(merged.values())
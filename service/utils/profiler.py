@@ -0,0 +1,196 @@
+"""In-process profilers: a stack sampler and a per-request cProfile."""
+
+import cProfile
+import gc
+import importlib
+import io
+import os
+import pstats
+import sys
+import time
+from collections import Counter, OrderedDict
+from threading import Lock
+from types import FrameType
+
+from flask import Request, Response
+
+PROFILE_HEADER = "X-Cloudscraper-Proxy-Profile"
+PROFILE_ID_HEADER = "X-Cloudscraper-Proxy-Profile-Id"
+GREENLETS_REFRESH_INTERVAL = 1
+
+
+def original(module: str, name: str):
+    """Get the standard library function as it was before gevent monkey patched it."""
+
+    try:
+        from gevent.monkey import get_original
+    except ImportError:
+        return getattr(importlib.import_module(module), name)
+    return get_original(module, name)
+
+
+def frame_label(frame: FrameType) -> str:
+    """Get the flamegraph label of the frame."""
+
+    code = frame.f_code
+    path = os.path.join(*code.co_filename.split(os.sep)[-2:])
+    return f"{code.co_name} ({path}:{code.co_firstlineno})"
+
+
+def collapse(frame: FrameType, root: str) -> str:
+    """Get the collapsed stack of the frame, the outermost frame first."""
+
+    labels = []
+    while frame is not None:
+        labels.append(frame_label(frame))
+        frame = frame.f_back
+    labels.append(root)
+    return ";".join(reversed(labels))
+
+
+def find_greenlets() -> list:
+    """Find the live greenlets."""
+
+    try:
+        from greenlet import greenlet
+    except ImportError:
+        return []
+    return [obj for obj in gc.get_objects() if isinstance(obj, greenlet)]
+
+
+class StackSampler:
+    def __init__(self, interval: float = 0.005):
+        """Initialize the stack sampler.
+
+        Args:
+            interval (float, optional): Seconds between the samples.
+        """
+
+        self.interval = interval
+        self._lock = Lock()
+
+    def profile(self, seconds: float, idle: bool = False) -> Counter | None:
+        """Sample the stacks of all the threads for the duration.
+
+        The sampling runs in a native thread, so it sees the greenlet running in every
+        thread while the worker keeps serving the requests. Waiting greenlets are only
+        sampled with idle, as finding them walks the whole heap.
+
+        Args:
+            seconds (float): Seconds to sample for.
+            idle (bool, optional): Sample the waiting greenlets too.
+
+        Returns:
+            Counter | None: Sample counts by the collapsed stacks or None if another
+                profile is running.
+        """
+
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            stacks = Counter()
+            done = []
+            original("_thread", "start_new_thread")(
+                self._sample, (stacks, seconds, idle, done)
+            )
+            # Sleep cooperatively, so the other greenlets run while being sampled
+            while not done:
+                time.sleep(min(self.interval * 10, 0.1))
+        finally:
+            self._lock.release()
+
+        return stacks
+
+    def _sample(self, stacks: Counter, seconds: float, idle: bool, done: list) -> None:
+        sleep = original("time", "sleep")
+        own_thread = original("_thread", "get_ident")()
+        greenlets = []
+        greenlets_found = 0
+        try:
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id != own_thread:
+                        stacks[collapse(frame, "running")] += 1
+                if idle:
+                    if time.monotonic() - greenlets_found > GREENLETS_REFRESH_INTERVAL:
+                        greenlets = find_greenlets()
+                        greenlets_found = time.monotonic()
+                    for greenlet in greenlets:
+                        # Running and finished greenlets have no suspended frame
+                        if greenlet.gr_frame is not None:
+                            stacks[collapse(greenlet.gr_frame, "waiting")] += 1
+                sleep(self.interval)
+        finally:
+            done.append(True)
+
+
+class RequestProfiler:
+    def __init__(self, max_profiles: int = 20, shard: int = 0, shards: int = 1):
+        """Initialize the per-request profiler.
+
+        Profile ids follow the agent ids sharding, so the profiles are owned by the
+        workers the same way the agents are.
+
+        Args:
+            max_profiles (int, optional): Number of the latest profiles kept.
+            shard (int, optional): The shard of this worker.
+            shards (int, optional): The number of shards.
+        """
+
+        self.max_profiles = max_profiles
+        self.shard = shard
+        self.shards = shards
+        self.profile_id = 0
+        self._profiles = OrderedDict()
+        self._lock = Lock()
+        self._active = Lock()
+
+    def start(self, request: Request) -> None:
+        """Profile the request if it asks for it.
+
+        One request is profiled at a time. The profiler hooks the whole thread, so the
+        other greenlets running meanwhile show up in the profile too.
+        """
+
+        if PROFILE_HEADER not in request.headers:
+            return
+        if not self._active.acquire(blocking=False):
+            return
+        request.profile = cProfile.Profile()
+        request.profile.enable()
+
+    def finish(self, request: Request, response: Response) -> None:
+        """Keep the request profile and tell its id in the response header."""
+
+        profile = self.stop(request)
+        # A forwarded request is profiled by the worker that handled it
+        if profile is None or PROFILE_ID_HEADER in response.headers:
+            return
+        stream = io.StringIO()
+        pstats.Stats(profile, stream=stream).sort_stats("cumulative").print_stats(50)
+        with self._lock:
+            profile_id = self.profile_id + 1
+            profile_id += (self.shard - profile_id) % self.shards
+            self.profile_id = profile_id
+            self._profiles[profile_id] = stream.getvalue()
+            while len(self._profiles) > self.max_profiles:
+                self._profiles.popitem(last=False)
+        response.headers[PROFILE_ID_HEADER] = str(profile_id)
+
+    def stop(self, request: Request) -> cProfile.Profile | None:
+        """Stop profiling the request."""
+
+        profile = getattr(request, "profile", None)
+        if profile is None:
+            return None
+        profile.disable()
+        request.profile = None
+        self._active.release()
+        return profile
+
+    def get(self, profile_id: int) -> str | None:
+        """Get the request profile by the id."""
+
+        with self._lock:
+            return self._profiles.get(profile_id)
@@ -0,0 +1,475 @@
+"""HTTP cache of the proxied GET responses.
+
+Freshness follows Cache-Control, Expires and Last-Modified, and stale entries are
+revalidated with conditional requests built from ETag and Last-Modified. Entries live in
+an in-memory LRU tier and the ones evicted from it are demoted to an optional disk tier.
+
+Cookies are handled explicitly:
+* requests with client credentials, i.e. Authorization or conditional headers, bypass the cache;
+* the key includes the client cookies and the destination cookies of the agent, except the
+  Cloudflare ones, so only agents with the same site session share entries;
+* responses setting cookies or marked private are never stored.
+"""
+
+import hashlib
+import os
+import pickle
+from collections import OrderedDict
+from collections.abc import Iterable
+from email.utils import parsedate_to_datetime
+from http.cookiejar import Cookie
+from threading import Lock
+from time import time
+from urllib.parse import urlparse
+
+from requests.structures import CaseInsensitiveDict
+from structlog import get_logger
+from utils.agent_pool import parent_domains
+
+CACHEABLE_STATUSES = {200, 203, 300, 301, 404, 410}
+CLOUDFLARE_COOKIES = {"cf_clearance", "__cf_bm", "__cflb", "_cfuvid"}
+BYPASS_HEADERS = ("Authorization", "If-None-Match", "If-Modified-Since", "Range")
+# Share of the Last-Modified age a response without explicit freshness stays fresh
+HEURISTIC_FRACTION = 0.1
+
+
+def parse_cache_control(value: str | None) -> dict[str, str | None]:
+    """Parse the Cache-Control header into lowercase directives and their values."""
+
+    directives = {}
+    for directive in (value or "").split(","):
+        name, _, arg = directive.strip().partition("=")
+        if name:
+            directives[name.lower()] = arg.strip('"') if arg else None
+
+    return directives
+
+
+def parse_date(value: str | None) -> float | None:
+    """Parse an HTTP date into a timestamp."""
+
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def freshness(headers: dict[str, str], now: float, max_ttl: float) -> float | None:
+    """Get the freshness lifetime of the response.
+
+    Args:
+        headers (dict[str, str]): The response headers.
+        now (float): The current timestamp.
+        max_ttl (float): Maximum freshness lifetime in seconds.
+
+    Returns:
+        float | None: Seconds the response stays fresh or None if it mustn't be stored.
+    """
+
+    headers = CaseInsensitiveDict(headers)
+    cache_control = parse_cache_control(headers.get("Cache-Control"))
+    if "no-store" in cache_control or "private" in cache_control:
+        return None
+    if "no-cache" in cache_control:
+        return 0
+
+    date = parse_date(headers.get("Date")) or now
+    age = headers.get("Age", "").strip()
+    # A malformed Age is ignored like a malformed max-age
+    age = float(age) if age.isdigit() else 0
+    ttl = None
+    for directive in ("s-maxage", "max-age"):
+        if (cache_control.get(directive) or "").isdigit():
+            ttl = float(cache_control[directive])
+            break
+    if ttl is None and "Expires" in headers:
+        expires = parse_date(headers["Expires"])
+        ttl = expires - date if expires is not None else 0
+    if ttl is None:
+        last_modified = parse_date(headers.get("Last-Modified"))
+        ttl = (date - last_modified) * HEURISTIC_FRACTION if last_modified else 0
+
+    return max(min(ttl - age, max_ttl), 0)
+
+
+class CacheEntry:
+    """A cached response."""
+
+    def __init__(
+        self,
+        status: int,
+        headers: list[tuple[str, str]],
+        body: bytes,
+        vary: dict[str, str | None],
+        ttl: float,
+    ):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.vary = vary
+        self.stored_at = time()
+        self.ttl = ttl
+        header_dict = CaseInsensitiveDict(headers)
+        self.etag = header_dict.get("ETag")
+        self.last_modified = header_dict.get("Last-Modified")
+        self.size = len(body) + sum(len(n) + len(v) for n, v in headers)
+
+    def fresh(self, now: float | None = None) -> bool:
+        return (now or time()) - self.stored_at < self.ttl
+
+    def validators(self) -> dict[str, str]:
+        """Get the conditional request headers revalidating the entry."""
+
+        validators = {}
+        if self.etag:
+            validators["If-None-Match"] = self.etag
+        if self.last_modified:
+            validators["If-Modified-Since"] = self.last_modified
+
+        return validators
+
+    def matches(self, request_headers: dict[str, str]) -> bool:
+        """Check whether the request selects the entry according to Vary."""
+
+        return all(
+            request_headers.get(name) == value for name, value in self.vary.items()
+        )
+
+
+class DiskTier:
+    def __init__(self, path: str, max_size: int):
+        """Initialize the disk tier. Files left by a previous run are removed.
+
+        Args:
+            path (str): The cache directory.
+            max_size (int): The byte budget of the cached files.
+        """
+
+        self.log = get_logger(__name__)
+        self.path = path
+        self.max_size = max_size
+        self.size = 0
+        self.evictions = 0
+        self._lock = Lock()
+        self._index = OrderedDict()
+        os.makedirs(path, exist_ok=True)
+        for name in os.listdir(path):
+            if name.endswith(".entry"):
+                os.unlink(os.path.join(path, name))
+
+    def _file(self, key: str) -> str:
+        return os.path.join(
+            self.path, hashlib.sha256(key.encode()).hexdigest() + ".entry"
+        )
+
+    def get(self, key: str) -> CacheEntry | None:
+        with self._lock:
+            if key not in self._index:
+                return None
+            self._index.move_to_end(key)
+        try:
+            with open(self._file(key), "rb") as file:
+                return pickle.load(file)
+        except (OSError, pickle.UnpicklingError) as err:
+            self.log.warning("Couldn't read the cache entry.", error=err)
+            self.pop(key)
+            return None
+
+    def put(self, key: str, entry: CacheEntry) -> None:
+        if entry.size > self.max_size:
+            return
+        data = pickle.dumps(entry, pickle.HIGHEST_PROTOCOL)
+        try:
+            with open(self._file(key), "wb") as file:
+                file.write(data)
+        except OSError as err:
+            self.log.warning("Couldn't write the cache entry.", error=err)
+            return
+        with self._lock:
+            self.size += len(data) - self._index.pop(key, 0)
+            self._index[key] = len(data)
+            evicted = []
+            while self.size > self.max_size:
+                old_key, old_size = self._index.popitem(last=False)
+                self.size -= old_size
+                self.evictions += 1
+                evicted.append(old_key)
+        for old_key in evicted:
+            self._unlink(old_key)
+
+    def pop(self, key: str) -> None:
+        with self._lock:
+            size = self._index.pop(key, None)
+            if size is None:
+                return
+            self.size -= size
+        self._unlink(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            keys = list(self._index)
+            self._index.clear()
+            self.size = 0
+        for key in keys:
+            self._unlink(key)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def _unlink(self, key: str) -> None:
+        try:
+            os.unlink(self._file(key))
+        except FileNotFoundError:
+            pass
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        max_entries: int = 10000,
+        max_memory: int = 64 * 1024 * 1024,
+        max_entry_size: int = 1024 * 1024,
+        max_ttl: float = 86400,
+        disk_path: str | None = None,
+        disk_max_size: int = 0,
+    ):
+        """Initialize the response cache.
+
+        Args:
+            max_entries (int, optional): Maximum number of entries in memory.
+            max_memory (int, optional): Byte budget of the entries in memory.
+            max_entry_size (int, optional): Larger responses aren't stored.
+            max_ttl (float, optional): Maximum freshness lifetime in seconds.
+            disk_path (str | None, optional): Directory of the disk tier. Disabled if not set.
+            disk_max_size (int, optional): Byte budget of the disk tier.
+        """
+
+        self.max_entries = max_entries
+        self.max_memory = max_memory
+        self.max_entry_size = max_entry_size
+        self.max_ttl = max_ttl
+        self.disk = None
+        if disk_path is not None and disk_max_size > 0:
+            self.disk = DiskTier(disk_path, disk_max_size)
+        self._lock = Lock()
+        self._entries = OrderedDict()
+        self._memory = 0
+        self.results = {"hit": 0, "miss": 0, "revalidated": 0, "bypass": 0}
+        self.stores = 0
+        self.evictions = 0
+
+    @staticmethod
+    def bypass(request_headers: dict[str, str]) -> bool:
+        """Check whether the request must bypass the cache."""
+
+        if any(name in request_headers for name in BYPASS_HEADERS):
+            return True
+        cache_control = parse_cache_control(request_headers.get("Cache-Control"))
+        return (
+            "no-cache" in cache_control
+            or "no-store" in cache_control
+            or request_headers.get("Pragma") == "no-cache"
+        )
+
+    @staticmethod
+    def key(
+        url: str, agent_cookies: Iterable[Cookie], client_cookies: dict[str, str]
+    ) -> str:
+        """Build the cache key from the URL and the cookies sent to the destination.
+
+        Args:
+            url (str): The destination URL.
+            agent_cookies (Iterable[Cookie]): The cookies of the agent.
+            client_cookies (dict[str, str]): The cookies proxied from the client.
+
+        Returns:
+            str: The cache key.
+        """
+
+        domains = set(parent_domains(urlparse(url).hostname or ""))
+        cookies = sorted(
+            (cookie.name, cookie.value)
+            for cookie in agent_cookies
+            if cookie.domain.lstrip(".") in domains
+            and cookie.name not in CLOUDFLARE_COOKIES
+        )
+        cookies += sorted(client_cookies.items())
+        if not cookies:
+            return url
+        digest = hashlib.sha256(repr(cookies).encode()).hexdigest()
+
+        return f"{url} {digest}"
+
+    def get(self, key: str, request_headers: dict[str, str]) -> CacheEntry | None:
+        """Get the entry, fresh or stale, promoting disk entries to memory.
+
+        Args:
+            key (str): The cache key.
+            request_headers (dict[str, str]): The request headers to match Vary against.
+
+        Returns:
+            CacheEntry | None: The entry or None if there is no matching one.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None and self.disk is not None:
+            entry = self.disk.get(key)
+            if entry is not None:
+                self.disk.pop(key)
+                self._put(key, entry)
+        if entry is None or not entry.matches(request_headers):
+            return None
+
+        return entry
+
+    def store(
+        self,
+        key: str,
+        status: int,
+        headers: dict[str, str],
+        body: bytes,
+        request_headers: dict[str, str],
+    ) -> CacheEntry | None:
+        """Store the response if it's cacheable.
+
+        Args:
+            key (str): The cache key.
+            status (int): The response status code.
+            headers (dict[str, str]): The response headers as sent to the client.
+            body (bytes): The response body as sent to the client.
+            request_headers (dict[str, str]): The request headers to record Vary values of.
+
+        Returns:
+            CacheEntry | None: The stored entry or None if the response isn't cacheable.
+        """
+
+        headers = CaseInsensitiveDict(headers)
+        if (
+            status not in CACHEABLE_STATUSES
+            or "Set-Cookie" in headers
+            or len(body) > self.max_entry_size
+        ):
+            return None
+        vary = [
+            name.strip() for name in headers.get("Vary", "").split(",") if name.strip()
+        ]
+        if "*" in vary:
+            return None
+        ttl = freshness(headers, time(), self.max_ttl)
+        if ttl is None or (
+            not ttl and "ETag" not in headers and "Last-Modified" not in headers
+        ):
+            return None
+
+        entry = CacheEntry(
+            status,
+            list(headers.items()),
+            body,
+            {name: request_headers.get(name) for name in vary},
+            ttl,
+        )
+        self._put(key, entry)
+        with self._lock:
+            self.stores += 1
+
+        return entry
+
+    def revalidate(
+        self, key: str, entry: CacheEntry, headers: dict[str, str]
+    ) -> CacheEntry:
+        """Refresh the entry after the destination confirmed it with 304 Not Modified.
+
+        Args:
+            key (str): The cache key.
+            entry (CacheEntry): The stale entry.
+            headers (dict[str, str]): The 304 response headers.
+
+        Returns:
+            CacheEntry: The refreshed entry.
+        """
+
+        headers = CaseInsensitiveDict(headers)
+        merged = CaseInsensitiveDict(entry.headers)
+        for name in ("Cache-Control", "Date", "Expires", "ETag", "Last-Modified", "Age"):
+            if name in headers:
+                merged[name] = headers[name]
+        ttl = freshness(merged, time(), self.max_ttl)
+        refreshed = CacheEntry(
+            entry.status, list(merged.items()), entry.body, entry.vary, ttl or 0
+        )
+        if ttl is None:
+            self.pop(key)
+        else:
+            self._put(key, refreshed)
+
+        return refreshed
+
+    def record(self, result: str) -> None:
+        """Count the cache result: hit, miss, revalidated or bypass."""
+
+        with self._lock:
+            self.results[result] += 1
+
+    def pop(self, key: str) -> None:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._memory -= entry.size
+        if self.disk is not None:
+            self.disk.pop(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._memory = 0
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self) -> dict:
+        """Get the cache statistics."""
+
+        with self._lock:
+            served = self.results["hit"] + self.results["revalidated"]
+            lookups = served + self.results["miss"]
+            stats = {
+                "entries": len(self._entries),
+                "memory": self._memory,
+                **self.results,
+                "hit_ratio": served / lookups if lookups else 0.0,
+                "stores": self.stores,
+                "evictions": self.evictions,
+            }
+        if self.disk is not None:
+            stats["disk"] = {
+                "entries": len(self.disk),
+                "size": self.disk.size,
+                "evictions": self.disk.evictions,
+            }
+
+        return stats
+
+    def _put(self, key: str, entry: CacheEntry) -> None:
+        """Put the entry in memory, demoting the least recently used ones to disk."""
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._memory -= old.size
+            self._entries[key] = entry
+            self._memory += entry.size
+            evicted = []
+            while len(self._entries) > 1 and (
+                len(self._entries) > self.max_entries or self._memory > self.max_memory
+            ):
+                old_key, old = self._entries.popitem(last=False)
+                self._memory -= old.size
+                self.evictions += 1
+                evicted.append((old_key, old))
+        if self.disk is not None:
+            for old_key, old in evicted:
+                self.disk.put(old_key, old)
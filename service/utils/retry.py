@@ -0,0 +1,89 @@
+"""Timeouts and retries of the upstream requests."""
+
+from random import uniform
+from time import monotonic
+
+import requests
+
+# Header a client tightens the upstream deadline of its request with, in seconds
+TIMEOUT_HEADER = "X-Cloudscraper-Proxy-Timeout"
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+# Statuses telling the origin behind the CDN is down or unreachable
+FAILED_STATUSES = {502, 504}
+FAILED_ERRORS = (requests.ConnectionError, requests.Timeout)
+
+
+class DeadlineExceeded(Exception):
+    """The upstream deadline of the request passed."""
+
+
+def deadline(seconds: float, header: str | None = None) -> float | None:
+    """Get the monotonic time the upstream requests have to finish by.
+
+    Args:
+        seconds (float): The configured deadline in seconds, 0 is none.
+        header (str | None, optional): The timeout header of the request, it can only
+            tighten the deadline.
+
+    Raises:
+        ValueError: The header isn't a positive number.
+
+    Returns:
+        float | None: The deadline or None without one.
+    """
+
+    if header is not None:
+        try:
+            timeout = float(header)
+        except ValueError:
+            timeout = 0
+        if not timeout > 0:
+            raise ValueError(f"Invalid timeout: {header}.")
+        seconds = min(seconds, timeout) if seconds else timeout
+    return monotonic() + seconds if seconds else None
+
+
+def timeouts(
+    connect: float, read: float, deadline: float | None
+) -> tuple[float | None, float | None]:
+    """Get the connect and read timeouts of an attempt, capped by the time left.
+
+    Args:
+        connect (float): The connect timeout in seconds, 0 is none.
+        read (float): The read timeout in seconds, 0 is none.
+        deadline (float | None): The monotonic deadline.
+
+    Raises:
+        DeadlineExceeded: No time is left.
+
+    Returns:
+        tuple[float | None, float | None]: The timeouts for requests.
+    """
+
+    if deadline is None:
+        return connect or None, read or None
+    remaining = deadline - monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded("The upstream deadline passed.")
+    return min(connect or remaining, remaining), min(read or remaining, remaining)
+
+
+def retryable(method: str, error: Exception | None) -> bool:
+    """Check whether the failed request may be sent again.
+
+    Only the idempotent requests are, but for the ones that never reached the origin.
+    """
+
+    return method in IDEMPOTENT_METHODS or isinstance(error, requests.ConnectTimeout)
+
+
+def backoff(attempt: int, base: float, cap: float) -> float:
+    """Get the seconds to wait before the retry, exponential with full jitter.
+
+    Args:
+        attempt (int): The number of the failed attempt, from 0.
+        base (float): The seconds of the first backoff.
+        cap (float): The maximum seconds.
+    """
+
+    return uniform(0, min(cap, base * 2**attempt))
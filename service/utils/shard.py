@@ -0,0 +1,200 @@
+"""Agent sharding across gunicorn workers.
+
+Agent ids encode the shard of the worker owning the agent: agent_id % shards == shard.
+Requests for agents owned by another worker are forwarded to it over a unix socket.
+"""
+
+import os
+import socket
+from collections.abc import Iterator
+from http.client import HTTPConnection, HTTPResponse
+
+from flask import Flask, Request, Response
+from flask_smorest import abort
+from structlog import get_logger
+
+FORWARDED_HEADER = "X-Cloudscraper-Proxy-Shard"
+HOP_BY_HOP_HEADERS = {"Connection", "Keep-Alive", "Transfer-Encoding"}
+
+
+class UnixHTTPConnection(HTTPConnection):
+    """HTTP connection over a unix socket."""
+
+    def __init__(self, path: str, timeout: float | None = None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class ShardRouter:
+    def __init__(
+        self, shard: int, shards: int, socket_dir: str, timeout: float | None = 300
+    ):
+        """Initialize the shard router.
+
+        Args:
+            shard (int): The shard of this worker.
+            shards (int): The number of shards, i.e. gunicorn workers.
+            socket_dir (str): The directory of the shard unix sockets.
+            timeout (float | None, optional): Timeout of the forwarded requests in seconds.
+        """
+
+        self.log = get_logger(__name__)
+        self.shard = shard
+        self.shards = shards
+        self.socket_dir = socket_dir
+        self.timeout = timeout
+        self._server = None
+
+    def owner(self, agent_id: int) -> int:
+        """Get the shard owning the agent."""
+
+        return agent_id % self.shards
+
+    def is_local(self, agent_id: int) -> bool:
+        """Check whether the agent is owned by this worker."""
+
+        return self.owner(agent_id) == self.shard
+
+    def socket_path(self, shard: int) -> str:
+        """Get the unix socket path of the shard."""
+
+        return os.path.join(self.socket_dir, f"shard-{shard}.sock")
+
+    def forward(
+        self, shard: int, method: str, path: str, headers: dict[str, str], body: bytes
+    ) -> HTTPResponse:
+        """Forward the request to the shard.
+
+        Args:
+            shard (int): The target shard.
+            method (str): The HTTP method.
+            path (str): The path with the query string.
+            headers (dict[str, str]): The request headers.
+            body (bytes): The request body.
+
+        Returns:
+            HTTPResponse: The shard response. The caller is responsible for reading it.
+        """
+
+        connection = UnixHTTPConnection(self.socket_path(shard), self.timeout)
+        headers = {
+            name: value
+            for name, value in headers.items()
+            if name not in HOP_BY_HOP_HEADERS and name != "Content-Length"
+        }
+        headers[FORWARDED_HEADER] = str(self.shard)
+        connection.request(method, path, body=body or None, headers=headers)
+
+        return connection.getresponse()
+
+    def forward_request(self, request: Request, agent_id: int | None) -> Response | None:
+        """Forward the Flask request to the worker owning the agent.
+
+        Args:
+            request (Request): The Flask request.
+            agent_id (int | None): The requested agent id.
+
+        Returns:
+            Response | None: The owner's response or None if the request should be handled locally.
+        """
+
+        if agent_id is None or self.is_local(agent_id) or is_forwarded(request):
+            return None
+
+        shard = self.owner(agent_id)
+        try:
+            response = self.forward(
+                shard,
+                request.method,
+                request.full_path if request.query_string else request.path,
+                dict(request.headers),
+                request.get_data(),
+            )
+        except OSError as err:
+            self.log.error("Couldn't reach the shard.", shard=shard, error=err)
+            return abort(503, message="The worker owning the agent is unavailable.")
+        headers = [
+            (name, value)
+            for name, value in response.getheaders()
+            if name not in HOP_BY_HOP_HEADERS
+        ]
+
+        return Response(iter_response(response), response.status, headers)
+
+    def broadcast(
+        self, method: str, path: str, headers: dict[str, str]
+    ) -> list[tuple[int, bytes]]:
+        """Send the request to all the other shards.
+
+        Args:
+            method (str): The HTTP method.
+            path (str): The path with the query string.
+            headers (dict[str, str]): The request headers.
+
+        Returns:
+            list[tuple[int, bytes]]: Status codes and bodies of the reachable shards.
+        """
+
+        responses = []
+        for shard in range(self.shards):
+            if shard == self.shard:
+                continue
+            try:
+                response = self.forward(shard, method, path, headers, b"")
+                responses.append((response.status, response.read()))
+                response.close()
+            except OSError as err:
+                self.log.error("Couldn't reach the shard.", shard=shard, error=err)
+
+        return responses
+
+    def serve(self, app: Flask) -> None:
+        """Serve the application on the shard unix socket for the other workers.
+
+        Requires gevent, as gunicorn runs the gevent workers.
+
+        Args:
+            app (Flask): The application.
+        """
+
+        from gevent.pywsgi import WSGIServer
+
+        os.makedirs(self.socket_dir, exist_ok=True)
+        path = self.socket_path(self.shard)
+        if os.path.exists(path):
+            os.unlink(path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(path)
+        listener.listen(128)
+        self._server = WSGIServer(listener, app, log=None)
+        self._server.start()
+        self.log.info("Serving the shard socket.", shard=self.shard, path=path)
+
+    def stop(self) -> None:
+        """Stop serving the shard unix socket."""
+
+        if self._server is not None:
+            self._server.stop()
+            self._server = None
+
+
+def is_forwarded(request: Request) -> bool:
+    """Check whether the request was forwarded by another worker."""
+
+    return FORWARDED_HEADER in request.headers
+
+
+def iter_response(response: HTTPResponse, chunk_size: int = 65536) -> Iterator[bytes]:
+    """Iterate over the response body, closing the response at the end."""
+
+    try:
+        while chunk := response.read(chunk_size):
+            yield chunk
+    finally:
+        response.close()
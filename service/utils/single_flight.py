@@ -0,0 +1,135 @@
+"""Single-flight coalescing of concurrent calls.
+
+Threading primitives are used, so it works for gevent greenlets once gevent has
+monkey patched the standard library.
+"""
+
+from collections import deque
+from collections.abc import Callable, Hashable
+from threading import Event, Lock
+from time import monotonic
+from typing import Any
+
+from structlog import get_logger
+
+
+class Flight:
+    """An in-flight call."""
+
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+        self.expires = None
+
+
+class SingleFlight:
+    def __init__(self, name: str = "single-flight", window: float = 0):
+        """Initialize the single-flight group.
+
+        Args:
+            name (str, optional): The group name used in logs.
+            window (float, optional): Seconds the result of a successful call is also
+                shared with the calls made after it completed.
+        """
+
+        self.log = get_logger(__name__)
+        self.name = name
+        self.window = window
+        self._lock = Lock()
+        self._flights = {}
+        self._expiring = deque()
+        self.flights = 0
+        self.coalesced = 0
+
+    def do(self, key: Hashable, fn: Callable, *args, **kwargs) -> tuple[Any, bool]:
+        """Run the call unless the same key is already in flight, then wait for its result.
+
+        Args:
+            key (Hashable): The key calls are coalesced by.
+            fn (Callable): The function to call.
+            *args: Positional arguments for the function.
+            **kwargs: Keyword arguments for the function.
+
+        Raises:
+            Exception: The exception raised by the function, re-raised for all waiters.
+
+        Returns:
+            tuple(Any, bool): The result and whether it was shared by another caller.
+        """
+
+        with self._lock:
+            self._expire()
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = Flight()
+                leader = True
+            else:
+                flight.waiters += 1
+                if flight.done.is_set():
+                    self.coalesced += 1
+                leader = False
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+        succeeded = False
+        try:
+            flight.result = fn(*args, **kwargs)
+            succeeded = True
+        except Exception as err:
+            flight.error = err
+            raise
+        finally:
+            with self._lock:
+                if self.window and succeeded:
+                    flight.expires = monotonic() + self.window
+                    self._expiring.append((flight.expires, key))
+                else:
+                    del self._flights[key]
+                self.flights += 1
+                self.coalesced += flight.waiters
+            flight.done.set()
+            if flight.waiters:
+                self.log.info(
+                    "Coalesced concurrent calls.",
+                    group=self.name,
+                    key=key,
+                    waiters=flight.waiters,
+                )
+
+        return flight.result, False
+
+    def in_flight(self) -> int:
+        """Get the number of keys currently in flight."""
+
+        return len(self._flights) - len(self._expiring)
+
+    def stats(self) -> dict:
+        """Get the coalescing statistics."""
+
+        with self._lock:
+            self._expire()
+            return {
+                "in_flight": len(self._flights) - len(self._expiring),
+                "flights": self.flights,
+                "coalesced": self.coalesced,
+            }
+
+    def _expire(self) -> None:
+        """Drop the completed flights whose window has passed. Must be called under the lock."""
+
+        now = monotonic()
+        while self._expiring and self._expiring[0][0] <= now:
+            _, key = self._expiring.popleft()
+            flight = self._flights.get(key)
+            if (
+                flight is not None
+                and flight.expires is not None
+                and flight.expires <= now
+            ):
+                del self._flights[key]
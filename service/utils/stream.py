@@ -0,0 +1,276 @@
+"""Content encoding negotiation and incremental decoding of upstream response bodies."""
+
+import zlib
+from collections.abc import Iterable, Iterator
+
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+GZIP_MAGIC = b"\x1f\x8b"
+DECODE_BUFFER_SIZE = 1024 * 1024
+
+
+class GzipDecoder:
+    """Incremental gzip decoder with a bounded output buffer."""
+
+    def __init__(self, buffer_size: int):
+        """Initialize the decoder.
+
+        Args:
+            buffer_size (int): The maximum size of a single decoded chunk.
+        """
+
+        self.buffer_size = buffer_size
+        self._decompressor = None
+        self._passthrough = False
+        # The first bytes until there are enough to check the magic numbers
+        self._head = b""
+
+    def decode(self, data: bytes) -> Iterator[bytes]:
+        """Decode a chunk of the compressed body.
+
+        Args:
+            data (bytes): The compressed chunk.
+
+        Yields:
+            bytes: Decoded chunks, each no larger than buffer_size.
+        """
+
+        if self._passthrough:
+            yield data
+            return
+        if self._decompressor is None:
+            self._head += data
+            if len(self._head) < len(GZIP_MAGIC):
+                return
+            data, self._head = self._head, b""
+            # Check for gzip magic numbers, pass the body through if it isn't gzipped
+            if data[:2] != GZIP_MAGIC:
+                self._passthrough = True
+                yield data
+                return
+            self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+        while data:
+            chunk = self._decompressor.decompress(data, self.buffer_size)
+            if chunk:
+                yield chunk
+            data = self._decompressor.unconsumed_tail
+            if not data and self._decompressor.eof and self._decompressor.unused_data:
+                # The body has several gzip members, decode the next one
+                data = self._decompressor.unused_data
+                self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def flush(self) -> Iterator[bytes]:
+        """Flush the remaining decoded data.
+
+        Yields:
+            bytes: The remaining decoded chunk if any.
+        """
+
+        if self._head:
+            # Too short to be gzipped
+            yield self._head
+            self._head = b""
+        if self._decompressor is not None:
+            chunk = self._decompressor.flush()
+            if chunk:
+                yield chunk
+
+
+class DeflateDecoder:
+    """Incremental deflate decoder with a bounded output buffer.
+
+    Accepts both zlib wrapped and raw deflate streams, as servers send either.
+    """
+
+    def __init__(self, buffer_size: int):
+        self.buffer_size = buffer_size
+        self._decompressor = None
+
+    def decode(self, data: bytes) -> Iterator[bytes]:
+        if self._decompressor is None:
+            if not data:
+                # The stream kind is told by its first byte
+                return
+            # A zlib stream starts with the deflate method in the low bits
+            wbits = zlib.MAX_WBITS if data[0] & 0x0F == 8 else -zlib.MAX_WBITS
+            self._decompressor = zlib.decompressobj(wbits)
+
+        while data:
+            chunk = self._decompressor.decompress(data, self.buffer_size)
+            if chunk:
+                yield chunk
+            data = self._decompressor.unconsumed_tail
+
+    def flush(self) -> Iterator[bytes]:
+        if self._decompressor is not None:
+            chunk = self._decompressor.flush()
+            if chunk:
+                yield chunk
+
+
+class BrotliDecoder:
+    """Incremental brotli decoder. The output of a chunk isn't bounded."""
+
+    def __init__(self, buffer_size: int):
+        self._decompressor = brotli.Decompressor()
+        # brotlicffi names it decompress, brotli process
+        self._decompress = getattr(self._decompressor, "process", None) or getattr(
+            self._decompressor, "decompress"
+        )
+
+    def decode(self, data: bytes) -> Iterator[bytes]:
+        chunk = self._decompress(data)
+        if chunk:
+            yield chunk
+
+    def flush(self) -> Iterator[bytes]:
+        return iter(())
+
+
+class ZstdDecoder:
+    """Incremental zstd decoder, handling concatenated frames. The output of a chunk
+    isn't bounded."""
+
+    def __init__(self, buffer_size: int):
+        self._decompressor = zstandard.ZstdDecompressor().decompressobj()
+
+    def decode(self, data: bytes) -> Iterator[bytes]:
+        while data:
+            chunk = self._decompressor.decompress(data)
+            if chunk:
+                yield chunk
+            data = b""
+            if self._decompressor.eof and self._decompressor.unused_data:
+                data = self._decompressor.unused_data
+                self._decompressor = zstandard.ZstdDecompressor().decompressobj()
+
+    def flush(self) -> Iterator[bytes]:
+        return iter(())
+
+
+DECODERS = {"gzip": GzipDecoder, "x-gzip": GzipDecoder, "deflate": DeflateDecoder}
+if brotli is not None:
+    DECODERS["br"] = BrotliDecoder
+if zstandard is not None:
+    DECODERS["zstd"] = ZstdDecoder
+
+
+def content_codings(content_encoding: str | None) -> list[str]:
+    """Get the codings of the Content-Encoding header in the order they were applied."""
+
+    if not content_encoding:
+        return []
+    codings = [coding.strip().lower() for coding in content_encoding.split(",")]
+    return [coding for coding in codings if coding and coding != "identity"]
+
+
+def is_decodable(content_encoding: str | None) -> bool:
+    """Check whether the body has a content encoding and it can be decoded incrementally."""
+
+    codings = content_codings(content_encoding)
+    return bool(codings) and all(coding in DECODERS for coding in codings)
+
+
+def accepts(accept_encoding: str | None, content_encoding: str | None) -> bool:
+    """Check whether the client accepts the body as it's encoded.
+
+    A client not sending Accept-Encoding is only sent unencoded bodies, as most of
+    them don't decode anything unless asked to.
+
+    Args:
+        accept_encoding (str | None): The client Accept-Encoding header value.
+        content_encoding (str | None): The upstream Content-Encoding header value.
+    """
+
+    codings = content_codings(content_encoding)
+    if not codings:
+        return True
+    if not accept_encoding:
+        return False
+
+    weights = {}
+    for entry in accept_encoding.split(","):
+        coding, _, params = entry.partition(";")
+        weight = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[coding.strip().lower()] = weight
+
+    return all(weights.get(coding, weights.get("*", 0)) > 0 for coding in codings)
+
+
+def negotiate(accept_encoding: str | None, zstd: bool = False) -> str:
+    """Get the Accept-Encoding to send upstream for the agent.
+
+    Keeps the codings of the agent's browser profile the service can decode, so the
+    body can always be decoded for clients that don't accept it. br is only there
+    when the agent allows it.
+
+    Args:
+        accept_encoding (str | None): The agent Accept-Encoding header value.
+        zstd (bool, optional): Add zstd for the agents allowing br.
+    """
+
+    codings = [
+        coding.strip()
+        for coding in (accept_encoding or "").split(",")
+        if coding.partition(";")[0].strip().lower() in DECODERS
+    ]
+    names = {coding.partition(";")[0].strip().lower() for coding in codings}
+    if zstd and "br" in names and "zstd" in DECODERS and "zstd" not in names:
+        codings.append("zstd")
+
+    return ", ".join(codings) or "identity"
+
+
+def iter_decoded(
+    chunks: Iterable[bytes], content_encoding: str | None, buffer_size: int
+) -> Iterator[bytes]:
+    """Decode the raw upstream body chunk by chunk.
+
+    Args:
+        chunks (Iterable[bytes]): Raw upstream body chunks.
+        content_encoding (str | None): The upstream Content-Encoding header value.
+        buffer_size (int): The maximum size of a single decoded chunk.
+
+    Yields:
+        bytes: Decoded body chunks. Chunks are passed through as they are
+            if the content encoding isn't supported.
+    """
+
+    if not is_decodable(content_encoding):
+        yield from chunks
+        return
+
+    # The last applied coding is decoded first
+    for coding in reversed(content_codings(content_encoding)):
+        chunks = decode_chunks(chunks, DECODERS[coding](buffer_size))
+    yield from chunks
+
+
+def decode_chunks(chunks: Iterable[bytes], decoder) -> Iterator[bytes]:
+    for chunk in chunks:
+        yield from decoder.decode(chunk)
+    yield from decoder.flush()
+
+
+def decode(content: bytes, content_encoding: str | None) -> bytes:
+    """Decode the whole body, returning it as it is if the encoding isn't supported."""
+
+    return b"".join(iter_decoded([content], content_encoding, DECODE_BUFFER_SIZE))